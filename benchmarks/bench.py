@@ -0,0 +1,192 @@
+"""
+Benchmarks for `fit`, `post_mean`, `post_var`, `post_cubature_var`, `get_x_next` and `add_y_next`
+across `FastGPLattice`, `FastGPDigitalNetB2` and `StandardGP`.
+
+Run the default sweep and write results to a JSON file
+
+    python benchmarks/bench.py run --out benchmarks/results/HEAD.json
+
+benchmark another commit through a temporary git worktree
+
+    python benchmarks/bench.py run --rev main --out benchmarks/results/main.json
+
+and flag regressions between two result files
+
+    python benchmarks/bench.py compare benchmarks/results/main.json benchmarks/results/HEAD.json --threshold 0.2
+
+Every case runs in a fresh process so the recorded peak resident set size belongs to that case alone.
+"""
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+MODELS = ["FastGPLattice","FastGPDigitalNetB2","StandardGP"]
+OPS = ["get_x_next","add_y_next","fit_per_iteration","fit_to_convergence","post_mean","post_var","post_cubature_var"]
+
+def _peak_rss_mb():
+    import resource
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss/2**20 if sys.platform=="darwin" else maxrss/2**10
+
+def _best_time(fn, repeats):
+    best = float("inf")
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best,time.perf_counter()-t0)
+    return best
+
+def _run_case(case, path, options):
+    if path is not None: sys.path.insert(0,path)
+    import torch
+    import fastgps
+    torch.set_default_dtype(torch.float64)
+    torch.manual_seed(7)
+    model,m,d,num_tasks,shape_batch,derivatives = case["model"],case["m"],case["d"],case["num_tasks"],case["shape_batch"],case["derivatives"]
+    kwargs = {"seed_for_seq":7,"shape_batch":torch.Size(shape_batch)}
+    if derivatives:
+        kwargs["derivatives"] = [torch.zeros(d,dtype=int)]+[ej for ej in torch.eye(d,dtype=int)]
+        kwargs["alpha"] = {"FastGPLattice":2,"FastGPDigitalNetB2":4}.get(model)
+    if num_tasks>1: kwargs["num_tasks"] = num_tasks
+    kwargs = {k:v for k,v in kwargs.items() if v is not None}
+    gp = getattr(fastgps,model)(d,**kwargs)
+    batch_weights = torch.arange(1,torch.Size(shape_batch).numel()+1).reshape(shape_batch)[...,None] if len(shape_batch)>0 else 1.
+    def f(x, task):
+        # f(x) = sin(x_1+...+x_d) for task 0, its partial derivatives for derivative tasks, and shifted copies for other tasks
+        if derivatives and task>0: return batch_weights*torch.cos(x.sum(-1))
+        return batch_weights*torch.sin(x.sum(-1)+task)
+    n = 2**m
+    times = {}
+    # load the first half, then time growing to n
+    x_half = gp.get_x_next([n//2]*gp.num_tasks)
+    x_half = x_half if isinstance(x_half,list) else [x_half]
+    gp.add_y_next([f(x_half[l],l) for l in range(gp.num_tasks)])
+    t0 = time.perf_counter()
+    x_next = gp.get_x_next([n]*gp.num_tasks)
+    times["get_x_next"] = time.perf_counter()-t0
+    x_next = x_next if isinstance(x_next,list) else [x_next]
+    y_next = [f(x_next[l],l) for l in range(gp.num_tasks)]
+    t0 = time.perf_counter()
+    gp.add_y_next(y_next)
+    times["add_y_next"] = time.perf_counter()-t0
+    iterations = options["fit_iterations"]
+    t0 = time.perf_counter()
+    data = gp.fit(iterations=iterations,stop_crit_wait_iterations=iterations+1,verbose=0)
+    times["fit_per_iteration"] = (time.perf_counter()-t0)/max(data["iterations"],1)
+    t0 = time.perf_counter()
+    data = gp.fit(iterations=options["fit_max_iterations"],verbose=0)
+    times["fit_to_convergence"] = time.perf_counter()-t0
+    xtest = torch.rand((options["n_test"],d))
+    times["post_mean"] = _best_time(lambda: gp.post_mean(xtest),options["repeats"])
+    times["post_var"] = _best_time(lambda: gp.post_var(xtest),options["repeats"])
+    times["post_cubature_var"] = _best_time(lambda: gp.post_cubature_var(),options["repeats"])
+    return {"case":case,"n":n,"times":times,"fit_iterations_to_convergence":data["iterations"],"peak_rss_mb":_peak_rss_mb()}
+
+def _run_case_safe(args):
+    case,path,options = args
+    try:
+        return _run_case(case,path,options)
+    except Exception as e:
+        return {"case":case,"n":2**case["m"],"error":"%s: %s"%(type(e).__name__,e),"peak_rss_mb":_peak_rss_mb()}
+
+def _cases(args):
+    for model,m,d,num_tasks,shape_batch,derivatives in itertools.product(args.models,args.m,args.d,args.num_tasks,args.shape_batch,args.derivatives):
+        if model=="StandardGP" and m>args.standard_m_max: continue
+        if derivatives and num_tasks!=1: continue
+        yield {"model":model,"m":m,"d":d,"num_tasks":d+1 if derivatives else num_tasks,"shape_batch":shape_batch,"derivatives":derivatives}
+
+def _git(*args, cwd=None):
+    return subprocess.run(["git"]+list(args),cwd=cwd,check=True,capture_output=True,text=True).stdout.strip()
+
+def run(args):
+    repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    worktree = None
+    if args.rev is not None:
+        worktree = tempfile.mkdtemp(prefix="fastgps_bench_")
+        _git("worktree","add","--detach",worktree,args.rev,cwd=repo)
+    path = worktree if worktree is not None else repo
+    options = {"fit_iterations":args.fit_iterations,"fit_max_iterations":args.fit_max_iterations,"n_test":args.n_test,"repeats":args.repeats}
+    results = []
+    try:
+        ctx = multiprocessing.get_context("spawn")
+        for case in _cases(args):
+            with ctx.Pool(1) as pool:
+                result = pool.apply(_run_case_safe,((case,path,options),))
+            results.append(result)
+            status = result["error"] if "error" in result else " ".join("%s=%.2e"%(op,t) for op,t in result["times"].items())
+            print("%-20s m=%-2d d=%-2d tasks=%-2d batch=%-8s deriv=%d rss=%.0fMB %s"%(case["model"],case["m"],case["d"],case["num_tasks"],case["shape_batch"],case["derivatives"],result["peak_rss_mb"],status),flush=True)
+        meta = {
+            "commit": _git("rev-parse","HEAD",cwd=path),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "options": options}
+    finally:
+        if worktree is not None: _git("worktree","remove","--force",worktree,cwd=repo)
+    if args.out is not None:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)),exist_ok=True)
+        with open(args.out,"w") as f: json.dump({"meta":meta,"results":results},f,indent=1)
+
+def _key(case):
+    return (case["model"],case["m"],case["d"],case["num_tasks"],tuple(case["shape_batch"]),case["derivatives"])
+
+def compare(args):
+    with open(args.base) as f: base = json.load(f)
+    with open(args.new) as f: new = json.load(f)
+    base_results = {_key(r["case"]):r for r in base["results"] if "error" not in r}
+    print("base %s\nnew  %s"%(base["meta"]["commit"],new["meta"]["commit"]))
+    regressions = 0
+    for r in new["results"]:
+        b = base_results.get(_key(r["case"]))
+        if b is None or "error" in r: continue
+        for op in OPS:
+            if op not in r["times"] or op not in b["times"] or b["times"][op]<args.min_time: continue
+            ratio = r["times"][op]/b["times"][op]
+            flag = ratio>1+args.threshold
+            regressions += flag
+            if flag or args.verbose:
+                print("%s %-20s m=%-2d d=%-2d tasks=%-2d batch=%-8s deriv=%d %-20s %.2e -> %.2e (x%.2f)"%("REGRESSION" if flag else "          ",*_key(r["case"])[:4],r["case"]["shape_batch"],r["case"]["derivatives"],op,b["times"][op],r["times"][op],ratio))
+        if r["peak_rss_mb"]>(1+args.threshold)*b["peak_rss_mb"]:
+            regressions += 1
+            print("REGRESSION %-20s m=%-2d d=%-2d tasks=%-2d peak_rss_mb %.0f -> %.0f"%(*_key(r["case"])[:4],b["peak_rss_mb"],r["peak_rss_mb"]))
+    print("%d regressions"%regressions)
+    return 1 if regressions>0 else 0
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command",required=True)
+    prun = subparsers.add_parser("run",help="run the benchmark sweep")
+    prun.add_argument("--out",type=str,default=None,help="JSON file to write")
+    prun.add_argument("--rev",type=str,default=None,help="git revision to benchmark in a temporary worktree, defaults to the working tree")
+    prun.add_argument("--models",nargs="+",default=MODELS,choices=MODELS)
+    prun.add_argument("--m",nargs="+",type=int,default=[8,10,12,14,16],help="log2 of the number of points per task, up to 22")
+    prun.add_argument("--standard-m-max",type=int,default=12,help="largest m for StandardGP whose cost grows cubically")
+    prun.add_argument("--d",nargs="+",type=int,default=[2,8])
+    prun.add_argument("--num-tasks",nargs="+",type=int,default=[1,2])
+    prun.add_argument("--shape-batch",nargs="+",type=lambda s: [int(v) for v in s.split(",") if v],default=[[],[4]],help="comma separated batch shapes, use '' for no batch")
+    prun.add_argument("--derivatives",nargs="+",type=int,default=[0,1],choices=[0,1],help="1 adds gradient tasks for every dimension")
+    prun.add_argument("--fit-iterations",type=int,default=10)
+    prun.add_argument("--fit-max-iterations",type=int,default=500)
+    prun.add_argument("--n-test",type=int,default=1024)
+    prun.add_argument("--repeats",type=int,default=3)
+    pcompare = subparsers.add_parser("compare",help="flag regressions between two result files")
+    pcompare.add_argument("base",type=str)
+    pcompare.add_argument("new",type=str)
+    pcompare.add_argument("--threshold",type=float,default=0.2,help="relative slowdown or peak RSS growth flagged as a regression")
+    pcompare.add_argument("--min-time",type=float,default=1e-4,help="ignore timings below this many seconds in the base results")
+    pcompare.add_argument("--verbose",action="store_true")
+    args = parser.parse_args()
+    if args.command=="run":
+        run(args)
+    else:
+        sys.exit(compare(args))
+
+if __name__=="__main__":
+    main()
@@ -3,3 +3,9 @@ __version__ = "0.0.4.1a"
 from .fast_gp_lattice import FastGPLattice
 from .fast_gp_digital_net_b2 import FastGPDigitalNetB2
 from .standard_gp import StandardGP
+from .interpolated_gp_lattice import InterpolatedGPLattice
+from .frozen_gp import FrozenGP
+from .prediction_server import PredictionServer
+from .profiler import Profiler
+from .shared_cache import SharedCache
+from .fit_many import fit_many
@@ -2,17 +2,25 @@ from .util import (
     _FastInverseLogDetCache,
     _K1PartsSeq,
     _LamCaches,
-    _YtildeCache)
+    _YtildeCache,
+    _CoeffsTildeCache,
+    _DesignStream)
 import torch
 import numpy as np
+import os
+import time
+import concurrent.futures
 from typing import Union,List
 from .abstract_gp import AbstractGP
+from .profiler import _profiled
+from .shared_cache import _attach_active
 
 class AbstractFastGP(AbstractGP):
     def __init__(self,
             alpha,
             ft,
             ift,
+            k1parts_storage,
             *args,
             **kwargs
         ):
@@ -26,9 +34,22 @@ class AbstractFastGP(AbstractGP):
         self.ft_unstable = ft
         self.ift_unstable = ift
         # storage and dynamic caches
-        self.k1parts_seq = np.array([[_K1PartsSeq(self,self.xxb_seqs[l0],self.xxb_seqs[l1],self.derivatives[l0],self.derivatives[l1]) if l1>=l0 else None for l1 in range(self.num_tasks)] for l0 in range(self.num_tasks)],dtype=object)
+        assert k1parts_storage in ["full","float32","recompute"], "k1parts_storage must be in ['full','float32','recompute']"
+        self.k1parts_storage = k1parts_storage
+        for l in range(self.num_tasks): self.xxb_seqs[l].store_x = k1parts_storage!="recompute"
+        self.k1parts_seq = np.array([[_K1PartsSeq(self,self.xxb_seqs[l0],self.xxb_seqs[l1],self.derivatives[l0],self.derivatives[l1],k1parts_storage) if l1>=l0 else None for l1 in range(self.num_tasks)] for l0 in range(self.num_tasks)],dtype=object)
         self.lam_caches = np.array([[_LamCaches(self,l0,l1,self.derivatives[l0],self.derivatives[l1],self.derivatives_coeffs[l0],self.derivatives_coeffs[l1]) if l1>=l0 else None for l1 in range(self.num_tasks)] for l0 in range(self.num_tasks)],dtype=object)
         self.ytilde_cache = np.array([_YtildeCache(self,i) for i in range(self.num_tasks)],dtype=object)
+        self.coeffs_tilde_cache = _CoeffsTildeCache(self)
+        # randomized replications share the kernel, so only the first replication is stored and the rest are shifts of it 
+        self.replications = self.seqs[0].replications
+        if self.replications>1:
+            assert self.num_tasks==1, "replications are only supported for single task problems"
+            assert self._shared_hyperparameters(), "replications require hyperparameters shared across the batch"
+            self.replication_shifts = self._replication_shifts(self.seqs[0])
+            self.shape_batch = self.shape_batch+torch.Size([self.replications])
+            self.ndim_batch = len(self.shape_batch)
+        _attach_active(self)
     def get_x_next(self, n:Union[int,torch.Tensor], task:Union[int,torch.Tensor]=None):
         n_og = n 
         if isinstance(n,(int,np.int64)): n = torch.tensor([n],dtype=int,device=self.device) 
@@ -50,18 +71,204 @@ class AbstractFastGP(AbstractGP):
         if isinstance(n,int): n = torch.tensor([n],dtype=int,device=self.device)
         assert isinstance(n,torch.Tensor) and (n&(n-1)==0).all() and (n>=self.n).all(), "require n are all power of two"
         return super().post_cov(x0=x0,x1=x1,task0=task0,task1=task1,n=n_og,eval=eval)
+    def post(self, x:torch.Tensor, task:Union[int,torch.Tensor]=None, n:Union[int,torch.Tensor]=None, want:Union[str,tuple]=("mean","var"), confidence:float=0.99, eval:bool=True):
+        n_og = n 
+        if n is None: n = self.n
+        if isinstance(n,int): n = torch.tensor([n],dtype=int,device=self.device)
+        assert isinstance(n,torch.Tensor) and (n&(n-1)==0).all() and (n>=self.n).all(), "require n are all power of two greater than or equal to self.n"
+        return super().post(x=x,task=task,n=n_og,want=want,confidence=confidence,eval=eval)
+    def post_mean_grid(self, n:int, shift:torch.Tensor=None, task:Union[int,torch.Tensor]=None, eval:bool=True):
+        r"""
+        Posterior mean on the first `n` points of a shifted copy of the sampling design. 
+            For `FastGPLattice` the grid is the lattice with the same generating vector shifted by `shift` modulo 1. 
+            For `FastGPDigitalNetB2` the grid is the digital net with the same generating matrices digitally shifted by `shift`. 
+            The kernel matrix between the grid and the sampling locations is diagonalized by the fast transform, 
+            so the posterior mean is computed from the transformed coefficients in $\mathcal{O}(n \log n)$ 
+            rather than the $\mathcal{O}(n^2 d)$ cost of `post_mean`. 
+
+        Args:
+            n (int): number of grid points, must be a power of 2 
+            shift (torch.Tensor[d]): shift in $[0,1)^d$, defaults to the shift of the first task so the grid is the first `n` points of its sequence
+            task (Union[int,torch.Tensor[T]]): task index
+            eval (bool): if `True`, disable gradients, otherwise use `torch.is_grad_enabled()`
+        
+        Returns:
+            x (torch.Tensor[n,d]): grid points
+            pmean (torch.Tensor[...,T,n]): posterior mean at `x`
+        """
+        assert isinstance(n,int) and n>0 and n&(n-1)==0, "n must be a power of 2"
+        assert self.replications==1, "post_mean_grid does not support replications"
+        ctildes = self.coeffs_tilde
+        kmat_tasks = self.gram_matrix_tasks
+        if eval:
+            incoming_grad_enabled = torch.is_grad_enabled()
+            torch.set_grad_enabled(False)
+        if task is None: task = self.default_task
+        inttask = isinstance(task,int)
+        if inttask: task = torch.tensor([task],dtype=int)
+        if isinstance(task,list): task = torch.tensor(task,dtype=int)
+        assert task.ndim==1 and (task>=0).all() and (task<self.num_tasks).all()
+        nmax = max(n,self.n.max().item())
+        x,xb = self._get_grid(nmax,shift)
+        r = [nmax//self.n[l1].item() if self.n[l1]>0 else 0 for l1 in range(self.num_tasks)]
+        ctildes = [ctildes[l1].repeat([1]*(ctildes[l1].ndim-1)+[r[l1]])/np.sqrt(r[l1]) if r[l1]>0 else None for l1 in range(self.num_tasks)]
+        xb1s = [self.xxb_seqs[l1][:1][1] for l1 in range(self.num_tasks)]
+        pmean = torch.cat([sum(kmat_tasks[...,l0,l1,None]*self.ift(np.sqrt(nmax)*self.ft(self._kernel(xb,xb1s[l1],self.derivatives[l0],self.derivatives[l1],self.derivatives_coeffs[l0],self.derivatives_coeffs[l1]))*ctildes[l1]).real for l1 in range(self.num_tasks) if r[l1]>0)[...,None,:] for l0 in task],dim=-2)
+        x,pmean = x[:n],pmean[...,:n]
+        if eval:
+            torch.set_grad_enabled(incoming_grad_enabled)
+        return x,(pmean[...,0,:] if inttask else pmean)
+    def post_sample_grid(self, num_samples:int, n:int=None, shift:torch.Tensor=None, generator:torch.Generator=None, eval:bool=True):
+        r"""
+        Posterior samples on the first `n` points of a shifted copy of the sampling design, see `post_mean_grid`. 
+            Prior samples on the grid and the sampling locations are drawn jointly in the spectral domain 
+            where the covariance of each frequency is a $2 \times 2$ matrix, 
+            and then conditioned on the data with Matheron's rule using `gram_matrix_solve`. 
+            The cost is $\mathcal{O}(S n \log n)$ for $S$ samples. 
+
+        Args:
+            num_samples (int): number of samples $S$
+            n (int): number of grid points, must be a power of 2, defaults to the current number of samples
+            shift (torch.Tensor[d]): shift in $[0,1)^d$, defaults to the shift of the sampling locations
+            generator (torch.Generator): random number generator 
+            eval (bool): if `True`, disable gradients, otherwise use `torch.is_grad_enabled()`
+        
+        Returns:
+            x (torch.Tensor[n,d]): grid points
+            samples (torch.Tensor[num_samples,...,n]): posterior samples at `x`
+        """
+        assert self.num_tasks==1, "post_sample_grid only supports single task problems"
+        assert self.replications==1, "post_sample_grid does not support replications"
+        assert isinstance(num_samples,int) and num_samples>0
+        if n is None: n = self.n[0].item()
+        assert isinstance(n,int) and n>0 and n&(n-1)==0, "n must be a power of 2"
+        inv_log_det_cache = self.get_inv_log_det_cache()
+        if eval:
+            incoming_grad_enabled = torch.is_grad_enabled()
+            torch.set_grad_enabled(False)
+        inv_log_det_cache() # populate the current level before requesting larger ones
+        n0 = self.n[0].item()
+        nmax = max(n,n0)
+        x,xb = self._get_grid(nmax,shift)
+        _,xb0 = self.xxb_seqs[0][:1]
+        beta,c = self.derivatives[0],self.derivatives_coeffs[0]
+        lam = np.sqrt(nmax)*self.get_lam(0,0,nmax).real
+        lam_shift = np.sqrt(nmax)*self.ft(self._kernel(xb,xb0,beta,beta,c,c))
+        lam = lam.clamp(min=1e-16*lam.abs().max())
+        lam_root = torch.sqrt(lam)
+        l21 = lam_shift.conj()/lam_root
+        l22 = torch.sqrt((lam-(lam_shift*lam_shift.conj()).real/lam).clamp(min=0))
+        w = torch.randn((2,num_samples)+(1,)*(lam.ndim-1)+(nmax,),generator=generator,device=self.device)
+        wtilde = self.ft(w)
+        f_grid = self.ift(lam_root*wtilde[0]).real
+        f_data = self.ift(l21*wtilde[0]+l22*wtilde[1]).real[...,:n0]
+        eps = torch.sqrt(self.noise)*torch.randn(f_data.shape,generator=generator,device=self.device)
+        v = inv_log_det_cache.gram_matrix_solve(self._y[0]-f_data-eps)
+        r = nmax//n0
+        vtilde = self.ft(v) if n0>1 else v.to(self._FTOUTDTYPE)
+        vtilde = vtilde.repeat([1]*(vtilde.ndim-1)+[r])/np.sqrt(r)
+        samples = f_grid+self.ift(lam_shift*vtilde).real
+        x,samples = x[:n],samples[...,:n]
+        if eval:
+            torch.set_grad_enabled(incoming_grad_enabled)
+        return x,samples
+    def posterior_sampler(self, num_samples:int, num_features:int=1024, generator:torch.Generator=None):
+        r"""
+        Pathwise posterior samples which may be evaluated at arbitrary locations. 
+            The kernel is truncated to the `num_features` largest terms of its series expansion, 
+            a Fourier series for `FastGPLattice` and a Walsh series for `FastGPDigitalNetB2`, 
+            so prior samples are $f(x) = \sum_{j=1}^F \sqrt{w_j} \phi_j(x) z_j$ with $z_j \sim \mathcal{N}(0,1)$. 
+            These are conditioned on the data with Matheron's rule 
+            $$f(x) + \tilde{k}(x,\mathsf{X}) \mathsf{K}^{-1}(\boldsymbol{y} - f(\mathsf{X}) - \boldsymbol{\varepsilon})$$
+            where $\tilde{k}$ is the truncated kernel and the solve is done with `gram_matrix_solve`. 
+            Evaluating the samples at $M$ points costs $\mathcal{O}(S M F)$ independent of $n$. 
+
+        Args:
+            num_samples (int): number of samples $S$
+            num_features (int): number of series terms $F$ retained in the kernel expansion
+            generator (torch.Generator): random number generator 
+        
+        Returns:
+            sampler (Callable): function mapping `x` (torch.Tensor[M,d]) to samples (torch.Tensor[num_samples,...,M])
+        """
+        assert self.num_tasks==1, "posterior_sampler only supports single task problems"
+        assert self.replications==1, "posterior_sampler does not support replications"
+        assert (self.derivatives[0]==0).all() and len(self.derivatives_coeffs[0])==1, "posterior_sampler does not support derivative information"
+        assert isinstance(num_samples,int) and num_samples>0
+        assert isinstance(num_features,int) and num_features>0
+        inv_log_det_cache = self.get_inv_log_det_cache()
+        with torch.no_grad():
+            freqs = self._series_frequencies(num_features)
+            weights = self._series_weights(freqs)*self.derivatives_coeffs[0][0]**2
+            phi = self._series_features(self.get_xb(0),freqs)
+            weights = weights.repeat([1]*(weights.ndim-1)+[phi.size(-1)//freqs.size(0)])
+            z = torch.randn((num_samples,)+(1,)*(weights.ndim-1)+(phi.size(-1),),generator=generator,device=self.device)
+            w = torch.sqrt(weights)*z
+            f_data = w@phi.T
+            eps = torch.sqrt(self.noise)*torch.randn(f_data.shape,generator=generator,device=self.device)
+            v = inv_log_det_cache.gram_matrix_solve(self._y[0]-f_data-eps).real
+            w = w+weights*(v@phi)
+        def sampler(x:torch.Tensor):
+            assert x.ndim==2 and x.size(1)==self.d, "x must a torch.Tensor with shape (-1,d)"
+            return w@self._series_features(self._convert_to_b(x),freqs).T
+        return sampler
+    def _series_frequencies(self, num_features):
+        # greedily combine per dimension series terms, keeping the num_features largest products
+        lengthscales = self.lengthscales.detach().reshape(-1,self.d).amax(0)
+        freqs = torch.zeros((1,0),dtype=torch.int64,device=self.device)
+        logw = torch.zeros(1,device=self.device)
+        for j in range(self.d):
+            k = self._series_candidates(num_features)
+            q = torch.where(k==0,0.,torch.log(lengthscales[j]*self._series_rates(k,j)))
+            q,order = q.sort(descending=True)
+            k = k[order]
+            # the i^th largest previous weight times the m^th largest new weight is dominated by (i+1)(m+1)-1 other products
+            ii = torch.cat([torch.arange(min(len(logw),num_features//(m+1)),device=self.device) for m in range(min(len(k),num_features))])
+            mm = torch.cat([torch.full((min(len(logw),num_features//(m+1)),),m,device=self.device) for m in range(min(len(k),num_features))])
+            logw,idx = (logw[ii]+q[mm]).topk(min(num_features,len(ii)))
+            freqs = torch.cat([freqs[ii[idx]],k[mm[idx],None]],-1)
+        return freqs
+    def _series_weights(self, freqs):
+        rates = torch.stack([torch.where(freqs[:,j]==0,1.,self.lengthscales[...,j,None]*self._series_rates(freqs[:,j],j)) for j in range(self.d)],-1)
+        return self.scale*rates.prod(-1)
+    def _get_grid(self, n, shift=None):
+        _,xb = self.xxb_seqs[0][:n]
+        ub = self._ominus(xb,xb[:1])
+        for l in range(1,self.num_tasks):
+            if self.n[l]==0: continue
+            _,xbl = self.xxb_seqs[l][:min(n,self.n[l].item())]
+            assert torch.allclose(self._convert_from_b(self._ominus(xbl,xbl[:1])),self._convert_from_b(ub[:len(xbl)])), "all tasks must share the same generating vector or generating matrices"
+        if shift is not None:
+            assert isinstance(shift,torch.Tensor) and shift.shape==(self.d,) and ((0<=shift)&(shift<1)).all(), "shift must be a torch.Tensor with shape (d,) and elements in [0,1)"
+            xb = self._oplus(ub,self._convert_to_b(shift.to(self.device)))
+        return self._convert_from_b(xb),xb
     def get_default_optimizer(self, lr):
         # if lr is None: lr = 1e-1
         # return torch.optim.Adam(self.parameters(),lr=lr,amsgrad=True)
         if lr is None: lr = 1e-1
         return torch.optim.Rprop(self.parameters(),lr=lr)
-    def get_inv_log_det_cache(self, n=None):
-        if n is None: n = self.n
-        assert isinstance(n,torch.Tensor) and n.shape==(self.num_tasks,) and (n>=self.n).all()
-        ntup = tuple(n.tolist())
-        if ntup not in self.inv_log_det_cache_dict.keys():
-            self.inv_log_det_cache_dict[ntup] = _FastInverseLogDetCache(self,n)
-        return self.inv_log_det_cache_dict[ntup]
+    _SNAPSHOT_CACHES = AbstractGP._SNAPSHOT_CACHES+("k1parts_seq","lam_caches","ytilde_cache")
+    def _materialize_caches(self):
+        super()._materialize_caches()
+        for l in range(self.num_tasks):
+            if self.n[l]>0: self.get_ytilde(l)
+    def _freeze_var(self):
+        inv_log_det_cache = self.get_inv_log_det_cache()
+        inv,logdet = inv_log_det_cache()
+        # bit reversal permutations applied by the lattice transform before the FFT
+        bitrevs = [torch.arange(nl,device=self.device).reshape([2]*int(np.log2(nl))).permute(list(range(int(np.log2(nl))-1,-1,-1))).flatten() if nl>1 else torch.arange(nl,device=self.device) for nl in self.n.tolist()]
+        return {"var_mode":"spectral","chol":torch.empty(0,device=self.device),"inv":inv,"ns":self.n.tolist(),"task_order":inv_log_det_cache.task_order.tolist(),"bitrevs":bitrevs,"lattice":self._FTOUTDTYPE.is_complex}
+    def _extend_output_caches(self, y_new, coeffs_old):
+        for l in range(self.num_tasks):
+            self.ytilde_cache[l].extend(y_new[l])
+        self.coeffs_tilde_cache.extend(coeffs_old,y_new[0].size(-2))
+    def _new_inv_log_det_cache(self, n):
+        return _FastInverseLogDetCache(self,n)
+    def _evictable_caches(self, keep):
+        tiers = super()._evictable_caches(keep)
+        lam_caches = [lam_cache for lam_cache in self.lam_caches.flat if lam_cache is not None and lam_cache.m_max>lam_cache.m_min]
+        k1parts_seqs = [k1parts_seq for k1parts_seq in self.k1parts_seq.flat if k1parts_seq is not None and k1parts_seq.n>0]
+        return tiers+[[(lam_cache.last_used,lam_cache._evict) for lam_cache in lam_caches],[(k1parts_seq.last_used,k1parts_seq._evict) for k1parts_seq in k1parts_seqs]]
     def post_cubature_mean(self, task:Union[int,torch.Tensor]=None, eval:bool=True):
         kmat_tasks = self.gram_matrix_tasks
         coeffs = self.coeffs
@@ -152,6 +359,155 @@ class AbstractFastGP(AbstractGP):
             return pccov[...,:,0]
         else: #not inttask0 and not inttask1
             return pccov
+    def integrate(self, f:callable, abs_tol:float=1e-2, rel_tol:float=0., n_init:int=2**8, max_n:int=2**16, executor:concurrent.futures.Executor=None, chunk_size:int=None, refit:bool=True, fit_kwargs:dict=None, confidence:float=0.99):
+        r"""
+        Sequential Bayesian cubature driver which doubles the sample size until 
+            the posterior cubature error is at most $\max(\varepsilon_\text{abs},\varepsilon_\text{rel} \lvert \mu \rvert)$ for posterior cubature mean $\mu$ 
+            or doubling would exceed `max_n`. 
+            When an `executor` is passed, each new batch from `get_x_next` is split into chunks evaluated in the pool, 
+            and the next batch is submitted before refitting so hyperparameter optimization overlaps integrand evaluation. 
+            Pending evaluations are cancelled once the tolerance is met. 
+
+        Args:
+            f (callable): integrand mapping `x` (torch.Tensor[N,d]) to `y` (torch.Tensor[...,N]), must be picklable for process pools
+            abs_tol (float): absolute error tolerance
+            rel_tol (float): relative error tolerance
+            n_init (int): initial number of samples, must be a power of 2
+            max_n (int): maximum number of samples, must be a power of 2
+            executor (concurrent.futures.Executor): thread or process pool used to evaluate `f`, if `None` then `f` is evaluated serially
+            chunk_size (int): number of points per submitted chunk, defaults to splitting each batch across `os.cpu_count()` chunks
+            refit (bool): if `True`, call `fit` after every round
+            fit_kwargs (dict): keyword arguments to `fit`, defaults to `{"verbose":0}`
+            confidence (float): confidence level in $(0,1)$ for the posterior cubature error
+        
+        Returns:
+            data (dict): with keys `"pcmean"`, `"pcerror"`, `"n"`, `"converged"`, and `"rounds"`, 
+                where `"rounds"` is a list of per round dicts with keys 
+                ```python
+                ["n","n_new","eval_time","wait_time","fit_time","throughput","pcmean","pcerror"]
+                ```
+                Here `eval_time` runs from submission until the last chunk finishes, 
+                `wait_time` is the time spent blocked on evaluations after refitting, 
+                and `throughput` is `n_new/eval_time` in evaluations per second. 
+        """
+        assert self.num_tasks==1, "integrate only supports single task problems"
+        assert self.replications==1, "integrate does not support replications"
+        assert callable(f)
+        assert np.isscalar(abs_tol) and abs_tol>=0 and np.isscalar(rel_tol) and rel_tol>=0 and (abs_tol>0 or rel_tol>0)
+        assert isinstance(n_init,int) and n_init>0 and n_init&(n_init-1)==0, "n_init must be a power of 2"
+        assert isinstance(max_n,int) and max_n>=n_init and max_n&(max_n-1)==0, "max_n must be a power of 2 at least n_init"
+        assert executor is None or isinstance(executor,concurrent.futures.Executor)
+        assert chunk_size is None or (isinstance(chunk_size,int) and chunk_size>0)
+        if fit_kwargs is None: fit_kwargs = {"verbose":0}
+        def submit(n_next):
+            x_next = self.get_x_next(n_next)
+            t_submit = time.perf_counter()
+            if executor is None:
+                y_next = f(x_next)
+                return {"n_new":len(x_next),"t_submit":t_submit,"done_times":[time.perf_counter()],"y":y_next}
+            cs = chunk_size if chunk_size is not None else max(1,-(-len(x_next)//(os.cpu_count() or 1)))
+            done_times = []
+            futures = [executor.submit(f,x_chunk) for x_chunk in x_next.split(cs,dim=0)]
+            for future in futures: future.add_done_callback(lambda _: done_times.append(time.perf_counter()))
+            return {"n_new":len(x_next),"t_submit":t_submit,"done_times":done_times,"futures":futures}
+        def gather(batch):
+            t_wait = time.perf_counter()
+            y_next = batch["y"] if "y" in batch else torch.cat([future.result() for future in batch["futures"]],dim=-1)
+            wait_time = time.perf_counter()-t_wait
+            # done callbacks may still be running right after result() returns
+            t_done = max(batch["done_times"]) if "y" in batch or len(batch["done_times"])==len(batch["futures"]) else t_wait+wait_time
+            eval_time = t_done-batch["t_submit"]
+            return y_next,eval_time,wait_time
+        rounds = []
+        batch = submit(max(n_init,self.n[0].item()))
+        while True:
+            y_next,eval_time,wait_time = gather(batch)
+            self.add_y_next(y_next)
+            n = self.n[0].item()
+            batch = submit(2*n) if executor is not None and 2*n<=max_n else None
+            t_fit = time.perf_counter()
+            if refit: self.fit(**fit_kwargs)
+            fit_time = time.perf_counter()-t_fit
+            pcmean = self.post_cubature_mean()
+            _,_,pcerror = self.post_cubature_error(confidence=confidence)
+            rounds.append({"n":n,"n_new":y_next.size(-1),"eval_time":eval_time,"wait_time":wait_time,"fit_time":fit_time,
+                "throughput":y_next.size(-1)/eval_time if eval_time>0 else np.inf,"pcmean":pcmean,"pcerror":pcerror})
+            converged = bool((pcerror<=torch.clamp(rel_tol*pcmean.abs(),min=abs_tol)).all())
+            if converged or 2*n>max_n:
+                if batch is not None:
+                    for future in batch["futures"]: future.cancel()
+                break
+            if batch is None: batch = submit(2*n)
+        return {"pcmean":pcmean,"pcerror":pcerror,"n":n,"converged":converged,"rounds":rounds}
+    def design_stream(self, max_n:int, batch_size:int=1, task:int=None, max_pending:int=None):
+        """
+        Asynchronous sequential design. Iterating the returned stream with `async for idx,x in stream` 
+            hands out the next points in the sequence as soon as they are requested, 
+            running ahead of the current doubling block so simulations never wait on the GP. 
+            Results are passed back with `await stream.put(idx,y)` in any order. 
+            They are buffered until the contiguous results reach the next power of 2, 
+            at which point they are passed to `add_y_next` and the incremental `ytilde` cache is updated. 
+            Use `await stream.wait(n)` to block until at least `n` samples have been added. 
+
+        Args:
+            max_n (int): total number of samples to hand out, must be a power of 2
+            batch_size (int): number of points per handed out batch
+            task (int): task index
+            max_pending (int): if not `None`, stop handing out points while this many are awaiting results
+
+        Returns:
+            stream (_DesignStream): asynchronous iterable of `(idx,x)` pairs where `idx` is the index of the first point in `x` (torch.Tensor[batch_size,d])
+        """
+        if task is None: task = self.default_task
+        if isinstance(task,torch.Tensor): task = task.item()
+        assert isinstance(task,int) and 0<=task<self.num_tasks
+        assert isinstance(max_n,int) and max_n>=self.n[task] and max_n&(max_n-1)==0, "max_n must be a power of 2 at least the current n"
+        assert self.replications==1, "design_stream does not support replications"
+        assert isinstance(batch_size,int) and batch_size>0
+        assert max_pending is None or (isinstance(max_pending,int) and max_pending>=batch_size)
+        return _DesignStream(self,max_n,batch_size,task,max_pending)
+    def schedule_doubling(self, costs:torch.Tensor, abs_tol:float=None, task:int=None, confidence:float=0.99, eval:bool=True):
+        r"""
+        Cost aware choice of which task to double next in a multitask (e.g. multi-fidelity) cubature problem. 
+            For each task $l$ the move doubling $n_l$ is scored by the reduction in the posterior cubature variance of `task` 
+            per unit cost of the new evaluations, $(\sigma^2_\text{now} - \sigma^2_l) / (c_l (n_l' - n_l))$. 
+            The hypothetical variances $\sigma^2_l$ come from `post_cubature_var(n=...)`, 
+            which reuses the cached kernel eigenvalues and keeps the inverse cache for each move so the chosen move is free to evaluate after `add_y_next`. 
+
+        Args:
+            costs (torch.Tensor[num_tasks]): cost per evaluation of each task
+            abs_tol (float): if the current posterior cubature error of `task` is at most `abs_tol` for every batch element then no move is returned
+            task (int): index of the task whose integral is targeted, defaults to the last task
+            confidence (float): confidence level in $(0,1)$ for the posterior cubature error
+            eval (bool): if `True`, disable gradients, otherwise use `torch.is_grad_enabled()`
+        
+        Returns:
+            data (dict): with keys 
+                
+                - `"task"`: the task to double, or `None` if the tolerance is already met 
+                - `"n_next"`: sample sizes after the chosen move, or the current sample sizes if no move is made
+                - `"pcerror"`: current posterior cubature error of `task`
+                - `"pcvars"`: posterior cubature variances of `task` after each move, summed over batch dimensions
+                - `"reduction_per_cost"`: variance reduction per unit cost of each move
+        """
+        if isinstance(costs,(list,np.ndarray)): costs = torch.tensor(costs,dtype=torch.get_default_dtype(),device=self.device)
+        assert isinstance(costs,torch.Tensor) and costs.shape==(self.num_tasks,) and (costs>0).all(), "costs must be a positive torch.Tensor with length num_tasks"
+        if task is None: task = self.num_tasks-1
+        assert isinstance(task,int) and 0<=task<self.num_tasks
+        assert abs_tol is None or (np.isscalar(abs_tol) and abs_tol>0)
+        pcvar,q,pcerror = self.post_cubature_error(task=task,confidence=confidence,eval=eval)
+        data = {"task":None,"n_next":self.n.clone(),"pcerror":pcerror}
+        if abs_tol is not None and (pcerror<=abs_tol).all():
+            return data
+        # each move changes the block sizes of the task structured Gram matrix, so moves are scored one at a time
+        moves = [self.n.clone() for l in range(self.num_tasks)]
+        for l in range(self.num_tasks):
+            moves[l][l] = max(1,2*self.n[l].item())
+        pcvars = torch.stack([self.post_cubature_var(task=task,n=moves[l],eval=eval).sum() for l in range(self.num_tasks)])
+        reduction_per_cost = (pcvar.sum()-pcvars)/(costs*torch.tensor([moves[l][l]-self.n[l] for l in range(self.num_tasks)],device=self.device))
+        best = reduction_per_cost.argmax().item()
+        data.update({"task":best,"n_next":moves[best],"pcvars":pcvars,"reduction_per_cost":reduction_per_cost})
+        return data
     def get_lam(self, task0, task1, n=None):
         assert 0<=task0<self.num_tasks
         assert 0<=task1<self.num_tasks
@@ -167,6 +523,12 @@ class AbstractFastGP(AbstractGP):
     def get_ytilde(self, task):
         assert 0<=task<self.num_tasks
         return self.ytilde_cache[task]()
+    @property
+    def coeffs_tilde(self):
+        r"""
+        Fast transforms of the coefficients $\mathsf{K}^{-1} \boldsymbol{y}$ split by task. 
+        """
+        return self.coeffs_tilde_cache()
     def get_inv_log_det(self, n=None):
         inv_log_det_cache = self.get_inv_log_det_cache(n)
         return inv_log_det_cache()
@@ -194,6 +556,7 @@ class AbstractFastGP(AbstractGP):
         assert beta0.shape==(len(c0),self.d) and beta1.shape==(len(c1),self.d)
         assert x.size(-1)==self.d and z.size(-1)==self.d
         return self._kernel_from_parts(self._kernel_parts(x,z,beta0,beta1),beta0,beta1,c0,c1)
+    @_profiled("ft")
     def ft(self, x):
         """
         One dimensional fast transform along the last dimenions. 
@@ -210,6 +573,7 @@ class AbstractFastGP(AbstractGP):
         y = self.ft_unstable(x-xmean[...,None])
         y[...,0] += xmean*np.sqrt(x.size(-1))
         return y
+    @_profiled("ift")
     def ift(self, x):
         """
         One dimensional inverse fast transform along the last dimenions. 
@@ -2,7 +2,14 @@ from .util import (
     _XXbSeq,
     _TaskCovCache,
     _CoeffsCache,
+    _SNAPSHOT_VERSION,
+    _snapshot_state,
+    _restore_state,
+    _cache_nbytes,
+    _CACHE_CLOCK,
 )
+from .frozen_gp import FrozenGP
+from .prediction_server import PredictionServer
 import torch
 import numpy as np 
 import scipy.stats 
@@ -75,6 +82,7 @@ class AbstractGP(torch.nn.Module):
         assert isinstance(shape_batch,torch.Size)
         self.shape_batch = shape_batch
         self.ndim_batch = len(self.shape_batch)
+        self.replications = 1
         # scale
         assert np.isscalar(scale) or isinstance(scale,torch.Tensor), "scale must be a scalar or torch.Tensor"
         if isinstance(scale,torch.Tensor): shape_scale = scale.shape
@@ -143,6 +151,8 @@ class AbstractGP(torch.nn.Module):
         self.coeffs_cache = _CoeffsCache(self)
         self.task_cov_cache = _TaskCovCache(self)
         self.inv_log_det_cache_dict = {}
+        self.cache_budget = None
+        self.cache_evictions = 0
         # derivative multitask setting checks 
         if any((self.derivatives[i]>0).any() or (self.derivatives_coeffs[i]!=1).any() for i in range(self.num_tasks)):
             self.raw_noise_task_kernel.requires_grad_(False)
@@ -166,10 +176,11 @@ class AbstractGP(torch.nn.Module):
         verbose_indent:int = 4,
         masks:torch.Tensor = None,
         cv_weights:torch.Tensor = 1,
+        folds:int = 4,
         ):
         """
         Args:
-            loss_metric (str): either "MLL" (Marginal Log Likelihood) or "CV" (Cross Validation) or "GCV" (Generalized CV)
+            loss_metric (str): either "MLL" (Marginal Log Likelihood) or "CV" (Cross Validation) or "GCV" (Generalized CV) or "KFOLD" (K-Fold CV, see `cross_validate`)
             iterations (int): number of optimization iterations
             lr (float): learning rate for default optimizer
             optimizer (torch.optim.Optimizer): optimizer defaulted to `torch.optim.Rprop(self.parameters(),lr=lr)`
@@ -185,6 +196,7 @@ class AbstractGP(torch.nn.Module):
             verbose_indent (int): size of the indent to be applied when logging, helpful for logging multiple models
             masks (torch.Tensor): only optimize outputs corresponding to `y[...,*masks]`
             cv_weights (Union[str,torch.Tensor]): weights for cross validation
+            folds (int): number of folds when `loss_metric="KFOLD"`
             
         Returns:
             data (dict): iteration data which, dependeing on storage arguments, may include keys in 
@@ -192,7 +204,7 @@ class AbstractGP(torch.nn.Module):
                 ["loss_hist","scale_hist","lengthscales_hist","noise_hist","task_kernel_hist"]
                 ```
         """
-        assert isinstance(loss_metric,str) and loss_metric.upper() in ["MLL","GCV","CV"] 
+        assert isinstance(loss_metric,str) and loss_metric.upper() in ["MLL","GCV","CV","KFOLD"] 
         assert (self.n>0).any(), "cannot fit without data"
         assert isinstance(iterations,int) and iterations>=0
         if optimizer is None:
@@ -271,6 +283,18 @@ class AbstractGP(torch.nn.Module):
                 else:
                     loss = squared_sums[...,*masks,0].sum()
                 metric_val = loss
+            elif loss_metric=="KFOLD":
+                coeffs = self.coeffs
+                del os.environ["FASTGP_FORCE_RECOMPILE"]
+                residuals,logscores = inv_log_det_cache.get_kfold_residuals_logscores(folds,coeffs)
+                os.environ["FASTGP_FORCE_RECOMPILE"] = "True"
+                term1 = term2 = torch.nan*torch.ones(1)
+                squared_sums = (residuals**2*cv_weights).sum(-1,keepdim=True)
+                if masks is None:
+                    loss = squared_sums.sum()
+                else:
+                    loss = squared_sums[...,*masks,0].sum()
+                metric_val = loss
             else:
                 assert False, "loss_metric parsing implementation error"
             if loss.item()<stop_crit_best_loss:
@@ -304,8 +328,36 @@ class AbstractGP(torch.nn.Module):
         if store_noise_hist: data["noise_hist"] = noise_hist[:(i+1)]
         if store_task_kernel_hist: data["task_kernel_hist"] = task_kernel_hist[:(i+1)]
         return data
+    def cross_validate(self, folds:int=4, eval:bool=True):
+        r"""
+        K-fold cross validation where the $j^\text{th}$ fold holds out the $j^\text{th}$ contiguous block of `n/folds` points from each task. 
+            For `FastGPLattice` and `FastGPDigitalNetB2` these blocks are cosets of the first `n/folds` points, 
+            so for single task problems every diagonal block of the inverse Gram matrix is diagonalized by a fast transform 
+            and the cost is $\mathcal{O}(n \log n)$ without forming dense matrices. 
+            Otherwise dense blocks of the inverse Gram matrix are used. 
+        
+        Args:
+            folds (int): number of folds which must divide the number of samples for every task
+            eval (bool): if `True`, disable gradients, otherwise use `torch.is_grad_enabled()`
+        
+        Returns:
+            residuals (torch.Tensor[...,folds,N/folds]): predictive residuals $y_i - \mathbb{E}[f(x_i) \mid y_{-j}]$ for points $x_i$ in fold $j$ 
+            logscores (torch.Tensor[...,folds]): log predictive densities of the held out values in each fold
+            idx (torch.Tensor[folds,N/folds]): indices of the points in each fold into the concatenated values across tasks 
+        """
+        coeffs = self.coeffs
+        if eval:
+            incoming_grad_enabled = torch.is_grad_enabled()
+            torch.set_grad_enabled(False)
+        inv_log_det_cache = self.get_inv_log_det_cache()
+        idx = inv_log_det_cache.get_kfold_idx(folds)
+        residuals,logscores = inv_log_det_cache.get_kfold_residuals_logscores(folds,coeffs)
+        if eval:
+            torch.set_grad_enabled(incoming_grad_enabled)
+        return residuals[...,idx],logscores,idx
     def _sample(self, seq, n_min, n_max):
         x = torch.from_numpy(seq(n_min=int(n_min),n_max=int(n_max))).to(self.device)
+        if x.ndim==3: x = x[0] # first replication
         return x,x
     def get_x_next(self, n:Union[int,torch.Tensor], task:Union[int,torch.Tensor]=None):
         """
@@ -326,7 +378,7 @@ class AbstractGP(torch.nn.Module):
         if isinstance(task,list): task = torch.tensor(task,dtype=int)
         assert isinstance(n,torch.Tensor) and isinstance(task,torch.Tensor) and n.ndim==task.ndim==1 and len(n)==len(task)
         assert (n>=self.n[task]).all(), "maximum sequence index must be greater than the current number of samples"
-        x_next = [self.xxb_seqs[l][self.n[l]:n[i]][0] for i,l in enumerate(task)]
+        x_next = [self._replicate_points(self.xxb_seqs[l][self.n[l]:n[i]][0]) for i,l in enumerate(task)]
         return x_next[0] if inttask else x_next
     def add_y_next(self, y_next:Union[torch.Tensor,List], task:Union[int,torch.Tensor]=None):
         """
@@ -349,6 +401,209 @@ class AbstractGP(torch.nn.Module):
         for key in list(self.inv_log_det_cache_dict.keys()):
             if (torch.tensor(key)<self.n.cpu()).any():
                 del self.inv_log_det_cache_dict[key]
+    def add_outputs(self, y_new:Union[torch.Tensor,List]):
+        """
+        Append output columns (e.g. new integrands) observed at the current sampling locations along the last batch axis. 
+            Requires hyperparameters shared across the batch, i.e. the default `shape_scale`, `shape_lengthscales`, `shape_noise`, 
+            `shape_factor_task_kernel`, and `shape_noise_task_kernel`, so kernel eigenvalues, inverse and log determinant caches, and fitted hyperparameters are reused. 
+            Only the coefficients and fast transforms of the new columns are computed. 
+
+        Args:
+            y_new (Union[torch.Tensor,List]): new outputs with shape `shape_batch[:-1]+(k,n)` for each task
+        """
+        if isinstance(y_new,torch.Tensor): y_new = [y_new]
+        assert isinstance(y_new,list) and len(y_new)==self.num_tasks, "y_new must have one tensor per task"
+        assert self.ndim_batch>=1, "add_outputs requires a batch axis, e.g. shape_batch=torch.Size([1])"
+        assert self._shared_hyperparameters(), "add_outputs requires hyperparameters shared across the batch"
+        assert self.replications==1, "add_outputs does not support replications"
+        num_new = y_new[0].size(-2)
+        assert all(y_new[l].shape==self.shape_batch[:-1]+torch.Size([num_new,self.n[l]]) for l in range(self.num_tasks)), "y_new[l] must have shape shape_batch[:-1]+(k,n[l])"
+        coeffs_old = getattr(self.coeffs_cache,"coeffs",None)
+        self.coeffs_cache.extend(y_new)
+        self._extend_output_caches(y_new,coeffs_old)
+        self._y = [torch.cat([self._y[l],y_new[l]],-2) if self.n[l]>0 else self._y[l] for l in range(self.num_tasks)]
+        self.shape_batch = self.shape_batch[:-1]+torch.Size([self.shape_batch[-1]+num_new])
+    def _extend_output_caches(self, y_new, coeffs_old):
+        pass
+    _SNAPSHOT_CACHES = ("xxb_seqs","coeffs_cache")
+    def get_inv_log_det_cache(self, n=None):
+        if n is None: n = self.n
+        assert isinstance(n,torch.Tensor) and n.shape==(self.num_tasks,) and (n>=self.n).all()
+        ntup = tuple(n.tolist())
+        if ntup not in self.inv_log_det_cache_dict.keys():
+            self.inv_log_det_cache_dict[ntup] = self._new_inv_log_det_cache(n)
+        inv_log_det_cache = self.inv_log_det_cache_dict[ntup]
+        inv_log_det_cache.last_used = next(_CACHE_CLOCK)
+        if self.cache_budget is not None: self._enforce_cache_budget(keep=ntup)
+        return inv_log_det_cache
+    def _cache_items(self):
+        items = {}
+        for name in self._SNAPSHOT_CACHES:
+            obj = getattr(self,name)
+            if isinstance(obj,np.ndarray):
+                for idx in np.ndindex(obj.shape):
+                    if obj[idx] is not None: items["%s[%s]"%(name,",".join(str(i) for i in idx))] = obj[idx]
+            else:
+                items[name] = obj
+        for ntup,cache in self.inv_log_det_cache_dict.items():
+            items["inv_log_det_cache_dict[%s]"%(",".join(str(v) for v in ntup))] = cache
+        return items
+    def cache_report(self):
+        """
+        Bytes held by each cache. 
+            Tensors sharing storage are only counted once, against the first cache holding them.
+
+        Returns:
+            report (dict): with keys `caches` mapping each cache to its bytes, `total`, `budget`, and `evictions`
+        """
+        seen = set()
+        caches = {name:_cache_nbytes(obj,seen) for name,obj in self._cache_items().items()}
+        return {"caches":caches,"total":sum(caches.values()),"budget":self.cache_budget,"evictions":self.cache_evictions}
+    def set_cache_budget(self, budget:int=None):
+        """
+        Bound the memory held by caches. 
+            Whenever an inverse cache is requested while the caches exceed the budget, 
+            least recently used entries are evicted in the order 
+            inverse caches for a hypothetical `n` other than the current number of samples, 
+            eigenvalues `lam_caches` at levels above the current number of samples (fast GPs), 
+            and the recomputable kernel parts `k1parts_seq` (fast GPs). 
+            Evicted entries are recomputed when next needed. 
+            Caches required at the current number of samples are never evicted, so the budget is a soft limit. 
+
+        Args:
+            budget (int): memory budget in bytes, or `None` to disable eviction
+        """
+        assert budget is None or (isinstance(budget,int) and budget>=0)
+        self.cache_budget = budget
+        if self.cache_budget is not None: self._enforce_cache_budget()
+    def _evictable_caches(self, keep):
+        ncur = tuple(self.n.tolist())
+        # each evict callable drops a cache entry and returns the bytes it released
+        return [[(cache.last_used,lambda ntup=ntup: _cache_nbytes(self.inv_log_det_cache_dict.pop(ntup),set())) for ntup,cache in self.inv_log_det_cache_dict.items() if ntup!=ncur and ntup!=keep]]
+    def _enforce_cache_budget(self, keep=None):
+        tiers = self._evictable_caches(keep)
+        if not any(tiers): return
+        total = self.cache_report()["total"]
+        for tier in tiers:
+            for last_used,evict in sorted(tier,key=lambda item: item[0]):
+                if total<=self.cache_budget: return
+                total -= evict()
+                self.cache_evictions += 1
+    def _materialize_caches(self):
+        if (self.n>0).any(): self.coeffs
+    def save(self, path:str, materialize:bool=True):
+        """
+        Save a versioned snapshot of the model to disk. 
+            Besides the `state_dict`, the snapshot stores the sampling locations, function evaluations, coefficients, 
+            and the inverse and kernel caches (e.g. the inverse Gram matrix for `StandardGP` or the eigenvalues and `ytilde` for fast GPs) 
+            so `load` can restore them without recomputation. 
+
+        Args:
+            path (str): file to write
+            materialize (bool): if `True`, compute the caches needed by the posterior mean and variance before saving
+        """
+        if materialize:
+            with torch.no_grad(): self._materialize_caches()
+        snapshot = {
+            "format": "fastgps",
+            "version": _SNAPSHOT_VERSION,
+            "class": type(self).__name__,
+            "d": self.d,
+            "num_tasks": self.num_tasks,
+            "shape_batch": list(self.shape_batch),
+            "state_dict": self.state_dict(),
+            "y": self._y,
+            "caches": {name:_snapshot_state(getattr(self,name)) for name in self._SNAPSHOT_CACHES},
+            "inv_log_det_caches": [[list(ntup),_snapshot_state(cache)] for ntup,cache in self.inv_log_det_cache_dict.items()],
+        }
+        torch.save(snapshot,path)
+    def load(self, path:str, mmap:bool=True, map_location=None):
+        """
+        Load a snapshot written by `save` into a model constructed with the same arguments, 
+            analogous to `load_state_dict`. With `mmap=True` tensors are memory mapped and only read from disk when used, 
+            so a new process can answer `post_mean` without regenerating points or recomputing caches. 
+
+        Args:
+            path (str): file written by `save`
+            mmap (bool): if `True`, memory map the tensors instead of reading them into memory
+            map_location: passed to `torch.load`
+        
+        Returns:
+            self (AbstractGP): this model
+        """
+        snapshot = torch.load(path,mmap=mmap,map_location=map_location,weights_only=True)
+        assert snapshot.get("format")=="fastgps", "path is not a fastgps snapshot"
+        assert snapshot["version"]==_SNAPSHOT_VERSION, "snapshot version %d does not match supported version %d"%(snapshot["version"],_SNAPSHOT_VERSION)
+        assert snapshot["class"]==type(self).__name__, "snapshot of a %s cannot be loaded into a %s"%(snapshot["class"],type(self).__name__)
+        assert snapshot["d"]==self.d and snapshot["num_tasks"]==self.num_tasks and torch.Size(snapshot["shape_batch"])==self.shape_batch, "snapshot dimensions do not match the model"
+        self.load_state_dict(snapshot["state_dict"])
+        self._y = list(snapshot["y"])
+        self.n = torch.tensor([self._y[i].size(-1) for i in range(self.num_tasks)],dtype=int,device=self.device)
+        self.m = torch.where(self.n==0,-1,torch.log2(self.n)).to(int)
+        for name in self._SNAPSHOT_CACHES:
+            _restore_state(getattr(self,name),snapshot["caches"][name])
+        self.inv_log_det_cache_dict = {}
+        for ntup,state in snapshot["inv_log_det_caches"]:
+            _restore_state(self.get_inv_log_det_cache(torch.tensor(ntup,dtype=int,device=self.device)),state)
+        return self
+    def _freeze_var(self):
+        chol = self.get_inv_log_det_cache().gram_matrix_cholesky()
+        return {"var_mode":"dense","chol":chol,"inv":torch.empty(0,device=self.device),"ns":self.n.tolist(),"task_order":list(range(self.num_tasks)),"bitrevs":[],"lattice":False}
+    def freeze(self, task:Union[int,torch.Tensor]=None):
+        """
+        Inference only predictor for low latency serving. 
+            The returned `FrozenGP` holds constant tensors for the current hyperparameters and data 
+            and evaluates the posterior mean and variance without gradient tracking, cache checks, or input validation. 
+            It does not see later calls to `add_y_next` or `fit`. 
+
+        Args:
+            task (Union[int,torch.Tensor[T]]): task indices to predict
+
+        Returns:
+            frozen (FrozenGP): predictor with `post_mean`, `post_var`, `post`, and `to_torchscript` methods
+        """
+        assert all((self.derivatives[l]==0).all() for l in range(self.num_tasks)), "freeze does not support derivative information"
+        assert (self.n>0).any(), "freeze requires data"
+        assert self.replications==1, "freeze does not support replications"
+        if task is None: task = self.default_task
+        inttask = isinstance(task,int)
+        if inttask: task = torch.tensor([task],dtype=int)
+        if isinstance(task,list): task = torch.tensor(task,dtype=int)
+        assert task.ndim==1 and (task>=0).all() and (task<self.num_tasks).all()
+        with torch.no_grad():
+            csums = torch.stack([self.derivatives_coeffs[l].sum() for l in range(self.num_tasks)])
+            kmat_tasks = self.gram_matrix_tasks*csums[:,None]*csums[None,:]
+            task_of = torch.cat([l*torch.ones(self.n[l],dtype=int,device=self.device) for l in range(self.num_tasks)])
+            cross = kmat_tasks[...,task,:][...,:,task_of]
+            x0 = torch.zeros((1,self.d),device=self.device)
+            prior_var = torch.stack([self.gram_matrix_tasks[...,l,l]*self._kernel(x0,x0,self.derivatives[l],self.derivatives[l],self.derivatives_coeffs[l],self.derivatives_coeffs[l])[...,0] for l in task.tolist()],-1)
+            frozen = FrozenGP(
+                d = self.d,
+                inttask = inttask,
+                scale = self.scale.clone(),
+                lengthscales = self.lengthscales.clone(),
+                x = torch.cat([self.get_xb(l) for l in range(self.num_tasks)],dim=0),
+                weights = cross*self.coeffs[...,None,:],
+                cross = cross,
+                prior_var = prior_var,
+                **self._freeze_kernel(),
+                **self._freeze_var())
+        return frozen
+    def serve(self, task:Union[int,torch.Tensor]=None, max_batch_size:int=256, max_wait:float=1e-3):
+        """
+        Read only serving state with a micro-batching dispatcher. 
+            The model is frozen with `freeze` so concurrent requests never touch the caches of this model, 
+            and single point requests from many threads are evaluated together in vectorized batches.
+
+        Args:
+            task (Union[int,torch.Tensor[T]]): task indices to predict
+            max_batch_size (int): maximum number of points evaluated in one batch
+            max_wait (float): maximum time in seconds to wait for more requests after the first request of a batch arrives
+
+        Returns:
+            server (PredictionServer): dispatcher with `submit`, `post`, and `close` methods, usable as a context manager
+        """
+        return PredictionServer(self.freeze(task),max_batch_size=max_batch_size,max_wait=max_wait)
     def post_mean(self, x:torch.Tensor, task:Union[int,torch.Tensor]=None, eval:bool=True):
         """
         Posterior mean. 
@@ -372,7 +627,7 @@ class AbstractGP(torch.nn.Module):
         if inttask: task = torch.tensor([task],dtype=int)
         if isinstance(task,list): task = torch.tensor(task,dtype=int)
         assert task.ndim==1 and (task>=0).all() and (task<self.num_tasks).all()
-        kmat = torch.cat([torch.cat([kmat_tasks[...,task[l0],l1,None,None]*self._kernel(x[:,None,:],self.get_xb(l1)[None,:,:],self.derivatives[task[l0]],self.derivatives[l1],self.derivatives_coeffs[task[l0]],self.derivatives_coeffs[l1]) for l1 in range(self.num_tasks)],dim=-1)[...,None,:,:] for l0 in range(len(task))],dim=-3)
+        kmat = torch.cat([torch.cat([kmat_tasks[...,task[l0],l1,None,None]*self._kernel(self._replicate_queries(x)[...,:,None,:],self.get_xb(l1)[None,:,:],self.derivatives[task[l0]],self.derivatives[l1],self.derivatives_coeffs[task[l0]],self.derivatives_coeffs[l1]) for l1 in range(self.num_tasks)],dim=-1)[...,None,:,:] for l0 in range(len(task))],dim=-3)
         #pmean = (kmat*coeffs[...,None,None,:]).sum(-1)
         pmean = torch.einsum("...i,...i->...",kmat,coeffs[...,None,None,:])
         if eval:
@@ -405,7 +660,7 @@ class AbstractGP(torch.nn.Module):
         if isinstance(task,list): task = torch.tensor(task,dtype=int)
         assert task.ndim==1 and (task>=0).all() and (task<self.num_tasks).all()
         kmat_new = torch.cat([kmat_tasks[...,task[l0],task[l0],None,None]*self._kernel(x,x,self.derivatives[task[l0]],self.derivatives[task[l0]],self.derivatives_coeffs[task[l0]],self.derivatives_coeffs[task[l0]])[...,None,:] for l0 in range(len(task))],dim=-2)
-        kmat = torch.cat([torch.cat([kmat_tasks[...,task[l0],l1,None,None]*self._kernel(x[:,None,:],self.get_xb(l1,n=n[l1])[None,:,:],self.derivatives[task[l0]],self.derivatives[l1],self.derivatives_coeffs[task[l0]],self.derivatives_coeffs[l1]) for l1 in range(self.num_tasks)],dim=-1)[...,None,:,:] for l0 in range(len(task))],dim=-3)
+        kmat = torch.cat([torch.cat([kmat_tasks[...,task[l0],l1,None,None]*self._kernel(self._replicate_queries(x)[...,:,None,:],self.get_xb(l1,n=n[l1])[None,:,:],self.derivatives[task[l0]],self.derivatives[l1],self.derivatives_coeffs[task[l0]],self.derivatives_coeffs[l1]) for l1 in range(self.num_tasks)],dim=-1)[...,None,:,:] for l0 in range(len(task))],dim=-3)
         kmat_perm = torch.permute(kmat,[-3,-2]+[i for i in range(kmat.ndim-3)]+[-1])
         t_perm = self.get_inv_log_det_cache(n).gram_matrix_solve(kmat_perm)
         t = torch.permute(t_perm,[2+i for i in range(t_perm.ndim-3)]+[0,1,-1])
@@ -450,8 +705,8 @@ class AbstractGP(torch.nn.Module):
         assert task1.ndim==1 and (task1>=0).all() and (task1<self.num_tasks).all()
         equal = torch.equal(x0,x1) and torch.equal(task0,task1)
         kmat_new = torch.cat([torch.cat([kmat_tasks[...,task0[l0],task1[l1],None,None,None,None]*self._kernel(x0[:,None,:],x1[None,:,:],self.derivatives[task0[l0]],self.derivatives[task1[l1]],self.derivatives_coeffs[task0[l0]],self.derivatives_coeffs[task1[l1]])[...,None,None,:,:] for l1 in range(len(task1))],dim=-3) for l0 in range(len(task0))],dim=-4)
-        kmat1 = torch.cat([torch.cat([kmat_tasks[...,task0[l0],l1,None,None]*self._kernel(x0[:,None,:],self.get_xb(l1,n=n[l1])[None,:,:],self.derivatives[task0[l0]],self.derivatives[l1],self.derivatives_coeffs[task0[l0]],self.derivatives_coeffs[l1]) for l1 in range(self.num_tasks)],dim=-1)[...,None,:,:] for l0 in range(len(task0))],dim=-3)
-        kmat2 = kmat1 if equal else torch.cat([torch.cat([kmat_tasks[...,task1[l0],l1,None,None]*self._kernel(x1[:,None,:],self.get_xb(l1,n=n[l1])[None,:,:],self.derivatives[task1[l0]],self.derivatives[l1],self.derivatives_coeffs[task1[l0]],self.derivatives_coeffs[l1]) for l1 in range(self.num_tasks)],dim=-1)[...,None,:,:] for l0 in range(len(task1))],dim=-3)
+        kmat1 = torch.cat([torch.cat([kmat_tasks[...,task0[l0],l1,None,None]*self._kernel(self._replicate_queries(x0)[...,:,None,:],self.get_xb(l1,n=n[l1])[None,:,:],self.derivatives[task0[l0]],self.derivatives[l1],self.derivatives_coeffs[task0[l0]],self.derivatives_coeffs[l1]) for l1 in range(self.num_tasks)],dim=-1)[...,None,:,:] for l0 in range(len(task0))],dim=-3)
+        kmat2 = kmat1 if equal else torch.cat([torch.cat([kmat_tasks[...,task1[l0],l1,None,None]*self._kernel(self._replicate_queries(x1)[...,:,None,:],self.get_xb(l1,n=n[l1])[None,:,:],self.derivatives[task1[l0]],self.derivatives[l1],self.derivatives_coeffs[task1[l0]],self.derivatives_coeffs[l1]) for l1 in range(self.num_tasks)],dim=-1)[...,None,:,:] for l0 in range(len(task1))],dim=-3)
         kmat2_perm = torch.permute(kmat2,[-3,-2]+[i for i in range(kmat2.ndim-3)]+[-1])
         t_perm = self.get_inv_log_det_cache(n).gram_matrix_solve(kmat2_perm)
         t = torch.permute(t_perm,[2+i for i in range(t_perm.ndim-3)]+[0,1,-1])
@@ -472,6 +727,76 @@ class AbstractGP(torch.nn.Module):
             return kmat[...,:,0,:,:]
         else: # not inttask0 and not inttask1
             return kmat
+    def post(self, x:torch.Tensor, task:Union[int,torch.Tensor]=None, n:Union[int,torch.Tensor]=None, want:Union[str,tuple]=("mean","var"), confidence:float=0.99, eval:bool=True):
+        """
+        Fused posterior query. The cross kernel matrix between `x` and the sampling locations is built once 
+        and shared by the posterior mean, the posterior variance, and the credible interval. 
+
+        Args:
+            x (torch.Tensor[N,d]): sampling locations
+            task (Union[int,torch.Tensor[T]]): task indices
+            n (Union[int,torch.Tensor[num_tasks]]): number of points at which to evaluate the posterior variance.
+            want (Union[str,tuple]): quantities to compute, a subset of `("mean","var","std","error","ci")`
+            confidence (float): confidence level in $(0,1)$ for the error and credible interval
+            eval (bool): if `True`, disable gradients, otherwise use `torch.is_grad_enabled()`
+
+        Returns:
+            out (dict): requested quantities with keys in 
+                ```python
+                ["mean","var","std","quantile","error","ci_low","ci_high"]
+                ```
+                where `"quantile"` is included when `"error"` or `"ci"` is requested and `"ci"` gives `"ci_low"` and `"ci_high"`
+        """
+        if isinstance(want,str): want = (want,)
+        want = tuple(w.lower() for w in want)
+        assert all(w in ["mean","var","std","error","ci"] for w in want), "want must be a subset of ('mean','var','std','error','ci')"
+        want_mean = "mean" in want or "ci" in want
+        want_var = any(w in want for w in ["var","std","error","ci"])
+        assert np.isscalar(confidence) and 0<confidence<1, "confidence must be between 0 and 1"
+        if n is None: n = self.n
+        if isinstance(n,int): n = torch.tensor([n],dtype=int,device=self.device)
+        assert isinstance(n,torch.Tensor)
+        assert x.ndim==2 and x.size(1)==self.d, "x must a torch.Tensor with shape (-1,d)"
+        if want_mean: coeffs = self.coeffs
+        kmat_tasks = self.gram_matrix_tasks
+        if eval:
+            incoming_grad_enabled = torch.is_grad_enabled()
+            torch.set_grad_enabled(False)
+        if task is None: task = self.default_task
+        inttask = isinstance(task,int)
+        if inttask: task = torch.tensor([task],dtype=int)
+        if isinstance(task,list): task = torch.tensor(task,dtype=int)
+        assert task.ndim==1 and (task>=0).all() and (task<self.num_tasks).all()
+        nkmat = n if want_var else self.n
+        kmat = torch.cat([torch.cat([kmat_tasks[...,task[l0],l1,None,None]*self._kernel(self._replicate_queries(x)[...,:,None,:],self.get_xb(l1,n=nkmat[l1])[None,:,:],self.derivatives[task[l0]],self.derivatives[l1],self.derivatives_coeffs[task[l0]],self.derivatives_coeffs[l1]) for l1 in range(self.num_tasks)],dim=-1)[...,None,:,:] for l0 in range(len(task))],dim=-3)
+        out = {}
+        if want_mean:
+            kmat_mean = kmat if torch.equal(nkmat,self.n) else torch.cat([kmat_l[...,:self.n[l]] for l,kmat_l in enumerate(kmat.split(nkmat.tolist(),-1))],dim=-1)
+            pmean = torch.einsum("...i,...i->...",kmat_mean,coeffs[...,None,None,:])
+            if "mean" in want: out["mean"] = pmean
+        if want_var:
+            kmat_new = torch.cat([kmat_tasks[...,task[l0],task[l0],None,None]*self._kernel(x,x,self.derivatives[task[l0]],self.derivatives[task[l0]],self.derivatives_coeffs[task[l0]],self.derivatives_coeffs[task[l0]])[...,None,:] for l0 in range(len(task))],dim=-2)
+            kmat_perm = torch.permute(kmat,[-3,-2]+[i for i in range(kmat.ndim-3)]+[-1])
+            t_perm = self.get_inv_log_det_cache(n).gram_matrix_solve(kmat_perm)
+            t = torch.permute(t_perm,[2+i for i in range(t_perm.ndim-3)]+[0,1,-1])
+            pvar = kmat_new-(t*kmat).sum(-1)
+            pvar[pvar<0] = 0
+            if "var" in want: out["var"] = pvar
+            pstd = torch.sqrt(pvar)
+            if "std" in want: out["std"] = pstd
+            if "error" in want or "ci" in want:
+                q = scipy.stats.norm.ppf(1-(1-confidence)/2)
+                out["quantile"] = q
+                perror = q*pstd
+                if "error" in want: out["error"] = perror
+                if "ci" in want:
+                    out["ci_low"] = pmean-perror
+                    out["ci_high"] = pmean+perror
+        if eval:
+            torch.set_grad_enabled(incoming_grad_enabled)
+        if inttask:
+            out = {key:(val if key=="quantile" else val[...,0,:]) for key,val in out.items()}
+        return out
     def post_error(self, x:torch.Tensor, task:Union[int,torch.Tensor]=None, n:Union[int,torch.Tensor]=None, confidence:float=0.99, eval:bool=True):
         """
         Posterior error. 
@@ -491,12 +816,8 @@ class AbstractGP(torch.nn.Module):
                 ```
             perror (torch.Tensor[T]): posterior error
         """
-        assert np.isscalar(confidence) and 0<confidence<1, "confidence must be between 0 and 1"
-        q = scipy.stats.norm.ppf(1-(1-confidence)/2)
-        pvar = self.post_var(x,task=task,n=n,eval=eval,)
-        pstd = torch.sqrt(pvar)
-        perror = q*pstd
-        return pvar,q,perror
+        out = self.post(x,task=task,n=n,want=("var","error"),confidence=confidence,eval=eval)
+        return out["var"],out["quantile"],out["error"]
     def post_ci(self, x:torch.Tensor, task:Union[int,torch.Tensor]=None, confidence:float=0.99, eval:bool=True):
         """
         Posterior credible interval.
@@ -517,13 +838,8 @@ class AbstractGP(torch.nn.Module):
             pci_low (torch.Tensor[...,T,N]): posterior credible interval lower bound
             pci_high (torch.Tensor[...,T,N]): posterior credible interval upper bound
         """
-        assert np.isscalar(confidence) and 0<confidence<1, "confidence must be between 0 and 1"
-        q = scipy.stats.norm.ppf(1-(1-confidence)/2)
-        pmean = self.post_mean(x,task=task,eval=eval)
-        pvar,q,perror = self.post_error(x,task=task,confidence=confidence)
-        pci_low = pmean-q*perror 
-        pci_high = pmean+q*perror
-        return pmean,pvar,q,pci_low,pci_high
+        out = self.post(x,task=task,want=("mean","var","ci"),confidence=confidence,eval=eval)
+        return out["mean"],out["var"],out["quantile"],out["ci_low"],out["ci_high"]
     def post_cubature_mean(self, task:Union[int,torch.Tensor]=None, eval:bool=True):
         """
         Posterior cubature mean. 
@@ -683,7 +999,15 @@ class AbstractGP(torch.nn.Module):
         if n is None: n = self.n[task]
         assert n>=0
         x,xb = self.xxb_seqs[task][:n]
-        return x
+        return self._replicate_points(x)
+    def _replicate_points(self, x):
+        # points of every replication from the stored points of the first replication
+        return x if self.replications==1 else self._replication_oplus(x)
+    def _replicate_queries(self, x):
+        # query locations seen from the first replication, valid as the kernel is invariant to the randomization
+        return x if self.replications==1 else self._replication_ominus(x)
+    def _shared_hyperparameters(self):
+        return self.raw_scale.ndim==1 and self.raw_lengthscales.ndim==1 and self.raw_noise.ndim==1 and self.raw_factor_task_kernel.ndim==2 and self.raw_noise_task_kernel.ndim==1
     def get_xb(self, task, n=None):
         assert 0<=task<self.num_tasks
         if n is None: n = self.n[task]
@@ -38,6 +38,22 @@ class FastGPDigitalNetB2(AbstractFastGP):
         >>> torch.linalg.norm(y-pmean)/torch.linalg.norm(y)
         tensor(0.0284)
         >>> assert torch.allclose(fgp.post_mean(fgp.x),fgp.y)
+        >>> xgrid,pmean_grid = fgp.post_mean_grid(2*n,shift=torch.tensor([0.3,0.6]))
+        >>> xgrid.shape
+        torch.Size([2048, 2])
+        >>> assert torch.allclose(pmean_grid,fgp.post_mean(xgrid))
+        >>> xgrid,samples = fgp.post_sample_grid(16,n=64,shift=torch.tensor([0.3,0.6]),generator=torch.Generator().manual_seed(7))
+        >>> samples.shape
+        torch.Size([16, 64])
+        >>> sampler = fgp.posterior_sampler(16,num_features=256,generator=torch.Generator().manual_seed(7))
+        >>> sampler(x).shape
+        torch.Size([16, 128])
+
+        >>> residuals,logscores,idx = fgp.cross_validate(folds=8)
+        >>> residuals.shape
+        torch.Size([8, 128])
+        >>> logscores.shape
+        torch.Size([8])
 
         >>> data = fgp.fit(verbose=0)
         >>> list(data.keys())
@@ -65,6 +81,9 @@ class FastGPDigitalNetB2(AbstractFastGP):
         torch.Size([128])
         >>> ci_high.shape
         torch.Size([128])
+        >>> pquery = fgp.post(x,want=("mean","var","ci"),confidence=0.99)
+        >>> assert torch.allclose(pquery["mean"],fgp.post_mean(x)) and torch.allclose(pquery["var"],pvar)
+        >>> assert torch.allclose(pquery["ci_low"],ci_low) and torch.allclose(pquery["ci_high"],ci_high)
 
         >>> fgp.post_cubature_mean()
         tensor(20.1888)
@@ -114,6 +133,15 @@ class FastGPDigitalNetB2(AbstractFastGP):
         >>> assert torch.allclose(fgp.post_cov(x,z),pcov_16n)
         >>> assert torch.allclose(fgp.post_var(x),pvar_16n)
         >>> assert torch.allclose(fgp.post_cubature_var(),pcvar_16n)
+
+        >>> import concurrent.futures
+        >>> fgp_int = FastGPDigitalNetB2(qmcpy.DigitalNetB2(dimension=d,seed=11))
+        >>> with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        ...     data = fgp_int.integrate(f_ackley,abs_tol=1e-1,n_init=2**8,max_n=2**12,executor=executor,refit=False)
+        >>> sorted(data.keys())
+        ['converged', 'n', 'pcerror', 'pcmean', 'rounds']
+        >>> assert data["converged"] or data["n"]==2**12
+        >>> assert all(r["n"]==2**8*2**i for i,r in enumerate(data["rounds"]))
     """
     _XBDTYPE = torch.int64
     _FTOUTDTYPE = torch.float64
@@ -150,6 +178,7 @@ class FastGPDigitalNetB2(AbstractFastGP):
             compile_fts:bool = False,
             compile_fts_kwargs: dict = {},
             adaptive_nugget:bool = False,
+            k1parts_storage:str = "full",
             ):
         """
         Args:
@@ -159,7 +188,10 @@ class FastGPDigitalNetB2(AbstractFastGP):
                 [qmcpy.DigitalNetB2(d,seed=seed,randomize="DS") for seed in np.random.SeedSequence(seed_for_seq).spawn(num_tasks)]
                 ```
                 See the <a href="https://qmcpy.readthedocs.io/en/latest/algorithms.html#module-qmcpy.discrete_distribution.digital_net_b2.digital_net_b2" target="_blank">`qmcpy.DigitalNetB2` docs</a> for more info. 
-                If `num_tasks==1` then randomize may be in `["FALSE","DS","LMS","LMS_DS"]`. 
+                If `num_tasks==1` then randomize may be in `["FALSE","DS","LMS","LMS_DS"]`.
+                A single task sequence with `replications=R>1` and randomize="DS" appends a replication axis of size `R` to `shape_batch`, 
+                so `get_x_next` returns points with shape `(R,n,d)` and `add_y_next` expects values with shape `shape_batch+(R,n)`; 
+                the kernel, its eigenvalues, and the inverse caches are shared across replications. 
             num_tasks (int): number of tasks 
             seed_for_seq (int): seed used for digital net randomization
             alpha (int): smoothness parameter
@@ -196,6 +228,10 @@ class FastGPDigitalNetB2(AbstractFastGP):
             compile_fts (bool): if `True`, use `torch.compile(qmcpy.fwht_torch,**compile_fts_kwargs)`, otherwise use the uncompiled version
             compile_fts_kwargs (dict): keyword arguments to `torch.compile`, see the `compile_fts` argument
             adaptive_nugget (bool): if True, use the adaptive nugget which modifies noises based on trace ratios.  
+            k1parts_storage (str): storage policy for the per dimension kernel parts used to update the eigenvalues when hyperparameters change. 
+                `"full"` stores the parts in the default dtype, `"float32"` stores them in single precision to halve their memory, 
+                and `"recompute"` stores nothing, recomputing the parts from `xb` in chunks whenever the eigenvalues are updated 
+                and deriving `x` from `xb` on demand instead of storing both. 
         """
         if num_tasks is None: 
             solo_task = True
@@ -214,7 +250,7 @@ class FastGPDigitalNetB2(AbstractFastGP):
         assert seqs.shape==(num_tasks,), "seqs should be a length num_tasks=%d list"%num_tasks
         assert all(isinstance(seqs[i],qmcpy.DigitalNetB2) for i in range(num_tasks)), "each seq should be a qmcpy.DigitalNetB2 instances"
         assert all(seqs[i].order=="NATURAL" for i in range(num_tasks)), "each seq should be in 'NATURAL' order "
-        assert all(seqs[i].replications==1 for i in range(num_tasks)) and "each seq should have only 1 replication"
+        assert seqs[0].replications==1 or seqs[0].randomize=="DS", "replications require randomize='DS'"
         if num_tasks==1:
             assert seqs[0].randomize in ['FALSE','DS','LMS','LMS_DS'], "seq should have randomize in ['FALSE','DS','LMS','LMS_DS']"
         else:
@@ -228,6 +264,7 @@ class FastGPDigitalNetB2(AbstractFastGP):
             alpha,
             ft,
             ift,
+            k1parts_storage,
             seqs,
             num_tasks,
             default_task,
@@ -265,12 +302,22 @@ class FastGPDigitalNetB2(AbstractFastGP):
         return 1
     def _sample(self, seq, n_min, n_max):
         _x = torch.from_numpy(seq(n_min=int(n_min),n_max=int(n_max),return_binary=True).astype(np.int64)).to(self.device)
+        if _x.ndim==3: _x = _x[0] # first replication
         x = self._convert_from_b(_x)
         return x,_x
+    def _replication_shifts(self, seq):
+        # digital shifts of each replication relative to the first
+        return torch.from_numpy((seq.rshift^seq.rshift[0]).astype(np.int64)).to(self.device)
+    def _replication_oplus(self, x):
+        return self._convert_from_b(self._convert_to_b(x)^self.replication_shifts[:,None,:])
+    def _replication_ominus(self, x):
+        return self._replication_oplus(x)
     def _convert_to_b(self, x):
         return torch.floor((x%1)*2**(self.t)).to(self._XBDTYPE)
     def _convert_from_b(self, xb):
         return xb*2**(-self.t)
+    def _oplus(self, xb, zb):
+        return xb^zb
     def _ominus(self, x_or_xb, z_or_zb):
         fp_x = torch.is_floating_point(x_or_xb)
         fp_z = torch.is_floating_point(z_or_zb)
@@ -299,3 +346,29 @@ class FastGPDigitalNetB2(AbstractFastGP):
             else:
                 omega[...,j] = qmcpy.kernel_methods.weighted_walsh_funcs(order[j].item(),delta[...,j],self.t)-1
         return (-2)**beta_plus_kappa*(ind+omega)
+    def _freeze_kernel(self):
+        return {"kernel":"digital_net_b2","product":True,"poly":torch.empty(0,device=self.device),"order":self.alpha.tolist(),"t":int(self.t)}
+    def _series_candidates(self, num_features):
+        return torch.arange(2**min(int(np.ceil(np.log2(num_features))),self.t),device=self.device)
+    def _series_rates(self, k, j):
+        # Walsh coefficients are 2^{-mu_alpha(k)} with mu_alpha the sum of the alpha largest 1-bit indices of k
+        alpha = self.alpha[j].item()
+        mu = torch.zeros_like(k)
+        count = torch.zeros_like(k)
+        for i in range(self.t,0,-1):
+            bit = (((k>>(i-1))&1)==1)&(count<alpha)
+            mu += i*bit
+            count += bit
+        if alpha==1: mu = 2*mu-1
+        return 2.**(-mu)
+    def _series_features(self, xb, freqs):
+        # wal_k(x) = (-1)^{sum_i k_{i-1} x_i} where x_i is bit t-i of xb
+        parity = torch.zeros((xb.size(0),freqs.size(0)),dtype=self._XBDTYPE,device=self.device)
+        for j in range(self.d):
+            mask = torch.zeros_like(freqs[:,j])
+            for i in range(1,self.t+1):
+                mask |= ((freqs[:,j]>>(i-1))&1)<<(self.t-i)
+            parity ^= xb[:,j,None]&mask
+        for s in [32,16,8,4,2,1]:
+            parity ^= parity>>s
+        return (1-2*(parity&1)).to(torch.get_default_dtype())
@@ -1,4 +1,5 @@
 from .abstract_fast_gp import AbstractFastGP
+from .frozen_gp import _bernoulli_poly_coeffs
 import torch 
 import qmcpy as qmcpy
 import numpy as np
@@ -38,12 +39,110 @@ class FastGPLattice(AbstractFastGP):
         >>> torch.linalg.norm(y-pmean)/torch.linalg.norm(y)
         tensor(0.0348)
         >>> assert torch.allclose(fgp.post_mean(fgp.x),fgp.y,atol=1e-3)
+        >>> xgrid,pmean_grid = fgp.post_mean_grid(2*n,shift=torch.tensor([0.3,0.6]))
+        >>> xgrid.shape
+        torch.Size([2048, 2])
+        >>> assert torch.allclose(pmean_grid,fgp.post_mean(xgrid))
+        >>> xgrid,samples = fgp.post_sample_grid(16,n=64,shift=torch.tensor([0.3,0.6]),generator=torch.Generator().manual_seed(7))
+        >>> samples.shape
+        torch.Size([16, 64])
+        >>> sampler = fgp.posterior_sampler(16,num_features=256,generator=torch.Generator().manual_seed(7))
+        >>> sampler(x).shape
+        torch.Size([16, 128])
 
         >>> fgp.post_cubature_mean()
         tensor(20.1842)
         >>> fgp.post_cubature_var()
         tensor(7.0015e-09)
 
+        >>> sched = fgp.schedule_doubling(torch.tensor([1.]))
+        >>> sched["task"],sched["n_next"]
+        (0, tensor([2048]))
+        >>> fgp.schedule_doubling(torch.tensor([1.]),abs_tol=1.)["task"] is None
+        True
+
+        >>> import asyncio
+        >>> async def run_design(gp):
+        ...     stream = gp.design_stream(2**6,batch_size=4,max_pending=16)
+        ...     async def simulate(idx, x):
+        ...         await asyncio.sleep(1e-3*(idx%3))
+        ...         await stream.put(idx,f_ackley(x))
+        ...     tasks = [asyncio.create_task(simulate(idx,x)) async for idx,x in stream]
+        ...     await stream.wait()
+        >>> fgp_stream = FastGPLattice(seqs = qmcpy.Lattice(dimension=d,seed=7))
+        >>> asyncio.run(run_design(fgp_stream))
+        >>> fgp_stream.n
+        tensor([64])
+        >>> torch.allclose(fgp_stream.y,f_ackley(fgp_stream.get_x(0)))
+        True
+
+        >>> import os
+        >>> import tempfile
+        >>> path = os.path.join(tempfile.mkdtemp(),"fgp.pt")
+        >>> fgp.save(path)
+        >>> fgp_loaded = FastGPLattice(seqs = qmcpy.Lattice(dimension=d,seed=7)).load(path,mmap=True)
+        >>> assert torch.allclose(fgp_loaded.post_mean(x),fgp.post_mean(x)) and torch.allclose(fgp_loaded.post_var(x),fgp.post_var(x))
+        >>> x_next = fgp_loaded.get_x_next(2*fgp_loaded.n)
+        >>> assert torch.allclose(x_next,fgp.get_x_next(2*fgp.n))
+
+        >>> fgp_budget = FastGPLattice(seqs = qmcpy.Lattice(dimension=d,seed=7))
+        >>> fgp_budget.add_y_next(f_ackley(fgp_budget.get_x_next(2**6)))
+        >>> data = fgp_budget.fit(iterations=3,verbose=0)
+        >>> pvar = fgp_budget.post_var(x)
+        >>> pvars = [fgp_budget.post_var(x,n=torch.tensor([2**m])) for m in range(6,10)]
+        >>> report = fgp_budget.cache_report()
+        >>> fgp_budget.set_cache_budget(report["total"]//2)
+        >>> report_bounded = fgp_budget.cache_report()
+        >>> assert report_bounded["total"]<report["total"] and report_bounded["evictions"]>0
+        >>> assert all(torch.allclose(fgp_budget.post_var(x,n=torch.tensor([2**m])),pvar) for m,pvar in zip(range(6,10),pvars))
+
+        >>> fgp_recompute = FastGPLattice(seqs = qmcpy.Lattice(dimension=d,seed=7),k1parts_storage="recompute")
+        >>> fgp_recompute.add_y_next(f_ackley(fgp_recompute.get_x_next(2**6)))
+        >>> data = fgp_recompute.fit(iterations=3,verbose=0)
+        >>> fgp_recompute.cache_report()["caches"]["k1parts_seq[0,0]"]
+        0
+        >>> assert torch.allclose(fgp_recompute.post_var(x),pvar)
+
+        >>> def f_integrands(x, k):
+        ...     return torch.stack([torch.cos((j+1)*x.sum(-1)) for j in range(k)],0)
+        >>> fgp_outputs = FastGPLattice(seqs = qmcpy.Lattice(dimension=d,seed=7),shape_batch=torch.Size([2]))
+        >>> x_outputs = fgp_outputs.get_x_next(2**6)
+        >>> fgp_outputs.add_y_next(f_integrands(x_outputs,2))
+        >>> data = fgp_outputs.fit(iterations=3,verbose=0)
+        >>> pmean_outputs = fgp_outputs.post_mean(x)
+        >>> from fastgps import Profiler
+        >>> with Profiler() as prof_outputs:
+        ...     fgp_outputs.add_outputs(f_integrands(x_outputs,5)[2:])
+        ...     pcmean_outputs = fgp_outputs.post_cubature_mean()
+        >>> fgp_outputs.shape_batch
+        torch.Size([5])
+        >>> sum(stat["misses"]+stat["recomputes"] for stat in prof_outputs.to_dict().values())
+        0
+        >>> fgp_all = FastGPLattice(seqs = qmcpy.Lattice(dimension=d,seed=7),shape_batch=torch.Size([5]))
+        >>> fgp_all.load_state_dict(fgp_outputs.state_dict())
+        <All keys matched successfully>
+        >>> fgp_all.add_y_next(f_integrands(fgp_all.get_x_next(2**6),5))
+        >>> assert torch.allclose(fgp_all.post_cubature_mean(),pcmean_outputs)
+        >>> assert torch.allclose(fgp_all.post_mean(x)[:2],pmean_outputs)
+
+        >>> fgp_reps = FastGPLattice(seqs = qmcpy.Lattice(dimension=d,replications=4,seed=7))
+        >>> x_reps = fgp_reps.get_x_next(2**6)
+        >>> x_reps.shape
+        torch.Size([4, 64, 2])
+        >>> fgp_reps.add_y_next(f_ackley(x_reps.reshape(-1,d)).reshape(4,-1))
+        >>> fgp_reps.post_mean(x).shape
+        torch.Size([4, 128])
+        >>> pcmean_reps = fgp_reps.post_cubature_mean()
+        >>> pcmean_reps.shape
+        torch.Size([4])
+        >>> assert torch.allclose(fgp_reps.post_mean(x_reps[2])[2],f_ackley(x_reps[2]),atol=1e-3)
+
+        >>> residuals,logscores,idx = fgp.cross_validate(folds=8)
+        >>> residuals.shape
+        torch.Size([8, 128])
+        >>> logscores.shape
+        torch.Size([8])
+
         >>> data = fgp.fit(verbose=0)
         >>> list(data.keys())
         ['iterations']
@@ -70,6 +169,9 @@ class FastGPLattice(AbstractFastGP):
         torch.Size([128])
         >>> ci_high.shape
         torch.Size([128])
+        >>> pquery = fgp.post(x,want=("mean","var","ci"),confidence=0.99)
+        >>> assert torch.allclose(pquery["mean"],fgp.post_mean(x)) and torch.allclose(pquery["var"],pvar)
+        >>> assert torch.allclose(pquery["ci_low"],ci_low) and torch.allclose(pquery["ci_high"],ci_high)
 
         >>> fgp.post_cubature_mean()
         tensor(20.1842)
@@ -155,11 +257,15 @@ class FastGPLattice(AbstractFastGP):
             compile_fts:bool = False,
             compile_fts_kwargs:dict = {},
             adaptive_nugget:bool = False,
+            k1parts_storage:str = "full",
             ):
         """
         Args:
             seqs ([int,qmcpy.Lattice,List]): list of lattice sequence generators
-                with order="NATURAL" and randomize in `["FALSE","SHIFT"]`. If an int `d` is passed in we use 
+                with order="NATURAL" and randomize in `["FALSE","SHIFT"]`. 
+                A single task sequence with `replications=R>1` and randomize="SHIFT" appends a replication axis of size `R` to `shape_batch`, 
+                so `get_x_next` returns points with shape `(R,n,d)` and `add_y_next` expects values with shape `shape_batch+(R,n)`; 
+                the kernel, its eigenvalues, and the inverse caches are shared across replications. If an int `d` is passed in we use 
                 ```python
                 [qmcpy.Lattice(d,seed=seed,randomize="SHIFT") for seed in np.random.SeedSequence(seed_for_seq).spawn(num_tasks)]
                 ```
@@ -200,6 +306,10 @@ class FastGPLattice(AbstractFastGP):
             compile_fts (bool): if `True`, use `torch.compile(qmcpy.fftbr_torch,**compile_fts)` and `torch.compile(qmcpy.ifftbr_torch,**compile_fts)`, otherwise use the uncompiled versions
             compile_fts_kwargs (dict): keyword arguments to `torch.compile`, see the `compile_fts argument`
             adaptive_nugget (bool): if True, use the adaptive nugget which modifies noises based on trace ratios.  
+            k1parts_storage (str): storage policy for the per dimension kernel parts used to update the eigenvalues when hyperparameters change. 
+                `"full"` stores the parts in the default dtype, `"float32"` stores them in single precision to halve their memory, 
+                and `"recompute"` stores nothing, recomputing the parts from `xb` in chunks whenever the eigenvalues are updated 
+                and deriving `x` from `xb` on demand instead of storing both. 
         """
         assert isinstance(alpha,int) and alpha in qmcpy.kernel_methods.shift_invar_ops.BERNOULLIPOLYSDICT.keys(), "alpha must be in %s"%list(qmcpy.kernel_methods.util.shift_invar_ops.BERNOULLIPOLYSDICT.keys())
         if num_tasks is None: 
@@ -219,14 +329,15 @@ class FastGPLattice(AbstractFastGP):
         assert seqs.shape==(num_tasks,), "seqs should be a length num_tasks=%d list"%num_tasks
         assert all(isinstance(seqs[i],qmcpy.Lattice) for i in range(num_tasks)), "each seq should be a qmcpy.Lattice instances"
         assert all(seqs[i].order=="NATURAL" for i in range(num_tasks)), "each seq should be in 'NATURAL' order "
-        assert all(seqs[i].replications==1 for i in range(num_tasks)) and "each seq should have only 1 replication"
         assert all(seqs[i].randomize in ['FALSE','SHIFT'] for i in range(num_tasks)), "each seq should have randomize in ['FALSE','SHIFT']"
+        assert seqs[0].replications==1 or seqs[0].randomize=="SHIFT", "replications require randomize='SHIFT'"
         ft = torch.compile(qmcpy.fftbr_torch,**compile_fts_kwargs) if compile_fts else qmcpy.fftbr_torch
         ift = torch.compile(qmcpy.ifftbr_torch,**compile_fts_kwargs) if compile_fts else qmcpy.ifftbr_torch
         super().__init__(
             alpha,
             ft,
             ift,
+            k1parts_storage,
             seqs,
             num_tasks,
             default_task,
@@ -260,6 +371,19 @@ class FastGPLattice(AbstractFastGP):
         )
     def get_omega(self, m):
         return torch.exp(-torch.pi*1j*torch.arange(2**m,device=self.device)/2**m)
+    def _replication_shifts(self, seq):
+        # shifts of each replication relative to the first
+        return torch.from_numpy((seq.shift-seq.shift[0])%1).to(self.device)
+    def _replication_oplus(self, x):
+        return (x+self.replication_shifts[:,None,:])%1
+    def _replication_ominus(self, x):
+        return (x-self.replication_shifts[:,None,:])%1
+    def _convert_to_b(self, x):
+        return x
+    def _convert_from_b(self, xb):
+        return xb
+    def _oplus(self, x, z):
+        return (x+z)%1
     def _ominus(self, x, z):
         assert ((0<=x)&(x<=1)).all(), "x should have all elements in [0,1]"
         assert ((0<=z)&(z<=1)).all(), "z should have all elements in [0,1]"
@@ -271,3 +395,26 @@ class FastGPLattice(AbstractFastGP):
         assert (2<=order).all(), "order must all be at least 2, but got order = %s"%str(order)
         coeff = (-1)**(self.alpha+kappa+1)*torch.exp(2*self.alpha*np.log(2*np.pi)-torch.lgamma(order+1))
         return coeff*torch.stack([qmcpy.kernel_methods.bernoulli_poly(order[j].item(),delta[...,j]) for j in range(self.d)],-1)
+    def _freeze_kernel(self):
+        # coefficients of the scaled Bernoulli polynomials, highest power first and left padded to a common degree
+        order = (2*self.alpha).tolist()
+        coeff = (-1)**(self.alpha+1)*torch.exp(2*self.alpha*np.log(2*np.pi)-torch.lgamma(2*self.alpha+1))
+        poly = torch.zeros((self.d,max(order)+1),device=self.device)
+        for j in range(self.d):
+            poly[j,max(order)-order[j]:] = coeff[j]*torch.tensor(_bernoulli_poly_coeffs(order[j]),device=self.device)
+        return {"kernel":"lattice","product":True,"poly":poly,"order":[],"t":0}
+    def _series_candidates(self, num_features):
+        return torch.arange(-num_features,num_features+1,device=self.device)
+    def _series_rates(self, k, j):
+        # Fourier coefficients of the scaled Bernoulli polynomial are |k|^{-2 alpha} for k != 0
+        return torch.where(k==0,1,k.abs()).to(torch.get_default_dtype())**(-2*self.alpha[j].item())
+    def _series_frequencies(self, num_features):
+        freqs = super()._series_frequencies(num_features)
+        # k and -k share a cosine and sine feature
+        first = freqs.gather(-1,(freqs!=0).to(torch.int64).argmax(-1,keepdim=True))
+        sign = torch.where(first<0,-1,1)
+        return torch.unique(sign*freqs,dim=0)
+    def _series_features(self, xb, freqs):
+        theta = 2*np.pi*xb@freqs.T.to(xb.dtype)
+        mult = torch.sqrt(torch.where((freqs==0).all(-1),1.,2.))
+        return torch.cat([mult*torch.cos(theta),mult*torch.sin(theta)],-1)
@@ -0,0 +1,100 @@
+import torch
+import torch.multiprocessing
+import multiprocessing
+import concurrent.futures
+import itertools
+import threading
+import os
+from typing import List
+
+_MODELS = {}
+_TOKENS = itertools.count()
+_LOCK = threading.Lock()
+
+def _init_worker(num_threads):
+    torch.set_num_threads(num_threads)
+
+def _fitted(model, fit_kwargs):
+    data = model.fit(**fit_kwargs)
+    return {name:p.detach() for name,p in model.named_parameters()},data
+
+def _fit_inherited(token, i, fit_kwargs):
+    # runs in a forked worker which inherited the models, so points and data are never pickled
+    return (i,)+_fitted(_MODELS[token][i],fit_kwargs)
+
+def _fit_passed(i, model, fit_kwargs):
+    return (i,)+_fitted(model,fit_kwargs)
+
+def fit_many(models:List, executor:concurrent.futures.Executor=None, workers:int=None, threads_per_worker:int=None, fit_kwargs:dict=None, callback:callable=None):
+    r"""
+    Fit many independent GP models in parallel.
+        By default models are fitted in a pool of forked processes which inherit the models copy on write,
+        so sampling locations, data, and caches are shared with the parent instead of being pickled,
+        and only the fitted hyperparameters and the data returned by `fit` are sent back.
+        Each worker limits `torch.set_num_threads` so the pool does not oversubscribe cores.
+        As each model finishes its fitted hyperparameters are copied into the model in the calling process
+        whose caches are then recomputed lazily on the next posterior query.
+
+    Examples:
+        >>> import fastgps
+        >>> torch.set_default_dtype(torch.float64)
+        >>> models = [fastgps.FastGPLattice(2,seed_for_seq=seed) for seed in range(4)]
+        >>> for k,model in enumerate(models):
+        ...     x = model.get_x_next(2**6)
+        ...     model.add_y_next(torch.sin((k+1)*x.sum(-1)))
+        >>> datas = fit_many(models,workers=2,fit_kwargs={"iterations":5,"verbose":0})
+        >>> [data["iterations"] for data in datas]
+        [5, 5, 5, 5]
+        >>> model_serial = fastgps.FastGPLattice(2,seed_for_seq=3)
+        >>> model_serial.add_y_next(torch.sin(4*model_serial.get_x_next(2**6).sum(-1)))
+        >>> data = model_serial.fit(iterations=5,verbose=0)
+        >>> assert torch.allclose(models[3].lengthscales,model_serial.lengthscales)
+
+    Args:
+        models (List[AbstractGP]): models with data added by `add_y_next`
+        executor (concurrent.futures.Executor): if not `None`, submit fits to this process based executor instead of a forked process pool.
+            Models are pickled to the executor, which requires picklable transforms in place of the default lambdas
+            or an executor serializing with `cloudpickle`. Thread pools are not supported as `fit` signals cache recomputation
+            through the process wide `FASTGP_FORCE_RECOMPILE` environment variable
+        workers (int): number of processes in the default pool, defaults to the number of CPUs capped at `len(models)`
+        threads_per_worker (int): torch threads in each process of the default pool, defaults to `torch.get_num_threads()//workers` and at least 1
+        fit_kwargs (dict): keyword arguments passed to each `fit`, defaults to `{"verbose":0}`
+        callback (callable): if not `None`, called as `callback(i,data)` in the calling process as soon as the hyperparameters of `models[i]` are updated
+
+    Returns:
+        datas (List[dict]): data returned by `fit` for each model, in the order of `models`
+    """
+    assert isinstance(models,(list,tuple)) and len(models)>0
+    if fit_kwargs is None: fit_kwargs = {"verbose":0}
+    assert "optimizer" not in fit_kwargs, "optimizers are bound to the parameters of one model, pass lr instead"
+    assert executor is None or isinstance(executor,concurrent.futures.Executor)
+    assert not isinstance(executor,concurrent.futures.ThreadPoolExecutor), "fit is not thread safe, use a process based executor"
+    datas = [None]*len(models)
+    token = None
+    if executor is None:
+        assert "fork" in multiprocessing.get_all_start_methods(), "the default pool requires the fork start method, pass an executor instead"
+        if workers is None: workers = min(os.cpu_count() or 1,len(models))
+        assert isinstance(workers,int) and workers>0
+        if threads_per_worker is None: threads_per_worker = max(1,torch.get_num_threads()//workers)
+        assert isinstance(threads_per_worker,int) and threads_per_worker>0
+        with _LOCK:
+            token = next(_TOKENS)
+            _MODELS[token] = models
+        pool = concurrent.futures.ProcessPoolExecutor(workers,mp_context=torch.multiprocessing.get_context("fork"),initializer=_init_worker,initargs=(threads_per_worker,))
+    try:
+        if executor is None:
+            futures = [pool.submit(_fit_inherited,token,i,fit_kwargs) for i in range(len(models))]
+        else:
+            futures = [executor.submit(_fit_passed,i,model,fit_kwargs) for i,model in enumerate(models)]
+        for future in concurrent.futures.as_completed(futures):
+            i,params,data = future.result()
+            with torch.no_grad():
+                for name,p in models[i].named_parameters(): p.copy_(params[name])
+            datas[i] = data
+            if callback is not None: callback(i,data)
+    finally:
+        if executor is None:
+            pool.shutdown(cancel_futures=True)
+            with _LOCK:
+                del _MODELS[token]
+    return datas
@@ -0,0 +1,212 @@
+import torch
+import math
+from typing import List,Tuple
+
+def _bernoulli_poly_coeffs(n):
+    # coefficients of the Bernoulli polynomial B_n(x) = sum_k binom(n,k) B_k x^{n-k}, highest power first
+    from fractions import Fraction
+    bnums = [Fraction(1)]
+    for m in range(1,n+1):
+        bnums.append(-sum(math.comb(m+1,k)*bnums[k] for k in range(m))/(m+1))
+    return [float(math.comb(n,k)*bnums[k]) for k in range(n+1)]
+
+def _frozen_unscaled_kernel(s:torch.Tensor, kernel:str) -> torch.Tensor:
+    if kernel=="gaussian":
+        return torch.exp(-s)
+    r = torch.where(s>0,torch.sqrt(torch.where(s>0,s,torch.ones_like(s))),torch.zeros_like(s))
+    if kernel=="matern12":
+        return torch.exp(-r)
+    elif kernel=="matern32":
+        return (1+math.sqrt(3)*r)*torch.exp(-math.sqrt(3)*r)
+    else: # "matern52"
+        return (1+math.sqrt(5)*r+5*r**2/3)*torch.exp(-math.sqrt(5)*r)
+
+def _frozen_walsh_part(order:int, delta:torch.Tensor, t:int, dtype:torch.dtype) -> torch.Tensor:
+    # weighted Walsh functions of Dick minus one, matching qmcpy.kernel_methods.weighted_walsh_funcs
+    deltaf = delta.to(dtype)
+    if order==1:
+        return 6*(1/6-torch.exp2(torch.log2(deltaf).floor()-t-1))
+    pos = delta>0
+    xf = torch.where(pos,deltaf*2.**(-t),torch.ones_like(deltaf))
+    beta = -torch.floor(torch.log2(xf))
+    if order==2:
+        y = -beta*xf+5/2*(1-torch.exp2(-beta))
+        zero = 5/2
+    elif order==3:
+        y = beta*xf**2-5*(1-torch.exp2(-beta))*xf+43/18*(1-torch.exp2(-2*beta))
+        zero = 43/18
+    else: # order==4
+        k4 = torch.zeros_like(deltaf)
+        for a in range(t):
+            factor = 2.**(-3*a)
+            if factor<1e-8: break
+            k4 = k4+(1-2*((delta>>(t-a-1))&1)).to(dtype)*factor
+        y = -2/3*beta*xf**3+5*(1-torch.exp2(-beta))*xf**2-43/9*(1-torch.exp2(-2*beta))*xf+701/294*(1-torch.exp2(-3*beta))+beta*(1/48*k4-1/42)
+        zero = 701/294
+    return torch.where(pos,y,zero*torch.ones_like(y))-1
+
+def _frozen_kernel(x:torch.Tensor, z:torch.Tensor, kernel:str, product:bool, scale:torch.Tensor, lengthscales:torch.Tensor, poly:torch.Tensor, order:List[int], t:int) -> torch.Tensor:
+    lengthscales = lengthscales[...,None,None,:]
+    if kernel=="lattice":
+        delta = (x[:,None,:]-z[None,:,:])%1
+        parts = poly[:,0]*torch.ones_like(delta)
+        for p in range(1,poly.size(1)):
+            parts = parts*delta+poly[:,p]
+        y = (1+lengthscales*parts).prod(-1)
+    elif kernel=="digital_net_b2":
+        delta = torch.floor((x%1)*2.**t).to(torch.int64)[:,None,:]^z[None,:,:]
+        parts = torch.stack([_frozen_walsh_part(order[j],delta[...,j],t,x.dtype) for j in range(len(order))],-1)
+        y = (1+lengthscales*parts).prod(-1)
+    else:
+        s = (x[:,None,:]-z[None,:,:])**2/(2*lengthscales)
+        y = _frozen_unscaled_kernel(s,kernel).prod(-1) if product else _frozen_unscaled_kernel(s.sum(-1),kernel)
+    return scale[...,None]*y
+
+def _fwht_ortho(x:torch.Tensor) -> torch.Tensor:
+    n = x.size(-1)
+    shape = x.shape
+    y = x.reshape(-1,n)
+    h = 1
+    while h<n:
+        y = y.reshape(-1,n//(2*h),2,h)
+        y = torch.stack([y[:,:,0,:]+y[:,:,1,:],y[:,:,0,:]-y[:,:,1,:]],2).reshape(-1,n)
+        h *= 2
+    return (y/math.sqrt(n)).reshape(shape)
+
+def _frozen_ft(x:torch.Tensor, bitrev:torch.Tensor, lattice:bool) -> torch.Tensor:
+    # same mean shifted orthonormal transforms as AbstractFastGP.ft
+    xmean = x.mean(-1,keepdim=True)
+    if lattice:
+        y = torch.fft.fft(torch.index_select(x-xmean,-1,bitrev),norm="ortho")
+    else:
+        y = _fwht_ortho(x-xmean)
+    y[...,0] += xmean[...,0]*math.sqrt(x.size(-1))
+    return y
+
+def _frozen_post_var(k:torch.Tensor, cross:torch.Tensor, prior_var:torch.Tensor, var_mode:str, chol:torch.Tensor, inv:torch.Tensor, ns:List[int], task_order:List[int], bitrevs:List[torch.Tensor], lattice:bool) -> torch.Tensor:
+    pvars = []
+    for i in range(cross.size(-2)):
+        kv = cross[...,i,None,:]*k
+        if var_mode=="dense":
+            quad = (torch.linalg.solve_triangular(chol,kv.transpose(-2,-1),upper=False)**2).sum(-2)
+        else: # "spectral"
+            kvs = torch.movedim(kv,-2,0).split(ns,dim=-1)
+            kts = []
+            nmin = max(ns)
+            for l in task_order:
+                if ns[l]==0: continue
+                kts.append(_frozen_ft(kvs[l],bitrevs[l],lattice))
+                nmin = min(nmin,ns[l])
+            kt = torch.cat(kts,dim=-1)
+            z = kt.reshape(list(kt.shape[:-1])+[1,-1,nmin])
+            z = (z*inv).sum(-2).reshape(kt.shape)
+            quad = torch.movedim((kt.conj()*z).real.sum(-1),0,-1)
+        pvars.append((prior_var[...,i,None]-quad).clamp_min(0.))
+    return torch.stack(pvars,-2)
+
+class FrozenGP(object):
+    r"""
+    Inference only snapshot of a fitted GP returned by `AbstractGP.freeze`.
+        Holds the sampling locations, the coefficients folded with the task covariance, the transformed hyperparameters,
+        and the factor needed for the posterior variance:
+        the lower Cholesky factor of the Gram matrix for `StandardGP`,
+        or the inverse of the diagonalized Gram matrix in the fast transform domain for `FastGPLattice` and `FastGPDigitalNetB2`.
+        Queries skip gradient tracking, cache checks, and input validation.
+        Models using derivative information are not supported.
+
+    Examples:
+        >>> import qmcpy
+        >>> import fastgps
+        >>> torch.set_default_dtype(torch.float64)
+        >>> x = torch.rand((2**7,3),generator=torch.Generator().manual_seed(17))
+        >>> for fgp in [fastgps.FastGPLattice(qmcpy.Lattice(dimension=3,seed=7)),fastgps.FastGPDigitalNetB2(qmcpy.DigitalNetB2(dimension=3,seed=7))]:
+        ...     fgp.add_y_next(torch.sin(fgp.get_x_next(2**8).sum(-1)))
+        ...     frozen = fgp.freeze()
+        ...     pmean,pvar = frozen.post(x)
+        ...     assert torch.allclose(pmean,fgp.post_mean(x)) and torch.allclose(pvar,fgp.post_var(x))
+        ...     scripted = frozen.to_torchscript()
+        ...     assert all(torch.allclose(a,b) for a,b in zip(scripted(x),(pmean,pvar)))
+    """
+    __slots__ = ("d","inttask","kernel","product","scale","lengthscales","poly","order","t","x","weights","cross","prior_var","var_mode","chol","inv","ns","task_order","bitrevs","lattice")
+    def __init__(self, **kwargs):
+        for name in self.__slots__: setattr(self,name,kwargs[name])
+    def _kernel(self, x):
+        return _frozen_kernel(x,self.x,self.kernel,self.product,self.scale,self.lengthscales,self.poly,self.order,self.t)
+    def _post_var(self, k):
+        return _frozen_post_var(k,self.cross,self.prior_var,self.var_mode,self.chol,self.inv,self.ns,self.task_order,self.bitrevs,self.lattice)
+    def post_mean(self, x:torch.Tensor):
+        """
+        Posterior mean.
+
+        Args:
+            x (torch.Tensor[N,d]): sampling locations
+
+        Returns:
+            pmean (torch.Tensor[...,T,N]): posterior mean, without the task dimension if the predictor was frozen for an int task
+        """
+        with torch.no_grad():
+            pmean = torch.einsum("...qj,...ij->...iq",self._kernel(x),self.weights)
+        return pmean[...,0,:] if self.inttask else pmean
+    def post_var(self, x:torch.Tensor):
+        """
+        Posterior variance.
+
+        Args:
+            x (torch.Tensor[N,d]): sampling locations
+
+        Returns:
+            pvar (torch.Tensor[...,T,N]): posterior variance, without the task dimension if the predictor was frozen for an int task
+        """
+        with torch.no_grad():
+            pvar = self._post_var(self._kernel(x))
+        return pvar[...,0,:] if self.inttask else pvar
+    def post(self, x:torch.Tensor):
+        """
+        Posterior mean and variance sharing one evaluation of the cross kernel matrix.
+
+        Args:
+            x (torch.Tensor[N,d]): sampling locations
+
+        Returns:
+            pmean (torch.Tensor[...,T,N]): posterior mean
+            pvar (torch.Tensor[...,T,N]): posterior variance
+        """
+        with torch.no_grad():
+            k = self._kernel(x)
+            pmean = torch.einsum("...qj,...ij->...iq",k,self.weights)
+            pvar = self._post_var(k)
+        return (pmean[...,0,:],pvar[...,0,:]) if self.inttask else (pmean,pvar)
+    def to_torchscript(self):
+        """
+        Export the predictor as a TorchScript module whose `forward(x)` returns the posterior mean and variance.
+            The module can be saved with `torch.jit.save` and served without `fastgps`.
+
+        Returns:
+            module (torch.jit.ScriptModule): scripted predictor
+        """
+        return torch.jit.script(_FrozenGPModule(self))
+
+class _FrozenGPModule(torch.nn.Module):
+    inttask: bool
+    kernel: str
+    product: bool
+    order: List[int]
+    t: int
+    var_mode: str
+    ns: List[int]
+    task_order: List[int]
+    bitrevs: List[torch.Tensor]
+    lattice: bool
+    def __init__(self, frozen:FrozenGP):
+        super().__init__()
+        for name in FrozenGP.__slots__:
+            if name=="d": continue
+            value = getattr(frozen,name)
+            if isinstance(value,torch.Tensor): self.register_buffer(name,value)
+            else: setattr(self,name,value)
+    def forward(self, x:torch.Tensor) -> Tuple[torch.Tensor,torch.Tensor]:
+        k = _frozen_kernel(x,self.x,self.kernel,self.product,self.scale,self.lengthscales,self.poly,self.order,self.t)
+        pmean = torch.einsum("...qj,...ij->...iq",k,self.weights)
+        pvar = _frozen_post_var(k,self.cross,self.prior_var,self.var_mode,self.chol,self.inv,self.ns,self.task_order,self.bitrevs,self.lattice)
+        if self.inttask: return pmean[...,0,:],pvar[...,0,:]
+        return pmean,pvar
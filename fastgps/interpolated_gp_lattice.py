@@ -0,0 +1,348 @@
+from .abstract_gp import AbstractGP
+from .abstract_fast_gp import AbstractFastGP
+from .fast_gp_lattice import FastGPLattice
+from .util import (
+    DummyDiscreteDistrib,
+    _InterpSeq,
+    _InterpolatedInverseLogDetCache,
+)
+import torch
+import numpy as np
+import scipy.stats
+import qmcpy as qmcpy
+from typing import Tuple,Union
+
+class InterpolatedGPLattice(AbstractGP):
+    r"""
+    Gaussian process regression for scattered data using structured kernel interpolation onto a rank-1 lattice.
+        The Gram matrix is approximated by $\mathsf{W} \mathsf{K}_\text{grid} \mathsf{W}^T + \sigma^2 \mathsf{I}$
+        where $\mathsf{K}_\text{grid}$ is the circulant Gram matrix of the shift invariant kernel used by `FastGPLattice`
+        on the first `n_grid` points of an unrandomized lattice and $\mathsf{W}$ holds sparse inverse distance interpolation weights
+        from each sampling location to its `num_interp_points` nearest grid points.
+        Matrix vector products cost $\mathcal{O}(n q + m \log m)$ for $q$ interpolation points and $m$ grid points,
+        linear systems are solved with conjugate gradients,
+        and the log determinant in the marginal log likelihood is estimated with stochastic Lanczos quadrature.
+        Predictions interpolate the query locations onto the grid in the same way, 
+        so the cross covariance $\mathsf{W}_* \mathsf{K}_\text{grid} \mathsf{W}^T$ is consistent with the approximate Gram matrix.
+        Only single task problems without derivative information and `fit(loss_metric="MLL")` are supported.
+
+    Examples:
+        >>> torch.set_default_dtype(torch.float64)
+
+        >>> def f_ackley(x, a=20, b=0.2, c=2*np.pi, scaling=32.768):
+        ...     # https://www.sfu.ca/~ssurjano/ackley.html
+        ...     assert x.ndim==2
+        ...     x = 2*scaling*x-scaling
+        ...     t1 = a*torch.exp(-b*torch.sqrt(torch.mean(x**2,1)))
+        ...     t2 = torch.exp(torch.mean(torch.cos(c*x),1))
+        ...     t3 = a+np.exp(1)
+        ...     y = -t1-t2+t3
+        ...     return y
+
+        >>> n = 2**8
+        >>> d = 2
+        >>> rng = torch.Generator().manual_seed(7)
+        >>> x_data = torch.rand((n,d),generator=rng)
+        >>> igp = InterpolatedGPLattice(d,data={"x":x_data,"y":f_ackley(x_data)},n_grid=2**12)
+
+        >>> x = torch.rand((2**7,d),generator=rng)
+        >>> y = f_ackley(x)
+        >>> pmean = igp.post_mean(x)
+        >>> pmean.shape
+        torch.Size([128])
+        >>> pvar = igp.post_var(x)
+        >>> pvar.shape
+        torch.Size([128])
+        >>> assert (pvar>=0).all()
+
+        Compare against a dense GP with the same lattice kernel 
+
+        >>> kmat = igp.kernel(x_data[:,None,:],x_data[None,:,:])+igp.noise*torch.eye(n)
+        >>> kmat_cross = igp.kernel(x[:,None,:],x_data[None,:,:])
+        >>> pmean_dense = kmat_cross@torch.linalg.solve(kmat,f_ackley(x_data))
+        >>> pvar_dense = igp.kernel(x,x)-(kmat_cross*torch.linalg.solve(kmat,kmat_cross.T).T).sum(-1)
+        >>> assert torch.linalg.norm(pmean-pmean_dense)<0.05*torch.linalg.norm(pmean_dense)
+        >>> assert torch.linalg.norm(pmean-y)<0.1*torch.linalg.norm(y)
+        >>> assert torch.linalg.norm(pvar-pvar_dense)<0.25*torch.linalg.norm(pvar_dense)
+        >>> pcov = igp.post_cov(x,x)
+        >>> assert torch.allclose(pcov.diagonal(),pvar)
+
+        >>> data = igp.fit(iterations=5,verbose=0)
+        >>> list(data.keys())
+        ['iterations']
+        >>> igp.post_mean(x).shape
+        torch.Size([128])
+        >>> igp.post_cubature_mean().shape
+        torch.Size([])
+    """
+    _XBDTYPE = torch.float64
+    _FTOUTDTYPE = torch.complex128
+    _ominus = FastGPLattice._ominus
+    _kernel_parts_from_delta = FastGPLattice._kernel_parts_from_delta
+    _kernel_parts = AbstractFastGP._kernel_parts
+    _kernel_from_parts = AbstractFastGP._kernel_from_parts
+    _kernel = AbstractFastGP._kernel
+    ft = AbstractFastGP.ft
+    ift = AbstractFastGP.ift
+    def __init__(self,
+            seqs:Union[qmcpy.DiscreteDistribution,int],
+            seed_for_seq:int = None,
+            alpha:int = 2,
+            n_grid:int = 2**12,
+            num_interp_points:int = None,
+            scale:float = 1.,
+            lengthscales:Union[torch.Tensor,float] = 1.,
+            noise:float = 1e-4,
+            device:torch.device = "cpu",
+            tfs_scale:Tuple[callable,callable] = ((lambda x: torch.log(x)),(lambda x: torch.exp(x))),
+            tfs_lengthscales:Tuple[callable,callable] = ((lambda x: torch.log(x)),(lambda x: torch.exp(x))),
+            tfs_noise:Tuple[callable,callable] = ((lambda x: torch.log(x)),(lambda x: torch.exp(x))),
+            requires_grad_scale:bool = True,
+            requires_grad_lengthscales:bool = True,
+            requires_grad_noise:bool = False,
+            shape_batch:torch.Size = torch.Size([]),
+            shape_scale:torch.Size = torch.Size([1]),
+            shape_lengthscales:torch.Size = None,
+            shape_noise:torch.Size = torch.Size([1]),
+            data:dict = None,
+            cg_tol:float = 1e-6,
+            cg_max_iters:int = 500,
+            num_probes:int = 16,
+            seed_for_probes:int = 7,
+            compile_fts:bool = False,
+            compile_fts_kwargs:dict = {},
+            ):
+        """
+        Args:
+            seqs (Union[int,qmcpy.DiscreteDistribution]): sequence generator for the scattered sampling locations. If an int `d` is passed in we use
+                ```python
+                qmcpy.DigitalNetB2(d,seed=seed_for_seq,order="GRAY")
+                ```
+            seed_for_seq (int): seed used for the default sequence
+            alpha (int): smoothness parameter of the lattice kernel
+            n_grid (int): number of lattice grid points, must be a power of 2
+            num_interp_points (int): number of nearest grid points each sampling location interpolates from, defaults to `d+1`
+            scale (float): kernel global scaling parameter
+            lengthscales (Union[torch.Tensor[d],float]): vector of kernel lengthscales.
+                If a scalar is passed in then `lengthscales` is set to a constant vector.
+            noise (float): positive noise variance i.e. nugget term
+            device (torch.device): torch device which is required to support `torch.float64`
+            tfs_scale (Tuple[callable,callable]): the first argument transforms to the raw value to be optimized, the second applies the inverse transform
+            tfs_lengthscales (Tuple[callable,callable]): the first argument transforms to the raw value to be optimized, the second applies the inverse transform
+            tfs_noise (Tuple[callable,callable]): the first argument transforms to the raw value to be optimized, the second applies the inverse transform
+            requires_grad_scale (bool): wheather or not to optimize the scale parameter
+            requires_grad_lengthscales (bool): wheather or not to optimize lengthscale parameters
+            requires_grad_noise (bool): wheather or not to optimize the noise parameter
+            shape_batch (torch.Size): shape of the batch output
+            shape_scale (torch.Size): shape of the scale parameter, defaults to `torch.Size([1])`
+            shape_lengthscales (torch.Size): shape of the lengthscales parameter, defaults to `torch.Size([d])` where `d` is the dimension
+            shape_noise (torch.Size): shape of the noise parameter, defaults to `torch.Size([1])`
+            data (dict): dictory of data with keys 'x' and 'y' where data['x'] and data['y'] are both `torch.Tensor`s
+            cg_tol (float): relative residual tolerance for conjugate gradients
+            cg_max_iters (int): maximum number of conjugate gradient iterations
+            num_probes (int): number of Rademacher probe vectors for the stochastic log determinant estimate
+            seed_for_probes (int): seed for the probe vectors, which are fixed across fitting iterations
+            compile_fts (bool): if `True`, use `torch.compile(qmcpy.fftbr_torch,**compile_fts)` and `torch.compile(qmcpy.ifftbr_torch,**compile_fts)`, otherwise use the uncompiled versions
+            compile_fts_kwargs (dict): keyword arguments to `torch.compile`, see the `compile_fts argument`
+        """
+        assert isinstance(alpha,int) and alpha in qmcpy.kernel_methods.shift_invar_ops.BERNOULLIPOLYSDICT.keys(), "alpha must be in %s"%list(qmcpy.kernel_methods.util.shift_invar_ops.BERNOULLIPOLYSDICT.keys())
+        assert isinstance(n_grid,int) and n_grid>1 and n_grid&(n_grid-1)==0, "n_grid must be a power of 2"
+        assert np.isscalar(cg_tol) and cg_tol>0
+        assert isinstance(cg_max_iters,int) and cg_max_iters>0
+        assert isinstance(num_probes,int) and num_probes>0
+        if data is not None:
+            assert isinstance(seqs,int), "passing in data requires seqs (the first argument) is a int specifying the dimension"
+            assert isinstance(data,dict) and "x" in data and "y" in data, "data must be a dict with keys 'x' and 'y'"
+            assert isinstance(data["x"],torch.Tensor) and data["x"].ndim==2 and data["x"].size(1)==seqs, "data['x'] should be a 2d tensor with number of columns equal to the dimension"
+            assert isinstance(data["y"],torch.Tensor) and data["y"].ndim>=1, "data['y'] should be a tensor"
+            seqs = DummyDiscreteDistrib(data["x"].cpu().detach().numpy())
+        elif isinstance(seqs,int):
+            seqs = qmcpy.DigitalNetB2(seqs,seed=seed_for_seq,order="GRAY")
+        assert isinstance(seqs,qmcpy.discrete_distribution.AbstractDiscreteDistribution), "seqs should be an int or a qmcpy.DiscreteDistribution"
+        seqs = np.array([seqs],dtype=object)
+        assert seqs[0].replications==1 and "seq should have only 1 replication"
+        self.n_grid = n_grid
+        self.cg_tol = cg_tol
+        self.cg_max_iters = cg_max_iters
+        self.num_probes = num_probes
+        self.seed_for_probes = seed_for_probes
+        self.ft_unstable = torch.compile(qmcpy.fftbr_torch,**compile_fts_kwargs) if compile_fts else qmcpy.fftbr_torch
+        self.ift_unstable = torch.compile(qmcpy.ifftbr_torch,**compile_fts_kwargs) if compile_fts else qmcpy.ifftbr_torch
+        super().__init__(
+            seqs,
+            1,
+            0,
+            True,
+            scale,
+            lengthscales,
+            noise,
+            1.,
+            None,
+            1.,
+            device,
+            tfs_scale,
+            tfs_lengthscales,
+            tfs_noise,
+            (lambda x: x, lambda x: x),
+            ((lambda x: torch.log(x)),(lambda x: torch.exp(x))),
+            requires_grad_scale,
+            requires_grad_lengthscales,
+            requires_grad_noise,
+            False,
+            False,
+            shape_batch,
+            shape_scale,
+            shape_lengthscales,
+            shape_noise,
+            None,
+            None,
+            None,
+            None,
+            False,
+        )
+        self.alpha = alpha*torch.ones(self.d,dtype=int,device=self.device)
+        if num_interp_points is None: num_interp_points = self.d+1
+        assert isinstance(num_interp_points,int) and 0<num_interp_points<=n_grid
+        grid_seq = qmcpy.Lattice(self.d,randomize="FALSE",order="NATURAL")
+        self.xgrid = torch.from_numpy(grid_seq(n_min=0,n_max=n_grid)).to(self.device)
+        self.interp_seq = _InterpSeq(self,self.xxb_seqs[0],self.xgrid,num_interp_points)
+        if data is not None:
+            self.add_y_next(data["y"])
+    def get_default_optimizer(self, lr):
+        if lr is None: lr = 1e-1
+        return torch.optim.Rprop(self.parameters(),lr=lr)
+    _SNAPSHOT_CACHES = AbstractGP._SNAPSHOT_CACHES+("interp_seq",)
+    def _new_inv_log_det_cache(self, n):
+        return _InterpolatedInverseLogDetCache(self,n)
+    def fit(self, loss_metric:str="MLL", *args, **kwargs):
+        """
+        See `AbstractGP.fit`, only `loss_metric="MLL"` is supported.
+        """
+        assert isinstance(loss_metric,str) and loss_metric.upper()=="MLL", "InterpolatedGPLattice only supports loss_metric='MLL'"
+        return super().fit(loss_metric,*args,**kwargs)
+    def cross_validate(self, folds:int=4, eval:bool=True):
+        assert False, "InterpolatedGPLattice does not support cross validation"
+    def freeze(self, task:Union[int,torch.Tensor]=None):
+        assert False, "InterpolatedGPLattice does not support freeze"
+    def _interp_rows(self, x, n):
+        # interpolation weights of x onto the grid and the rows of W_x K_grid
+        assert x.ndim==2 and x.size(1)==self.d, "x must a torch.Tensor with shape (-1,d)"
+        idx,weights = self.interp_seq._interp_weights(x.to(self._XBDTYPE))
+        u = torch.zeros((len(x),self.n_grid),dtype=weights.dtype,device=self.device).scatter_add(-1,idx,weights)
+        lam = self.get_inv_log_det_cache(n)()
+        return idx,weights,self.ift(lam[...,None,:]*self.ft(u)).real
+    def _interp_cross(self, rows, idx, weights):
+        # W_x K_grid W_z^T from the rows of W_x K_grid and the interpolation weights of z
+        return (rows[...,idx]*weights).sum(-1)
+    def _interp_solve(self, kmat, n):
+        kmat_perm = torch.movedim(kmat,-2,0)
+        return torch.movedim(self.get_inv_log_det_cache(n).gram_matrix_solve(kmat_perm),0,-2)
+    def _parse_task(self, task):
+        if task is None: task = self.default_task
+        inttask = isinstance(task,int)
+        if isinstance(task,list): task = torch.tensor(task,dtype=int)
+        assert (task==0) if inttask else (task.ndim==1 and (task==0).all()), "InterpolatedGPLattice only supports a single task"
+        return inttask,task
+    def post_mean(self, x:torch.Tensor, task:Union[int,torch.Tensor]=None, eval:bool=True):
+        return self.post(x,task=task,want="mean",eval=eval)["mean"]
+    def post_var(self, x:torch.Tensor, task:Union[int,torch.Tensor]=None, n:Union[int,torch.Tensor]=None, eval:bool=True):
+        return self.post(x,task=task,n=n,want="var",eval=eval)["var"]
+    def post(self, x:torch.Tensor, task:Union[int,torch.Tensor]=None, n:Union[int,torch.Tensor]=None, want:Union[str,tuple]=("mean","var"), confidence:float=0.99, eval:bool=True):
+        if isinstance(want,str): want = (want,)
+        want = tuple(w.lower() for w in want)
+        assert all(w in ["mean","var","std","error","ci"] for w in want), "want must be a subset of ('mean','var','std','error','ci')"
+        want_mean = "mean" in want or "ci" in want
+        want_var = any(w in want for w in ["var","std","error","ci"])
+        assert np.isscalar(confidence) and 0<confidence<1, "confidence must be between 0 and 1"
+        if n is None: n = self.n
+        if isinstance(n,int): n = torch.tensor([n],dtype=int,device=self.device)
+        assert isinstance(n,torch.Tensor) and (n>=self.n).all()
+        if want_mean: coeffs = self.coeffs
+        if eval:
+            incoming_grad_enabled = torch.is_grad_enabled()
+            torch.set_grad_enabled(False)
+        inttask,task = self._parse_task(task)
+        idx_x,weights_x,rows = self._interp_rows(x,n)
+        nkmat = n if want_var else self.n
+        kmat = self._interp_cross(rows,*self.interp_seq[:nkmat[0]])
+        out = {}
+        if want_mean:
+            pmean = torch.einsum("...i,...i->...",kmat[...,:self.n[0]],coeffs[...,None,:])
+            if "mean" in want: out["mean"] = pmean
+        if want_var:
+            kmat_new = (rows.gather(-1,idx_x.expand(rows.shape[:-2]+idx_x.shape))*weights_x).sum(-1)
+            pvar = kmat_new-(self._interp_solve(kmat,n)*kmat).sum(-1)
+            pvar[pvar<0] = 0
+            if "var" in want: out["var"] = pvar
+            pstd = torch.sqrt(pvar)
+            if "std" in want: out["std"] = pstd
+            if "error" in want or "ci" in want:
+                q = scipy.stats.norm.ppf(1-(1-confidence)/2)
+                out["quantile"] = q
+                perror = q*pstd
+                if "error" in want: out["error"] = perror
+                if "ci" in want:
+                    out["ci_low"] = pmean-perror
+                    out["ci_high"] = pmean+perror
+        if eval:
+            torch.set_grad_enabled(incoming_grad_enabled)
+        if not inttask:
+            out = {key:(val if key=="quantile" else val[...,None,:].expand(val.shape[:-1]+(len(task),val.size(-1)))) for key,val in out.items()}
+        return out
+    def post_cov(self, x0:torch.Tensor, x1:torch.Tensor, task0:Union[int,torch.Tensor]=None, task1:Union[int,torch.Tensor]=None, n:Union[int,torch.Tensor]=None, eval:bool=True):
+        if n is None: n = self.n
+        if isinstance(n,int): n = torch.tensor([n],dtype=int,device=self.device)
+        assert isinstance(n,torch.Tensor) and (n>=self.n).all()
+        if eval:
+            incoming_grad_enabled = torch.is_grad_enabled()
+            torch.set_grad_enabled(False)
+        inttask0,task0 = self._parse_task(task0)
+        inttask1,task1 = self._parse_task(task1)
+        equal = torch.equal(x0,x1)
+        _,_,rows0 = self._interp_rows(x0,n)
+        idx_x1,weights_x1,rows1 = self._interp_rows(x1,n)
+        idx,weights = self.interp_seq[:n[0]]
+        kmat1 = self._interp_cross(rows0,idx,weights)
+        kmat2 = kmat1 if equal else self._interp_cross(rows1,idx,weights)
+        kmat_new = self._interp_cross(rows0,idx_x1,weights_x1)
+        kmat = kmat_new-torch.einsum("...ik,...jk->...ij",kmat1,self._interp_solve(kmat2,n))
+        if equal:
+            diag = kmat.diagonal(dim1=-2,dim2=-1)
+            diag[diag<0] = 0
+        if eval:
+            torch.set_grad_enabled(incoming_grad_enabled)
+        if not inttask1: kmat = kmat[...,None,:,:].expand(kmat.shape[:-2]+(len(task1),)+kmat.shape[-2:])
+        if not inttask0: kmat = kmat.unsqueeze(-3 if inttask1 else -4).expand(kmat.shape[:kmat.ndim-(2 if inttask1 else 3)]+(len(task0),)+kmat.shape[kmat.ndim-(2 if inttask1 else 3):])
+        return kmat
+    def post_cubature_mean(self, task:Union[int,torch.Tensor]=None, eval:bool=True):
+        coeffs = self.coeffs
+        if eval:
+            incoming_grad_enabled = torch.is_grad_enabled()
+            torch.set_grad_enabled(False)
+        if task is None: task = self.default_task
+        inttask = isinstance(task,int)
+        if isinstance(task,list): task = torch.tensor(task,dtype=int)
+        assert (task==0) if inttask else (task.ndim==1 and (task==0).all()), "InterpolatedGPLattice only supports a single task"
+        # the lattice kernel integrates to the scale in its second argument
+        pcmean = (self.scale*coeffs).sum(-1)
+        if eval:
+            torch.set_grad_enabled(incoming_grad_enabled)
+        return pcmean if inttask else pcmean[...,None].expand(pcmean.shape+(len(task),))
+    def post_cubature_var(self, task:Union[int,torch.Tensor]=None, n:Union[int,torch.Tensor]=None, eval:bool=True):
+        if n is None: n = self.n
+        if isinstance(n,int): n = torch.tensor([n],dtype=int,device=self.device)
+        assert isinstance(n,torch.Tensor) and (n>=self.n).all()
+        if eval:
+            incoming_grad_enabled = torch.is_grad_enabled()
+            torch.set_grad_enabled(False)
+        if task is None: task = self.default_task
+        inttask = isinstance(task,int)
+        if isinstance(task,list): task = torch.tensor(task,dtype=int)
+        assert (task==0) if inttask else (task.ndim==1 and (task==0).all()), "InterpolatedGPLattice only supports a single task"
+        v = self.get_inv_log_det_cache(n).gram_matrix_solve(torch.ones(n[0].item(),device=self.device))
+        scale = self.scale[...,0]
+        pcvar = scale-scale**2*v.sum(-1)
+        pcvar = pcvar.clamp(min=0)
+        if eval:
+            torch.set_grad_enabled(incoming_grad_enabled)
+        return pcvar if inttask else pcvar[...,None].expand(pcvar.shape+(len(task),))
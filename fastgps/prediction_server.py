@@ -0,0 +1,124 @@
+import torch
+import threading
+import queue
+import time
+from concurrent.futures import Future
+from .frozen_gp import FrozenGP
+
+class PredictionServer(object):
+    r"""
+    Micro-batching dispatcher around a `FrozenGP` returned by `AbstractGP.serve`.
+        Requests submitted from any number of threads are collected by a single worker thread
+        for up to `max_wait` seconds or `max_batch_size` points,
+        evaluated with one vectorized call to `FrozenGP.post`,
+        and scattered back to the callers through `concurrent.futures.Future` objects.
+        The frozen predictor never mutates its tensors, so no locks are taken around the evaluation.
+
+    Examples:
+        >>> import qmcpy
+        >>> import fastgps
+        >>> from concurrent.futures import ThreadPoolExecutor
+        >>> torch.set_default_dtype(torch.float64)
+        >>> fgp = fastgps.FastGPLattice(qmcpy.Lattice(dimension=2,seed=7))
+        >>> fgp.add_y_next(torch.sin(fgp.get_x_next(2**8).sum(-1)))
+        >>> x = torch.rand((32,2),generator=torch.Generator().manual_seed(17))
+        >>> with fgp.serve(max_batch_size=16,max_wait=1e-3) as server:
+        ...     with ThreadPoolExecutor(8) as pool:
+        ...         results = list(pool.map(server.post,x))
+        ...     pmean,pvar = server.submit(x).result()
+        >>> assert torch.allclose(torch.stack([pm for pm,pv in results]),pmean)
+        >>> assert torch.allclose(torch.stack([pv for pm,pv in results]),pvar)
+        >>> assert torch.allclose(pmean,fgp.post_mean(x)) and torch.allclose(pvar,fgp.post_var(x))
+        >>> assert server.num_points==64 and server.num_batches<=33
+    """
+    def __init__(self, frozen:FrozenGP, max_batch_size:int=256, max_wait:float=1e-3):
+        """
+        Args:
+            frozen (FrozenGP): inference only predictor
+            max_batch_size (int): maximum number of points evaluated in one batch
+            max_wait (float): maximum time in seconds to wait for more requests after the first request of a batch arrives
+        """
+        assert isinstance(frozen,FrozenGP)
+        assert isinstance(max_batch_size,int) and max_batch_size>0
+        assert max_wait>=0
+        self.frozen = frozen
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.num_batches = 0
+        self.num_points = 0
+        self._queue = queue.Queue()
+        self._closed = False
+        self._worker = threading.Thread(target=self._run,daemon=True)
+        self._worker.start()
+    def submit(self, x:torch.Tensor):
+        """
+        Queue a prediction request.
+
+        Args:
+            x (Union[torch.Tensor[d],torch.Tensor[N,d]]): a single sampling location or a block of sampling locations
+
+        Returns:
+            future (concurrent.futures.Future): resolves to the posterior mean and variance,
+                with the last dimension dropped when `x` is a single location
+        """
+        assert not self._closed, "server is closed"
+        assert x.ndim in [1,2] and x.size(-1)==self.frozen.d
+        future = Future()
+        self._queue.put((x,future))
+        return future
+    def post(self, x:torch.Tensor):
+        """
+        Blocking prediction, equivalent to `submit(x).result()`.
+
+        Args:
+            x (Union[torch.Tensor[d],torch.Tensor[N,d]]): a single sampling location or a block of sampling locations
+
+        Returns:
+            pmean (torch.Tensor): posterior mean
+            pvar (torch.Tensor): posterior variance
+        """
+        return self.submit(x).result()
+    def close(self):
+        """
+        Stop accepting requests, finish the queued ones, and join the worker thread.
+        """
+        if self._closed: return
+        self._closed = True
+        self._queue.put(None)
+        self._worker.join()
+    def __enter__(self):
+        return self
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+    def _collect(self, first):
+        batch = [first]
+        size = 1 if first[0].ndim==1 else first[0].size(0)
+        deadline = time.perf_counter()+self.max_wait
+        while size<self.max_batch_size:
+            timeout = deadline-time.perf_counter()
+            try:
+                request = self._queue.get(timeout=timeout) if timeout>0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is None:
+                self._queue.put(None)
+                break
+            batch.append(request)
+            size += 1 if request[0].ndim==1 else request[0].size(0)
+        return batch
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None: break
+            batch = [(x,future) for x,future in self._collect(first) if future.set_running_or_notify_cancel()]
+            if len(batch)==0: continue
+            sizes = [1 if x.ndim==1 else x.size(0) for x,future in batch]
+            try:
+                pmean,pvar = self.frozen.post(torch.cat([x.reshape(-1,x.size(-1)) for x,future in batch],dim=0))
+            except Exception as e:
+                for x,future in batch: future.set_exception(e)
+                continue
+            self.num_batches += 1
+            self.num_points += sum(sizes)
+            for (x,future),pm,pv in zip(batch,pmean.split(sizes,dim=-1),pvar.split(sizes,dim=-1)):
+                future.set_result((pm[...,0],pv[...,0]) if x.ndim==1 else (pm,pv))
@@ -0,0 +1,160 @@
+import torch
+import functools
+import threading
+import time
+import json
+import os
+
+class _ActiveProfilers(threading.local):
+    # profilers entered in the current thread, so calls made by other threads are never attributed to them
+    def __init__(self):
+        self.stack = []
+
+_ACTIVE = _ActiveProfilers()
+
+def _nbytes(out):
+    if isinstance(out,torch.Tensor): return out.numel()*out.element_size()
+    if isinstance(out,(tuple,list)): return sum(_nbytes(o) for o in out)
+    return 0
+
+def _profiled(name):
+    # times calls to the decorated function while a Profiler is active, otherwise calls straight through
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            stack = _ACTIVE.stack
+            if not stack: return fn(*args,**kwargs)
+            return stack[-1]._call(name,fn,args,kwargs)
+        return wrapper
+    return decorator
+
+def _cache_event(name, event):
+    # event is "miss" when a cache is first filled or extended and "recompute" when stale values are rebuilt
+    stack = _ACTIVE.stack
+    if stack: stack[-1]._event(name,event)
+
+class Profiler(object):
+    r"""
+    Context manager recording where time goes inside `fit`, `post_mean`, `post_var`, and friends.
+        Instrumented components are
+
+        - `xxb`: generating sampling locations in `_XXbSeq`,
+        - `k1parts`: extending the kernel parts in `_K1PartsSeq`,
+        - `lam`: kernel eigenvalues in `_LamCaches`,
+        - `ytilde`: fast transforms of the data in `_YtildeCache`,
+        - `ft` and `ift`: fast transforms,
+        - `task_cov`: the task covariance in `_TaskCovCache`,
+        - `coeffs`: the coefficients $\mathsf{K}^{-1} \boldsymbol{y}$ in `_CoeffsCache`,
+        - `cubature_weights`: the Bayesian cubature weights of `StandardGP` in `_CubatureWeightsCache`,
+        - `standard_inverse`, `kronecker_inverse`, `fast_inverse`, and `interpolated_inverse`: the inverse and log determinant caches.
+
+        For each component the profiler counts calls, cache misses (first fill or extension) and recomputes (stale values after a hyperparameter change),
+        derives hits as the remaining calls, and sums the wall time and the bytes of tensors produced by calls which missed or recomputed.
+        Time spent in recursive calls to the same component is only counted once.
+        Only calls made by the thread which entered the profiler are recorded, 
+        so work done by other threads, such as the worker of a `PredictionServer`, is not attributed to it. 
+        When no profiler is active every instrumented call reduces to one check of an empty thread local list.
+
+    Examples:
+        >>> import qmcpy
+        >>> import fastgps
+        >>> torch.set_default_dtype(torch.float64)
+        >>> fgp = fastgps.FastGPLattice(qmcpy.Lattice(dimension=2,seed=7))
+        >>> fgp.add_y_next(torch.sin(fgp.get_x_next(2**6).sum(-1)))
+        >>> x = torch.rand((2**7,2),generator=torch.Generator().manual_seed(17))
+        >>> with Profiler() as prof:
+        ...     data = fgp.fit(iterations=3,verbose=0)
+        ...     pvar = fgp.post_var(x)
+        >>> stats = prof.to_dict()
+        >>> all(stats[name]["calls"]==stats[name]["hits"]+stats[name]["misses"]+stats[name]["recomputes"] for name in stats)
+        True
+        >>> stats["fast_inverse"]["recomputes"]>0
+        True
+        >>> trace = prof.to_chrome_trace()
+        >>> sorted(trace["traceEvents"][0].keys())
+        ['dur', 'name', 'ph', 'pid', 'tid', 'ts']
+
+        >>> import threading
+        >>> with Profiler() as prof_main:
+        ...     worker = threading.Thread(target=fgp.post_var,args=(x,))
+        ...     worker.start()
+        ...     worker.join()
+        >>> prof_main.to_dict()
+        {}
+    """
+    def __init__(self, synchronize:bool=False):
+        """
+        Args:
+            synchronize (bool): if `True`, call `torch.cuda.synchronize` before reading the clock so asynchronous CUDA kernels are attributed to the component which launched them
+        """
+        self.synchronize = synchronize
+        self.stats = {}
+        self.events = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._t0 = None
+    def __enter__(self):
+        self._t0 = time.perf_counter()
+        _ACTIVE.stack.append(self)
+        return self
+    def __exit__(self, exc_type, exc_value, traceback):
+        _ACTIVE.stack.remove(self)
+    def _stat(self, name):
+        if name not in self.stats: self.stats[name] = {"calls":0,"misses":0,"recomputes":0,"time":0.,"bytes":0}
+        return self.stats[name]
+    def _event(self, name, event):
+        with self._lock:
+            self._stat(name)["misses" if event=="miss" else "recomputes"] += 1
+    def _clock(self):
+        if self.synchronize and torch.cuda.is_available(): torch.cuda.synchronize()
+        return time.perf_counter()
+    def _call(self, name, fn, args, kwargs):
+        stack = getattr(self._local,"stack",None)
+        if stack is None: stack = self._local.stack = []
+        with self._lock:
+            stat = self._stat(name)
+            stat["calls"] += 1
+            computes = stat["misses"]+stat["recomputes"]
+        if name in stack: return fn(*args,**kwargs) # recursion is timed by the outermost call
+        stack.append(name)
+        t0 = self._clock()
+        try:
+            out = fn(*args,**kwargs)
+        finally:
+            t1 = self._clock()
+            stack.pop()
+        with self._lock:
+            stat["time"] += t1-t0
+            if name in ["ft","ift"] or stat["misses"]+stat["recomputes"]>computes: stat["bytes"] += _nbytes(out)
+            self.events.append({"name":name,"ph":"X","ts":1e6*(t0-self._t0),"dur":1e6*(t1-t0),"pid":os.getpid(),"tid":threading.get_ident()})
+        return out
+    def to_dict(self):
+        """
+        Per component statistics.
+
+        Returns:
+            stats (dict): maps each component to a dict with keys `calls`, `hits`, `misses`, `recomputes`, `time` (seconds), and `bytes`
+        """
+        with self._lock:
+            return {name:{
+                "calls": stat["calls"],
+                "hits": max(stat["calls"]-stat["misses"]-stat["recomputes"],0),
+                "misses": stat["misses"],
+                "recomputes": stat["recomputes"],
+                "time": stat["time"],
+                "bytes": stat["bytes"]} for name,stat in self.stats.items()}
+    def to_chrome_trace(self, path:str=None):
+        """
+        Timed calls in the Chrome trace event format, viewable in `chrome://tracing` or Perfetto.
+
+        Args:
+            path (str): if not `None`, also write the trace to this JSON file
+
+        Returns:
+            trace (dict): dict with key `traceEvents`
+        """
+        with self._lock:
+            trace = {"traceEvents":[dict(event) for event in self.events],"displayTimeUnit":"ms"}
+        if path is not None:
+            with open(path,"w") as f: json.dump(trace,f)
+        return trace
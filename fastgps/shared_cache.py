@@ -0,0 +1,167 @@
+import torch
+import numpy as np
+import hashlib
+import threading
+import weakref
+import os
+from .util import _snapshot_state,_restore_state,_cache_nbytes
+
+_ACTIVE = []
+
+_SEQ_SKIP_ATTRS = ("rng","entropy","spawn_key","_base_seed")
+
+def _fingerprint(*parts):
+    # content hash of sequences, tensors, arrays and plain values
+    h = hashlib.sha1()
+    for part in parts:
+        if isinstance(part,torch.Tensor): part = part.cpu().numpy()
+        if isinstance(part,np.ndarray):
+            h.update(str((part.dtype,part.shape)).encode())
+            h.update(np.ascontiguousarray(part).tobytes())
+        elif hasattr(part,"__dict__") and not isinstance(part,type):
+            h.update(type(part).__name__.encode())
+            for name,value in sorted(vars(part).items()):
+                if name in _SEQ_SKIP_ATTRS or not isinstance(value,(np.ndarray,int,float,str,bool,list,tuple,type(None))): continue
+                h.update(name.encode())
+                h.update(_fingerprint(value).encode())
+        else:
+            h.update(repr(part).encode())
+    return h.hexdigest()
+
+def _attach_active(model):
+    if _ACTIVE: _ACTIVE[-1].attach(model)
+
+class _SharedEntry(object):
+    def __init__(self, snapshot_attrs):
+        self._SNAPSHOT_ATTRS = snapshot_attrs
+        self.n = 0
+        self.refs = 0
+
+class SharedCache(object):
+    r"""
+    Process wide cache of sampling locations and kernel parts shared by `FastGPLattice` and `FastGPDigitalNetB2` instances.
+        Entries are keyed by the content of the sequence (generating vector or matrices, randomization, and replications),
+        so models built on the same sequence reuse the points in `_XXbSeq` and the kernel parts in `_K1PartsSeq`,
+        the latter additionally keyed by `alpha`, the derivatives, and `k1parts_storage`.
+        Models only read shared tensors and publish longer ones when they extend past the shared number of points.
+        Each entry counts the models attached to it and is dropped when the last of them is detached or garbage collected,
+        after being written to `path` if one was given. Models still attached when the interpreter exits are released then.
+        Models constructed inside a `with SharedCache(...)` block are attached automatically.
+
+    Examples:
+        >>> import qmcpy
+        >>> import fastgps
+        >>> import tempfile
+        >>> torch.set_default_dtype(torch.float64)
+        >>> path = tempfile.mkdtemp()
+        >>> with SharedCache(path) as shared:
+        ...     fgps = [fastgps.FastGPLattice(qmcpy.Lattice(dimension=2,seed=7)) for _ in range(3)]
+        >>> for k,fgp in enumerate(fgps):
+        ...     fgp.add_y_next(torch.sin((k+1)*fgp.get_x_next(2**6).sum(-1)))
+        ...     pmean = fgp.post_mean(fgp.get_x(0))
+        >>> [entry["refs"] for entry in shared.report().values()]
+        [3, 3]
+        >>> assert fgps[0].get_x(0).data_ptr()==fgps[2].get_x(0).data_ptr()
+        >>> for fgp in fgps:
+        ...     shared.detach(fgp)
+        >>> shared.report()
+        {}
+
+        Entries released to `path` are reloaded by a new cache without regenerating points or kernel parts
+
+        >>> with fastgps.Profiler() as prof:
+        ...     with SharedCache(path) as shared_loaded:
+        ...         fgp = fastgps.FastGPLattice(qmcpy.Lattice(dimension=2,seed=7))
+        ...     fgp.add_y_next(torch.sin(fgp.get_x_next(2**6).sum(-1)))
+        ...     pmean = fgp.post_mean(fgp.get_x(0))
+        >>> prof.to_dict()["xxb"]["misses"],prof.to_dict()["k1parts"]["misses"]
+        (0, 0)
+    """
+    def __init__(self, path:str=None):
+        """
+        Args:
+            path (str): if not `None`, directory from which entries are memory mapped when first requested and to which they are written by `save` and when released
+        """
+        self.path = path
+        if path is not None: os.makedirs(path,exist_ok=True)
+        self.entries = {}
+        self._lock = threading.Lock()
+    def __enter__(self):
+        _ACTIVE.append(self)
+        return self
+    def __exit__(self, exc_type, exc_value, traceback):
+        _ACTIVE.remove(self)
+    def _file(self, key):
+        return os.path.join(self.path,key+".pt")
+    def _acquire(self, key, snapshot_attrs):
+        with self._lock:
+            if key not in self.entries:
+                entry = _SharedEntry(snapshot_attrs)
+                if self.path is not None and os.path.isfile(self._file(key)):
+                    _restore_state(entry,torch.load(self._file(key),mmap=True,weights_only=True))
+                self.entries[key] = entry
+            entry = self.entries[key]
+            entry.refs += 1
+            return entry
+    def _release(self, keys):
+        with self._lock:
+            for key in keys:
+                entry = self.entries[key]
+                entry.refs -= 1
+                if entry.refs==0:
+                    if self.path is not None: self._save_entry(key,entry)
+                    del self.entries[key]
+    def _save_entry(self, key, entry):
+        if entry.n==0: return
+        if os.path.isfile(self._file(key)) and torch.load(self._file(key),mmap=True,weights_only=True)["n"]>=entry.n: return
+        torch.save(_snapshot_state(entry),self._file(key))
+    def attach(self, model):
+        """
+        Share the sampling locations and kernel parts of a fast GP with other attached models.
+
+        Args:
+            model (AbstractFastGP): model whose caches should read from and publish to this cache
+        """
+        keys = []
+        xxb_keys = []
+        for l in range(model.num_tasks):
+            xxb_seq = model.xxb_seqs[l]
+            key = _fingerprint("xxb",type(model).__name__,str(model.device),str(model._XBDTYPE),xxb_seq.store_x,xxb_seq.seq)
+            xxb_seq.shared = self._acquire(key,xxb_seq._SNAPSHOT_ATTRS)
+            keys.append(key)
+            xxb_keys.append(key)
+        if model.k1parts_storage!="recompute":
+            for l0 in range(model.num_tasks):
+                for l1 in range(l0,model.num_tasks):
+                    k1parts_seq = model.k1parts_seq[l0,l1]
+                    key = _fingerprint("k1parts",xxb_keys[l0],xxb_keys[l1],model.alpha,k1parts_seq.beta,k1parts_seq.kappa,k1parts_seq.storage,str(torch.get_default_dtype()))
+                    k1parts_seq.shared = self._acquire(key,k1parts_seq._SNAPSHOT_ATTRS)
+                    keys.append(key)
+        model._shared_cache_release = weakref.finalize(model,self._release,keys)
+    def detach(self, model):
+        """
+        Stop sharing the caches of a model attached with `attach`, keeping the tensors it already holds.
+
+        Args:
+            model (AbstractFastGP): attached model
+        """
+        model._shared_cache_release()
+        for l in range(model.num_tasks):
+            model.xxb_seqs[l].shared = None
+            for l1 in range(l,model.num_tasks): model.k1parts_seq[l,l1].shared = None
+    def save(self):
+        """
+        Write every entry to `path`.
+        """
+        assert self.path is not None, "save requires a path"
+        with self._lock:
+            for key,entry in self.entries.items(): self._save_entry(key,entry)
+    def report(self):
+        """
+        Attached models, number of points, and bytes held by each entry.
+
+        Returns:
+            report (dict): maps each key to a dict with keys `refs`, `n`, and `bytes`
+        """
+        with self._lock:
+            return {key:{"refs":entry.refs,"n":int(entry.n),"bytes":_cache_nbytes(entry,set())} for key,entry in self.entries.items()}
@@ -2,12 +2,28 @@ from .abstract_gp import AbstractGP
 from .util import (
     DummyDiscreteDistrib,
     _StandardInverseLogDetCache,
+    _KroneckerInverseLogDetCache,
+    _CubatureWeightsCache,
 )
 import torch
 import numpy as np
 import qmcpy as qmcpy
+import itertools
 from typing import Tuple,Union
 
+def _radial_deriv_coeffs(gmax):
+    # d^g/ddelta^g psi(delta^2/(2l)) = sum_k a[g][k] delta^(2k-g) l^(-k) psi^(k)(delta^2/(2l))
+    a = [{0:1}]
+    for g in range(gmax):
+        a_next = {}
+        for k,v in a[-1].items():
+            if 2*k-g>0: a_next[k] = a_next.get(k,0)+v*(2*k-g)
+            a_next[k+1] = a_next.get(k+1,0)+v
+        a.append(a_next)
+    return a
+
+_RADIAL_DERIV_COEFFS = _radial_deriv_coeffs(4)
+
 class StandardGP(AbstractGP):
     """
     Standard Gaussian process regression
@@ -71,6 +87,9 @@ class StandardGP(AbstractGP):
         torch.Size([128])
         >>> ci_high.shape
         torch.Size([128])
+        >>> pquery = sgp.post(x,want=("mean","var","ci"),confidence=0.99)
+        >>> assert torch.allclose(pquery["mean"],sgp.post_mean(x)) and torch.allclose(pquery["var"],pvar)
+        >>> assert torch.allclose(pquery["ci_low"],ci_low) and torch.allclose(pquery["ci_high"],ci_high)
 
         >>> sgp.post_cubature_mean()
         tensor(20.0282)
@@ -120,6 +139,50 @@ class StandardGP(AbstractGP):
         >>> assert torch.allclose(sgp.post_cov(x,z),pcov_16n)
         >>> assert torch.allclose(sgp.post_var(x),pvar_16n)
         >>> assert torch.allclose(sgp.post_cubature_var(),pcvar_16n)
+
+        >>> weights = sgp.cubature_weights()
+        >>> weights.shape
+        torch.Size([1024])
+        >>> assert torch.allclose(weights@sgp.y,sgp.post_cubature_mean())
+        >>> pcmean_cos = weights@torch.cos(sgp.x.sum(-1))
+
+        >>> candidates = torch.rand((2**10,d),generator=rng)
+        >>> idx = sgp.select_batch(candidates,8)
+        >>> idx.shape
+        torch.Size([8])
+        >>> assert idx[0]==sgp.post_var(candidates).argmax()
+        >>> idx = sgp.select_batch(candidates,8,criterion="imse",generator=torch.Generator().manual_seed(7))
+        >>> assert len(torch.unique(idx))==8
+
+        >>> import os
+        >>> import tempfile
+        >>> path = os.path.join(tempfile.mkdtemp(),"sgp.pt")
+        >>> sgp.save(path)
+        >>> sgp_loaded = StandardGP(qmcpy.DigitalNetB2(dimension=d,seed=7)).load(path,mmap=True)
+        >>> assert (sgp_loaded.n==sgp.n).all()
+        >>> assert torch.allclose(sgp_loaded.post_mean(x),sgp.post_mean(x)) and torch.allclose(sgp_loaded.post_var(x),sgp.post_var(x))
+
+        >>> frozen = sgp.freeze()
+        >>> assert torch.allclose(frozen.post_mean(x),sgp.post_mean(x)) and torch.allclose(frozen.post_var(x),sgp.post_var(x),atol=1e-6)
+
+        >>> grid_axes = [torch.linspace(0,1,8),torch.linspace(0,1,6)]
+        >>> xgrid = torch.cartesian_prod(*grid_axes)
+        >>> sgp_grid = StandardGP(d,data={"grid_axes":grid_axes,"y":f_ackley(xgrid)})
+        >>> sgp_dense = StandardGP(d,data={"x":xgrid,"y":f_ackley(xgrid)})
+        >>> assert torch.allclose(sgp_grid.post_mean(x),sgp_dense.post_mean(x),atol=1e-6)
+        >>> assert torch.allclose(sgp_grid.post_var(x),sgp_dense.post_var(x),atol=1e-6)
+        >>> residuals_grid,logscores_grid,idx = sgp_grid.cross_validate(folds=4)
+        >>> residuals_dense,logscores_dense,idx = sgp_dense.cross_validate(folds=4)
+        >>> assert torch.allclose(residuals_grid,residuals_dense,atol=1e-6)
+
+        Closed form derivative kernels agree with the autograd fallback, including for a shared lengthscale
+
+        >>> beta0,beta1,c = torch.tensor([[0,1]]),torch.tensor([[1,0]]),torch.ones(1)
+        >>> for kernel_class in ["gaussian","matern32","matern52"]:
+        ...     sgp_deriv = StandardGP(d,seed_for_seq=7,kernel_class=kernel_class,shape_lengthscales=torch.Size([1]),lengthscales=0.7)
+        ...     kmat = sgp_deriv.kernel(x[:5,None,:],x[None,5:11,:],beta0,beta1,c,c)
+        ...     sgp_deriv._closed_form_derivatives = lambda beta0,beta1: False
+        ...     assert kmat.shape==(5,6) and torch.allclose(kmat,sgp_deriv.kernel(x[:5,None,:],x[None,5:11,:],beta0,beta1,c,c),atol=1e-12)
     """
     _XBDTYPE = torch.float64
     _FTOUTDTYPE = torch.float64
@@ -157,6 +220,7 @@ class StandardGP(AbstractGP):
             data:dict = None,
             compile_dist_func:bool = False,
             compile_dist_func_kwargs:dict = {},
+            dist_block_size:int = 2**12,
             ):
         """
         Args:
@@ -196,11 +260,21 @@ class StandardGP(AbstractGP):
                 ```python
                 derivatives = [torch.zeros(d,dtype=int)]+[ej for ej in torch.eye(d,dtype=int)]
                 ```
-            derivatives_coeffs (list): list of derivative coefficients where if `derivatives[k].shape==(p,d)` then we should have `derivatives_coeffs[k].shape==(p,)`
+            derivatives_coeffs (list): list of derivative coefficients where if `derivatives[k].shape==(p,d)` then we should have `derivatives_coeffs[k].shape==(p,)`. 
+                Derivative kernels are evaluated in closed form for the Gaussian, Matern 3/2, and Matern 5/2 kernels with derivative orders at most 2 per dimension 
+                (and total order within the kernel smoothness for Matern kernels), otherwise we fall back to automatic differentiation.
             adaptive_nugget (bool): if True, use the adaptive nugget which modifies noises based on trace ratios.  
-            data (dict): dictory of data with keys 'x' and 'y' where data['x'] and data['y'] are both `torch.Tensor`s or list of `torch.Tensor`s with lengths equal to the number of tasks
-            compile_dist_func (bool): if `True`, use compile the pairwise distance function for memory efficiency when evaluating the kernel matrix.
+            data (dict): dictory of data with keys 'x' and 'y' where data['x'] and data['y'] are both `torch.Tensor`s or list of `torch.Tensor`s with lengths equal to the number of tasks. 
+                For single task data on a full tensor grid, pass keys 'grid_axes' and 'y' instead where data['grid_axes'] is a length `d` list of 1d `torch.Tensor`s 
+                and data['y'] has last dimension equal to the grid size with points ordered as in `torch.cartesian_prod(*data['grid_axes'])`. 
+                The kernel is then the product of one dimensional kernels, which for Matern kernels differs from the non-grid kernel, 
+                so the Gram matrix is a Kronecker product whose per axis eigendecompositions give solves and log determinants in $\mathcal{O}(d n^{1+1/d})$. 
+            compile_dist_func (bool): if `True`, compile the pairwise distance function used by the autograd derivative fallback, 
+                i.e. derivative orders without a closed form such as `kernel_class="matern12"` or orders above 2 in a dimension. 
+                Kernels without derivatives and closed form derivative kernels use blocked distances and are unaffected. 
             compile_dist_func_kwargs (dict): keyword arguments to `torch.compile` used when `compile_dist_func=True`.
+            dist_block_size (int): number of rows per block when computing pairwise distances between lengthscale rescaled inputs 
+                via $\lVert \boldsymbol{a} \rVert^2 + \lVert \boldsymbol{b} \rVert^2 - 2 \boldsymbol{a}^T \boldsymbol{b}$, which avoids forming `[N,n,d]` temporaries.
         """
         if num_tasks is None: 
             solo_task = True
@@ -210,6 +284,14 @@ class StandardGP(AbstractGP):
             assert isinstance(num_tasks,int) and num_tasks>0
             solo_task = False
             default_task = torch.arange(num_tasks)
+        self.grid_axes = None
+        if data is not None and "grid_axes" in data:
+            assert isinstance(seqs,int), "passing in data requires seqs (the first argument) is a int specifying the dimension"
+            assert solo_task, "grid_axes data only supports single task problems"
+            assert derivatives is None and derivatives_coeffs is None, "grid_axes data does not support derivative information"
+            assert isinstance(data["grid_axes"],list) and len(data["grid_axes"])==seqs and all(isinstance(ax,torch.Tensor) and ax.ndim==1 and len(ax)>0 for ax in data["grid_axes"]), "data['grid_axes'] should be a list of d 1d tensors"
+            self.grid_axes = [ax.to(device) for ax in data["grid_axes"]]
+            data["x"] = torch.cartesian_prod(*data["grid_axes"]).reshape(-1,seqs)
         if data is not None:
             assert isinstance(seqs,int), "passing in data requires seqs (the first argument) is a int specifying the dimension"
             assert isinstance(data,dict) and "x" in data and "y" in data, "data must be a dict with keys 'x' and 'y'"
@@ -232,6 +314,8 @@ class StandardGP(AbstractGP):
         assert kernel_class in self.available_kernel_classes, "kernel_class must in %s"%str(self.available_kernel_classes)
         self.kernel_class = kernel_class
         assert isinstance(compile_dist_func,bool)
+        assert isinstance(dist_block_size,int) and dist_block_size>0
+        self.dist_block_size = dist_block_size
         if self.kernel_class=="gaussian":
             self.unscaled_gaussian_kernel = lambda x1,x2,lengthscales: torch.exp(-((x1-x2)**2/(2*lengthscales)).sum(-1))
             if compile_dist_func:
@@ -272,6 +356,7 @@ class StandardGP(AbstractGP):
             derivatives_coeffs,
             adaptive_nugget,
         )
+        self.cubature_weights_cache = _CubatureWeightsCache(self)
         if data is not None:
             self.add_y_next(data["y"],task=torch.arange(self.num_tasks))
     def get_default_optimizer(self, lr):
@@ -279,17 +364,17 @@ class StandardGP(AbstractGP):
         # return torch.optim.Adam(self.parameters(),lr=lr,amsgrad=True)
         if lr is None: lr = 1e-1
         return torch.optim.Rprop(self.parameters(),lr=lr)
-    def get_inv_log_det_cache(self, n=None):
-        if n is None: n = self.n
-        assert isinstance(n,torch.Tensor) and n.shape==(self.num_tasks,) and (n>=self.n).all()
-        ntup = tuple(n.tolist())
-        if ntup not in self.inv_log_det_cache_dict.keys():
-            self.inv_log_det_cache_dict[ntup] = _StandardInverseLogDetCache(self,n)
-        return self.inv_log_det_cache_dict[ntup]
+    _SNAPSHOT_CACHES = AbstractGP._SNAPSHOT_CACHES+("cubature_weights_cache",)
+    def _new_inv_log_det_cache(self, n):
+        return _StandardInverseLogDetCache(self,n) if self.grid_axes is None else _KroneckerInverseLogDetCache(self,n)
     def _kernel(self, x:torch.Tensor, z:torch.Tensor, beta0:torch.Tensor, beta1: torch.Tensor, c0:torch.Tensor, c1:torch.Tensor):
         assert c0.ndim==1 and c1.ndim==1
         assert beta0.shape==(len(c0),self.d) and beta1.shape==(len(c1),self.d)
         assert x.size(-1)==self.d and z.size(-1)==self.d
+        if not ((beta0>0).any() or (beta1>0).any()):
+            return self._kernel_no_derivatives(x,z,c0,c1)
+        if self._closed_form_derivatives(beta0,beta1):
+            return self._kernel_closed_form(x,z,beta0,beta1,c0,c1)
         incoming_grad_enabled = torch.is_grad_enabled()
         torch.set_grad_enabled(True)
         if (beta0>0).any():
@@ -338,23 +423,228 @@ class StandardGP(AbstractGP):
                 y += c0[i0]*c1[i1]*y_part
         torch.set_grad_enabled(incoming_grad_enabled)
         return y
-    def post_cubature_mean(self, task:Union[int,torch.Tensor]=None, eval:bool=True, integrate_unit_cube:bool=True):
-        kmat_tasks = self.gram_matrix_tasks
+    def _scaled_sq_dists(self, x:torch.Tensor, z:torch.Tensor, lengthscales:torch.Tensor):
+        # s = sum_j (x_j-z_j)^2/(2l_j)
+        pairwise = x.ndim>=3 and z.ndim>=3 and x.size(-2)==1 and z.size(-3)==1 and lengthscales.size(-2)==1 and lengthscales.size(-3)==1
+        if not pairwise:
+            return ((x-z)**2/(2*lengthscales)).sum(-1)
+        sqrt2l = torch.sqrt(2*lengthscales[...,0,0,:])[...,None,:]
+        xs = x[...,0,:]/sqrt2l
+        zs = z[...,0,:,:]/sqrt2l
+        xsq = (xs**2).sum(-1)
+        zsq = (zs**2).sum(-1)
+        s = torch.cat([
+            (xsq[...,i:i+self.dist_block_size,None]+zsq[...,None,:]-2*xs[...,i:i+self.dist_block_size,:]@zs.transpose(-2,-1)).clamp_min(0.)
+            for i in range(0,max(xs.size(-2),1),self.dist_block_size)],dim=-2)
+        return s
+    def _kernel_no_derivatives(self, x:torch.Tensor, z:torch.Tensor, c0:torch.Tensor, c1:torch.Tensor):
+        ndim = max(x.ndim,z.ndim)
+        lengthscales = self.lengthscales.reshape(list(self.lengthscales.shape)[:-1]+[1]*(ndim-1)+[self.lengthscales.size(-1)])
+        scale = self.scale.reshape(list(self.scale.shape)[:-1]+[1]*(ndim-1))
+        if self.grid_axes is None or self.kernel_class=="gaussian":
+            y = self._unscaled_kernel_from_sq_dists(self._scaled_sq_dists(x,z,lengthscales))
+        else:
+            y = 1.
+            for j in range(self.d):
+                y = y*self._unscaled_kernel_from_sq_dists((x[...,j]-z[...,j])**2/(2*lengthscales[...,j if lengthscales.size(-1)>1 else 0]))
+        return c0.sum()*c1.sum()*scale*y
+    def _unscaled_kernel_from_sq_dists(self, s:torch.Tensor):
+        if self.kernel_class=="gaussian":
+            return torch.exp(-s)
+        r = torch.where(s>0,torch.sqrt(torch.where(s>0,s,1.)),0.)
+        if self.kernel_class=="matern12":
+            return torch.exp(-r)
+        elif self.kernel_class=="matern32":
+            return (1+np.sqrt(3)*r)*torch.exp(-np.sqrt(3)*r)
+        elif self.kernel_class=="matern52":
+            return (1+np.sqrt(5)*r+5*r**2/3)*torch.exp(-np.sqrt(5)*r)
+        else:
+            raise Exception("kernel_class must be in %s"%str(self.available_kernel_classes))
+    def _freeze_kernel(self):
+        return {"kernel":self.kernel_class,"product":self.grid_axes is not None and self.kernel_class!="gaussian","poly":torch.empty(0,device=self.device),"order":[],"t":0}
+    def _kernel_grid_axis(self, j:int, x:torch.Tensor=None):
+        # unscaled one dimensional kernel between x (defaults to the grid axis) and the j^th grid axis
+        axis = self.grid_axes[j]
+        if x is None: x = axis
+        lengthscale = self.lengthscales[...,j if self.lengthscales.size(-1)>1 else 0]
+        return self._unscaled_kernel_from_sq_dists((x[:,None]-axis[None,:])**2/(2*lengthscale[...,None,None]))
+    def _closed_form_derivatives(self, beta0, beta1):
+        if self.kernel_class=="matern12" or (beta0>2).any() or (beta1>2).any(): return False
+        if self.kernel_class=="gaussian": return True
+        smoothness = 2 if self.kernel_class=="matern32" else 4
+        return bool(((beta0[:,None,:]+beta1[None,:,:]).sum(-1)<=smoothness).all())
+    def _radial_derivs(self, s, mmax):
+        # derivatives of the kernel with respect to s = sum_j delta_j^2/(2l_j)
+        if self.kernel_class=="gaussian":
+            e = torch.exp(-s)
+            return [(-1)**m*e for m in range(mmax+1)]
+        if self.kernel_class=="matern32":
+            a,p = np.sqrt(3),1
+            coeffs = {0:1.,1:a}
+        else: # matern52
+            a,p = np.sqrt(5),2
+            coeffs = {0:1.,1:a,2:a**2/3}
+        r = torch.where(s>0,torch.sqrt(torch.where(s>0,s,1.)),0.)
+        r_safe = torch.where(r>0,r,1.)
+        e = torch.exp(-a*r)
+        psis = []
+        for m in range(mmax+1):
+            # derivatives beyond the smoothness are singular at r=0 but only appear multiplied by powers of delta
+            rm = r if m<=p else r_safe
+            psis.append(e*sum(c*rm**i for i,c in coeffs.items()))
+            # d/ds (e^{-ar} r^i) = e^{-ar} (i r^{i-2} - a r^{i-1})/2
+            coeffs_next = {}
+            for i,c in coeffs.items():
+                coeffs_next[i-2] = coeffs_next.get(i-2,0.)+c*i/2
+                coeffs_next[i-1] = coeffs_next.get(i-1,0.)-c*a/2
+            coeffs = {i:c for i,c in coeffs_next.items() if abs(c)>1e-12}
+        return psis
+    def _kernel_closed_form(self, x:torch.Tensor, z:torch.Tensor, beta0:torch.Tensor, beta1: torch.Tensor, c0:torch.Tensor, c1:torch.Tensor):
+        delta = x-z
+        ndim = delta.ndim
+        lengthscales = self.lengthscales.reshape(list(self.lengthscales.shape)[:-1]+[1]*(ndim-1)+[self.lengthscales.size(-1)])
+        scale = self.scale.reshape(list(self.scale.shape)[:-1]+[1]*(ndim-1))
+        s = self._scaled_sq_dists(x,z,lengthscales)
+        gammas = beta0[:,None,:]+beta1[None,:,:]
+        psis = self._radial_derivs(s,gammas.sum(-1).max().item())
+        y = 0
+        for i0 in range(len(c0)):
+            for i1 in range(len(c1)):
+                gamma = gammas[i0,i1].tolist()
+                dims = [j for j in range(self.d) if gamma[j]>0]
+                terms = {}
+                for ks in itertools.product(*[_RADIAL_DERIV_COEFFS[gamma[j]].keys() for j in dims]):
+                    term = 1.
+                    for j,k in zip(dims,ks):
+                        term = term*_RADIAL_DERIV_COEFFS[gamma[j]][k]*delta[...,j]**(2*k-gamma[j])/lengthscales[...,j if lengthscales.size(-1)>1 else 0]**k
+                    terms[sum(ks)] = terms.get(sum(ks),0.)+term
+                y_part = sum(term*psis[m] for m,term in terms.items())
+                y += c0[i0]*c1[i1]*(-1)**beta1[i1].sum().item()*y_part
+        return scale*y
+    def select_batch(self, candidates:torch.Tensor, k:int, criterion:str="max_var", num_reference:int=256, generator:torch.Generator=None):
+        r"""
+        Greedily select a batch of `k` points from a candidate pool. 
+            After each pick the posterior covariance is downdated by a rank one term 
+            $\Sigma \leftarrow \Sigma - \Sigma_{:,p} \Sigma_{p,:} / (\Sigma_{p,p} + \sigma^2)$ 
+            so no refitting or refactorization of the Gram matrix is needed. 
+            Each pick costs $\mathcal{O}(N n)$ for $N$ candidates and $n$ samples, plus $\mathcal{O}(R N)$ for the `"imse"` criterion. 
+
+        Args:
+            candidates (torch.Tensor[N,d]): candidate locations
+            k (int): number of points to select
+            criterion (str): either `"max_var"` to pick the largest posterior variance, 
+                or `"imse"` to pick the largest reduction in posterior variance integrated over a random reference subset of the candidates
+            num_reference (int): size $R$ of the reference subset for the `"imse"` criterion
+            generator (torch.Generator): random number generator for the reference subset
+
+        Returns:
+            idx (torch.Tensor[k]): indices of the selected candidates
+        """
+        assert self.num_tasks==1, "select_batch only supports single task problems"
+        assert self.scale.numel()==1 and self.noise.numel()==1 and self.lengthscales.ndim==1, "select_batch does not support batched parameters"
+        assert candidates.ndim==2 and candidates.size(1)==self.d, "candidates must a torch.Tensor with shape (-1,d)"
+        N = candidates.size(0)
+        assert isinstance(k,int) and 0<k<=N
+        criterion = criterion.lower()
+        assert criterion in ["max_var","imse"], "criterion must be 'max_var' or 'imse'"
+        beta,c = self.derivatives[0],self.derivatives_coeffs[0]
+        kt = self.gram_matrix_tasks[...,0,0]
+        noise = self.noise[...,0]
+        with torch.no_grad():
+            inv_log_det_cache = self.get_inv_log_det_cache()
+            kmat = kt*self._kernel(candidates[:,None,:],self.get_xb(0)[None,:,:],beta,beta,c,c)
+            pvar = kt*self._kernel(candidates,candidates,beta,beta,c,c)-(kmat*inv_log_det_cache.gram_matrix_solve(kmat)).sum(-1)
+            if criterion=="imse":
+                ref = torch.randperm(N,generator=generator)[:min(num_reference,N)].to(self.device)
+                pcov_ref = kt*self._kernel(candidates[ref,None,:],candidates[None,:,:],beta,beta,c,c)-inv_log_det_cache.gram_matrix_solve(kmat[ref])@kmat.T
+            us = torch.empty((k,N),device=self.device)
+            idx = torch.empty(k,dtype=torch.int64,device=self.device)
+            available = torch.ones(N,dtype=torch.bool,device=self.device)
+            for t in range(k):
+                score = pvar if criterion=="max_var" else (pcov_ref**2).sum(0)/(pvar+noise)
+                p = torch.where(available,score,-torch.inf).argmax()
+                pcov_p = kt*self._kernel(candidates,candidates[p][None,:],beta,beta,c,c)-kmat@inv_log_det_cache.gram_matrix_solve(kmat[p])-us[:t].T@us[:t,p]
+                us[t] = pcov_p/torch.sqrt(pcov_p[p].clamp(min=0)+noise)
+                pvar = (pvar-us[t]**2).clamp(min=0)
+                if criterion=="imse":
+                    pcov_ref = pcov_ref-us[t,ref,None]*us[t,None,:]
+                idx[t] = p
+                available[p] = False
+        return idx
+    def post_mean(self, x:torch.Tensor, task:Union[int,torch.Tensor]=None, eval:bool=True):
+        if self.grid_axes is None:
+            return super().post_mean(x,task=task,eval=eval)
         coeffs = self.coeffs
         if eval:
             incoming_grad_enabled = torch.is_grad_enabled()
             torch.set_grad_enabled(False)
+        assert x.ndim==2 and x.size(1)==self.d, "x must a torch.Tensor with shape (-1,d)"
         if task is None: task = self.default_task
         inttask = isinstance(task,int)
         if inttask: task = torch.tensor([task],dtype=int)
         if isinstance(task,list): task = torch.tensor(task,dtype=int)
-        assert task.ndim==1 and (task>=0).all() and (task<self.num_tasks).all()
+        assert task.ndim==1 and (task==0).all()
+        # contract the coefficients one grid axis at a time so the cross kernel matrix is never formed
+        sizes = [len(ax) for ax in self.grid_axes]
+        t = coeffs.reshape(coeffs.shape[:-1]+(sizes[0],-1))
+        t = self._kernel_grid_axis(0,x[:,0])@t
+        for j in range(1,self.d):
+            t = t.reshape(t.shape[:-1]+(sizes[j],-1))
+            t = (self._kernel_grid_axis(j,x[:,j])[...,None]*t).sum(-2)
+        pmean = self.scale*t[...,0]
+        if eval:
+            torch.set_grad_enabled(incoming_grad_enabled)
+        return pmean if inttask else pmean[...,None,:].expand(pmean.shape[:-1]+(len(task),pmean.size(-1)))
+    def _cubature_kints(self, kmat_tasks:torch.Tensor, task:torch.Tensor, n:torch.Tensor, integrate_unit_cube:bool):
+        # integrals of the Gaussian kernel against each sampling location in closed form
         assert self.kernel_class=="gaussian", "so far, we have only worked out integrals for the Gaussian kernel"
-        norms = [torch.distributions.Normal(self.get_x(l),torch.sqrt(self.lengthscales[...,None,:])) for l in range(self.num_tasks)]
-        lb,ub = (torch.tensor([0],device=self.device),torch.tensor([1],device=self.device)) if integrate_unit_cube else (torch.tensor([-torch.inf],device=self.device),torch.tensor([torch.inf],device=self.device))
-        kint_parts = [self.scale*(torch.sqrt(2*torch.pi*self.lengthscales[...,None,:])*(norms[l].cdf(ub)-norms[l].cdf(lb))).prod(-1) for l in range(self.num_tasks)]
-        kints = torch.cat([kmat_tasks[...,task,l,None]*kint_parts[l][...,None,:] for l in range(self.num_tasks)],dim=-1)
-        pcmean = (kints*coeffs[...,None,:]).sum(-1)
+        s = torch.sqrt(2*self.lengthscales[...,None,:])
+        kint_parts = []
+        for l in range(self.num_tasks):
+            x = self.get_x(l,n=n[l])
+            probs = (torch.erf((1-x)/s)+torch.erf(x/s))/2 if integrate_unit_cube else torch.ones_like(x)
+            kint_parts.append(self.scale*(np.sqrt(np.pi)*s*probs).prod(-1))
+        return torch.cat([kmat_tasks[...,task,l,None]*kint_parts[l][...,None,:] for l in range(self.num_tasks)],dim=-1)
+    def _cubature_t(self):
+        # integral of the unscaled Gaussian kernel over the unit cube in both arguments
+        l_d = self.lengthscales+torch.zeros(self.d,device=self.device)
+        t = 2*(-1+torch.exp(-1/(2*l_d)))*l_d+torch.sqrt(2*np.pi*l_d)*torch.erf(1/torch.sqrt(2*l_d))
+        return t.prod(-1)
+    def cubature_weights(self, task:Union[int,torch.Tensor]=None, n:Union[int,torch.Tensor]=None, integrate_unit_cube:bool=True):
+        r"""
+        Bayesian cubature weights $\boldsymbol{w} = \mathsf{K}^{-1} \boldsymbol{k}_\mathrm{int}$ so that `post_cubature_mean` is $\boldsymbol{w}^\intercal \boldsymbol{y}$. 
+            The weights and the posterior cubature variance are cached until the hyperparameters or the number of points change, 
+            so integrating further outputs observed at the same sampling locations costs one dot product. 
+
+        Args:
+            task (Union[int,torch.Tensor[T]]): task indices
+            n (Union[int,torch.Tensor[num_tasks]]): number of points at which to evaluate the weights, defaults to the current number of points
+            integrate_unit_cube (bool): if `True`, integrate over the unit cube, otherwise integrate over all reals
+
+        Returns:
+            weights (torch.Tensor[...,T,N]): weights against the outputs of all tasks concatenated along the last dimension, without the task dimension for an int task
+        """
+        if n is None: n = self.n
+        if isinstance(n,int): n = torch.tensor([n],dtype=int,device=self.device)
+        assert isinstance(n,torch.Tensor)
+        if task is None: task = self.default_task
+        inttask = isinstance(task,int)
+        if inttask: task = torch.tensor([task],dtype=int)
+        if isinstance(task,list): task = torch.tensor(task,dtype=int)
+        assert task.ndim==1 and (task>=0).all() and (task<self.num_tasks).all()
+        weights,_ = self.cubature_weights_cache(n,integrate_unit_cube)
+        return weights[...,task[0],:] if inttask else weights[...,task,:]
+    def post_cubature_mean(self, task:Union[int,torch.Tensor]=None, eval:bool=True, integrate_unit_cube:bool=True):
+        if eval:
+            incoming_grad_enabled = torch.is_grad_enabled()
+            torch.set_grad_enabled(False)
+        if task is None: task = self.default_task
+        inttask = isinstance(task,int)
+        if inttask: task = torch.tensor([task],dtype=int)
+        if isinstance(task,list): task = torch.tensor(task,dtype=int)
+        assert task.ndim==1 and (task>=0).all() and (task<self.num_tasks).all()
+        weights,_ = self.cubature_weights_cache(self.n,integrate_unit_cube)
+        pcmean = (weights[...,task,:]*torch.cat(self._y,dim=-1)[...,None,:]).sum(-1)
         if eval:
             torch.set_grad_enabled(incoming_grad_enabled)
         return pcmean[...,0] if inttask else pcmean
@@ -363,9 +653,6 @@ class StandardGP(AbstractGP):
         if n is None: n = self.n
         if isinstance(n,int): n = torch.tensor([n],dtype=int,device=self.device)
         assert isinstance(n,torch.Tensor)
-        kmat_tasks = self.gram_matrix_tasks
-        inv_log_det_cache = self.get_inv_log_det_cache(n)
-        thetainv = inv_log_det_cache()[0]
         if eval:
             incoming_grad_enabled = torch.is_grad_enabled()
             torch.set_grad_enabled(False)
@@ -374,17 +661,8 @@ class StandardGP(AbstractGP):
         if inttask: task = torch.tensor([task],dtype=int)
         if isinstance(task,list): task = torch.tensor(task,dtype=int)
         assert task.ndim==1 and (task>=0).all() and (task<self.num_tasks).all()
-        assert self.kernel_class=="gaussian", "so far, we have only worked out integrals for the Gaussian kernel"
-        norms = [torch.distributions.Normal(self.get_x(l,n=n[l]),torch.sqrt(self.lengthscales[...,None,:])) for l in range(self.num_tasks)]
-        lb,ub = (torch.tensor([0],device=self.device),torch.tensor([1],device=self.device)) if integrate_unit_cube else (torch.tensor([-torch.inf],device=self.device),torch.tensor([torch.inf],device=self.device))
-        kint_parts = [self.scale*(torch.sqrt(2*torch.pi*self.lengthscales[...,None,:])*(norms[l].cdf(ub)-norms[l].cdf(lb))).prod(-1) for l in range(self.num_tasks)]
-        kints = torch.cat([kmat_tasks[...,task,l,None]*kint_parts[l][...,None,:] for l in range(self.num_tasks)],dim=-1)
-        v = torch.einsum("...ij,...j->...i",thetainv,kints)
-        l_d = self.lengthscales+torch.zeros(self.d,device=self.device)
-        t = 2*(-1+torch.exp(-1/(2*l_d)))*l_d+torch.sqrt(2*np.pi*l_d)*torch.erf(1/torch.sqrt(2*l_d))
-        tval = self.scale*kmat_tasks[...,task,task]*t.prod(-1)[...,None]
-        pcvar = tval-(kints*v).sum(-1)
-        pcvar[pcvar<0] = 0.
+        _,pcvar = self.cubature_weights_cache(n,integrate_unit_cube)
+        pcvar = pcvar[...,task]
         if eval:
             torch.set_grad_enabled(incoming_grad_enabled)
         return pcvar[...,0] if inttask else pcvar
@@ -395,7 +673,6 @@ class StandardGP(AbstractGP):
         assert isinstance(n,torch.Tensor)
         kmat_tasks = self.gram_matrix_tasks
         inv_log_det_cache = self.get_inv_log_det_cache(n)
-        thetainv = inv_log_det_cache()[0]
         if eval:
             incoming_grad_enabled = torch.is_grad_enabled()
             torch.set_grad_enabled(False)
@@ -411,15 +688,10 @@ class StandardGP(AbstractGP):
         assert task1.ndim==1 and (task1>=0).all() and (task1<self.num_tasks).all()
         assert self.kernel_class=="gaussian", "so far, we have only worked out integrals for the Gaussian kernel"
         equal = torch.equal(task0,task1)
-        norms = [torch.distributions.Normal(self.get_x(l,n=n[l]),torch.sqrt(self.lengthscales[...,None,:])) for l in range(self.num_tasks)]
-        lb,ub = (torch.tensor([0],device=self.device),torch.tensor([1],device=self.device)) if integrate_unit_cube else (torch.tensor([-torch.inf],device=self.device),torch.tensor([torch.inf],device=self.device))
-        kint_parts = [self.scale*(torch.sqrt(2*torch.pi*self.lengthscales[...,None,:])*(norms[l].cdf(ub)-norms[l].cdf(lb))).prod(-1) for l in range(self.num_tasks)]
-        kints0 = torch.cat([kmat_tasks[...,task0,l,None]*kint_parts[l][...,None,:] for l in range(self.num_tasks)],dim=-1)
-        kints1 = torch.cat([kmat_tasks[...,task1,l,None]*kint_parts[l][...,None,:] for l in range(self.num_tasks)],dim=-1)
-        v = torch.einsum("...ij,...j->...i",thetainv,kints1)
-        l_d = self.lengthscales+torch.zeros(self.d,device=self.device)
-        t = 2*(-1+torch.exp(-1/(2*l_d)))*l_d+torch.sqrt(2*np.pi*l_d)*torch.erf(1/torch.sqrt(2*l_d))
-        tval = self.scale[...,None]*kmat_tasks[...,task0,:][...,:,task1]*t.prod(-1)[...,None,None]
+        kints0 = self._cubature_kints(kmat_tasks,task0,n,integrate_unit_cube)
+        kints1 = self._cubature_kints(kmat_tasks,task1,n,integrate_unit_cube)
+        v = inv_log_det_cache.gram_matrix_solve(kints1)
+        tval = self.scale[...,None]*kmat_tasks[...,task0,:][...,:,task1]*self._cubature_t()[...,None,None]
         pccov = tval-(kints0[...,:,None,:]*v[...,None,:,:]).sum(-1)
         if equal:
             tvec = torch.arange(pccov.size(-1))
@@ -1,7 +1,11 @@
 import torch 
 import os 
+import asyncio
+import itertools
+import warnings
 import numpy as np 
 import qmcpy as qp 
+from .profiler import _profiled,_cache_event
 
 class DummyDiscreteDistrib(qp.discrete_distribution.AbstractDiscreteDistribution):
     def __init__(self, x):
@@ -14,54 +18,173 @@ class DummyDiscreteDistrib(qp.discrete_distribution.AbstractDiscreteDistribution
         assert n_min==0 and n_max==self.n, "trying to generate samples other than the one provided is invalid"
         return self.x[None]
 
+_SNAPSHOT_VERSION = 1
+
+def _snapshot_state(obj):
+    if obj is None: return None
+    if isinstance(obj,np.ndarray): return [_snapshot_state(o) for o in obj]
+    return {name:(lambda v: v.item() if isinstance(v,np.generic) else v)(getattr(obj,name)) for name in obj._SNAPSHOT_ATTRS if hasattr(obj,name)}
+
+def _restore_state(obj, state):
+    if obj is None:
+        assert state is None
+        return
+    if isinstance(obj,np.ndarray):
+        assert len(obj)==len(state)
+        for o,s in zip(obj,state): _restore_state(o,s)
+        return
+    for name,value in state.items(): setattr(obj,name,value)
+    # restored values were computed with the current hyperparameters, so refreeze against them
+    if isinstance(obj,_LamCaches):
+        obj.raw_scale_freeze_list = [None]*len(obj.lam_list)
+        obj.raw_lengthscales_freeze_list = [None]*len(obj.lam_list)
+        obj.raw_noise_freeze_list = [None]*len(obj.lam_list)
+        for i in range(len(obj.lam_list)): obj._freeze(i)
+    elif hasattr(obj,"_freeze") and len(state)>0:
+        obj._freeze()
+
+_CACHE_CLOCK = itertools.count()
+
+def _cache_nbytes(obj, seen):
+    # bytes of the tensors held in the snapshot attributes of a cache, skipping storages already in seen
+    if isinstance(obj,torch.Tensor):
+        storage = obj.untyped_storage()
+        if storage.data_ptr() in seen: return 0
+        seen.add(storage.data_ptr())
+        return storage.nbytes()
+    if isinstance(obj,np.ndarray) and obj.dtype==object: obj = obj.ravel().tolist()
+    if isinstance(obj,(list,tuple)): return sum(_cache_nbytes(o,seen) for o in obj)
+    return sum(_cache_nbytes(getattr(obj,name),seen) for name in getattr(obj,"_SNAPSHOT_ATTRS",()) if hasattr(obj,name))
+
 class _XXbSeq(object):
+    _SNAPSHOT_ATTRS = ("x","xb","n")
     def __init__(self, fgp, seq):
         self.fgp = fgp
         self.seq = seq
         self.n = 0
         self.x = torch.empty((0,seq.d),device=self.fgp.device)
         self.xb = torch.empty((0,seq.d),dtype=self.fgp._XBDTYPE,device=self.fgp.device)
+        self.store_x = True
+        self.shared = None
+    @_profiled("xxb")
     def __getitem__(self, i):
         if isinstance(i,int): i = slice(None,i,None)
         if isinstance(i,torch.Tensor):
             assert i.numel()==1 and isinstance(i,torch.int64)
             i = slice(None,i.item(),None)
         assert isinstance(i,slice)
+        if i.stop>self.n and self.shared is not None and self.shared.n>self.n:
+            self.x,self.xb,self.n = self.shared.x,self.shared.xb,self.shared.n
         if i.stop>self.n:
+            _cache_event("xxb","miss")
             x_next,xb_next = self.fgp._sample(self.seq,self.n,i.stop)
             if x_next.data_ptr()==xb_next.data_ptr():
                 self.x = self.xb = torch.vstack([self.x,x_next])
-            else:
+            elif self.store_x:
                 self.x = torch.vstack([self.x,x_next])
                 self.xb = torch.vstack([self.xb,xb_next])
+            else:
+                self.xb = torch.vstack([self.xb,xb_next])
             self.n = i.stop
+            if self.shared is not None and self.n>self.shared.n:
+                self.shared.x,self.shared.xb,self.shared.n = self.x,self.xb,self.n
+        if not self.store_x and self.x.data_ptr()!=self.xb.data_ptr():
+            return self.fgp._convert_from_b(self.xb[i]),self.xb[i]
         return self.x[i],self.xb[i]
 
 class _K1PartsSeq(object):
-    def __init__(self, fgp, xxb_seq_first, xxb_seq_second, beta, kappa):
+    _SNAPSHOT_ATTRS = ("k1parts","n")
+    def __init__(self, fgp, xxb_seq_first, xxb_seq_second, beta, kappa, storage="full"):
         self.fgp = fgp
         self.xxb_seq_first = xxb_seq_first
         self.xxb_seq_second = xxb_seq_second
         assert beta.ndim==2 and beta.size(-1)==self.fgp.d and kappa.ndim==2 and kappa.size(-1)==self.fgp.d
         self.beta = beta 
         self.kappa = kappa
-        self.k1parts = torch.empty((0,len(self.beta),len(self.kappa),self.fgp.d),device=self.fgp.device)
+        assert storage in ["full","float32","recompute"], "storage must be in ['full','float32','recompute']"
+        self.storage = storage
+        # rows per chunk when recomputing parts, about 32 MB of float64 parts
+        self.chunk_size = max(1,2**22//(len(self.beta)*len(self.kappa)*self.fgp.d))
+        self.k1parts = torch.empty((0,len(self.beta),len(self.kappa),self.fgp.d),dtype=torch.float32 if storage=="float32" else torch.get_default_dtype(),device=self.fgp.device)
+        self.n = 0
+        self.last_used = next(_CACHE_CLOCK)
+        self.shared = None
+    def _evict(self):
+        # returns the bytes released
+        nbytes = _cache_nbytes(self.k1parts,set())
+        self.k1parts = self.k1parts[:0].clone()
         self.n = 0
+        return nbytes
+    @_profiled("k1parts")
     def __getitem__(self, i):
+        self.last_used = next(_CACHE_CLOCK)
         if isinstance(i,int): i = slice(None,i,None)
         if isinstance(i,torch.Tensor):
             assert i.numel()==1 and isinstance(i,torch.int64)
             i = slice(None,i.item(),None)
         assert isinstance(i,slice)
+        if self.storage=="recompute":
+            _cache_event("k1parts","recompute")
+            _,xb = self.xxb_seq_first[i]
+            _,xb0 = self.xxb_seq_second[:1]
+            return self.fgp._kernel_parts(xb,xb0,self.beta,self.kappa)
+        if i.stop>self.n and self.shared is not None and self.shared.n>self.n:
+            self.k1parts,self.n = self.shared.k1parts,self.shared.n
         if i.stop>self.n:
+            _cache_event("k1parts","miss")
             _,xb_next = self.xxb_seq_first[self.n:i.stop]
             _,xb0 = self.xxb_seq_second[:1]
             k1parts_next = self.fgp._kernel_parts(xb_next,xb0,self.beta,self.kappa)
-            self.k1parts = torch.cat([self.k1parts,k1parts_next],dim=0)
+            self.k1parts = torch.cat([self.k1parts,k1parts_next.to(self.k1parts.dtype)],dim=0)
             self.n = i.stop
-        return self.k1parts[i]
+            if self.shared is not None and self.n>self.shared.n:
+                self.shared.k1parts,self.shared.n = self.k1parts,self.n
+        return self.k1parts[i].to(torch.get_default_dtype())
+    def k1(self, start, stop, c0, c1):
+        # kernel column from the parts of points start through stop, recomputed in chunks when parts are not stored
+        if self.storage!="recompute":
+            return self.fgp._kernel_from_parts(self[start:stop],self.beta,self.kappa,c0,c1)
+        return torch.cat([self.fgp._kernel_from_parts(self[i:min(i+self.chunk_size,stop)],self.beta,self.kappa,c0,c1) for i in range(start,stop,self.chunk_size)],dim=-1)
+
+class _InterpSeq(object):
+    _SNAPSHOT_ATTRS = ("idx","weights","n")
+    def __init__(self, fgp, xxb_seq, xgrid, num_interp_points):
+        self.fgp = fgp
+        self.xxb_seq = xxb_seq
+        self.xgrid = xgrid
+        self.num_interp_points = num_interp_points
+        self.idx = torch.empty((0,num_interp_points),dtype=torch.int64,device=self.fgp.device)
+        self.weights = torch.empty((0,num_interp_points),device=self.fgp.device)
+        self.n = 0
+    def _interp_weights(self, xb):
+        # inverse squared distance weights on the nearest grid points in the periodic metric
+        block_size = max(1,2**22//(self.xgrid.numel()))
+        idxs,weights = [],[]
+        for i in range(0,len(xb),block_size):
+            delta = (xb[i:i+block_size,None,:]-self.xgrid[None,:,:])%1
+            dist2 = (torch.minimum(delta,1-delta)**2).sum(-1)
+            dist2,idx = dist2.topk(self.num_interp_points,dim=-1,largest=False)
+            exact = dist2==0
+            w = torch.where(exact.any(-1,keepdim=True),exact.to(dist2.dtype),1/torch.where(exact,1.,dist2))
+            idxs.append(idx)
+            weights.append(w/w.sum(-1,keepdim=True))
+        return torch.cat(idxs,dim=0),torch.cat(weights,dim=0)
+    def __getitem__(self, i):
+        if isinstance(i,int): i = slice(None,i,None)
+        if isinstance(i,torch.Tensor):
+            assert i.numel()==1 and isinstance(i,torch.int64)
+            i = slice(None,i.item(),None)
+        assert isinstance(i,slice)
+        if i.stop>self.n:
+            _,xb_next = self.xxb_seq[self.n:i.stop]
+            idx_next,weights_next = self._interp_weights(xb_next)
+            self.idx = torch.cat([self.idx,idx_next],dim=0)
+            self.weights = torch.cat([self.weights,weights_next],dim=0)
+            self.n = i.stop
+        return self.idx[i],self.weights[i]
 
 class _LamCaches(object):
+    _SNAPSHOT_ATTRS = ("lam_list","m_min","m_max")
     def __init__(self, fgp, l0, l1, beta0, beta1, c0, c1):
         self.fgp = fgp
         self.l0 = l0
@@ -78,6 +201,16 @@ class _LamCaches(object):
         self.raw_noise_freeze_list = [None]
         self._freeze(0)
         self.lam_list = [torch.empty(0,dtype=self.fgp._FTOUTDTYPE,device=self.fgp.device)]
+        self.last_used = next(_CACHE_CLOCK)
+    def _evict(self):
+        # drop the levels above m_min, which are only needed for a hypothetical n, and return the bytes released
+        nbytes = _cache_nbytes(self.lam_list[1:],set())
+        del self.lam_list[1:]
+        del self.raw_scale_freeze_list[1:]
+        del self.raw_lengthscales_freeze_list[1:]
+        del self.raw_noise_freeze_list[1:]
+        self.m_max = self.m_min
+        return nbytes
     def _frozen_equal(self, i):
         return (
             (self.fgp.raw_scale==self.raw_scale_freeze_list[i]).all() and 
@@ -92,6 +225,7 @@ class _LamCaches(object):
         self.raw_scale_freeze_list[i] = self.fgp.raw_scale.clone()
         self.raw_lengthscales_freeze_list[i] = self.fgp.raw_lengthscales.clone()
         self.raw_noise_freeze_list[i] = self.fgp.raw_noise.clone()
+    @_profiled("lam")
     def __getitem__no_delete(self, m):
         if isinstance(m,torch.Tensor):
             assert m.numel()==1 and isinstance(m,torch.int64)
@@ -99,18 +233,21 @@ class _LamCaches(object):
         assert isinstance(m,int)
         assert m>=self.m_min, "old lambda are not retained after updating"
         if self.m_min==-1 and m>=0:
-            k1 = self.fgp._kernel_from_parts(self.fgp.get_k1parts(self.l0,self.l1,n=2**m),self.beta0,self.beta1,self.c0,self.c1)
+            _cache_event("lam","miss")
+            k1 = self.fgp.k1parts_seq[self.l0,self.l1].k1(0,2**m,self.c0,self.c1)
             self.lam_list = [self.fgp.ft(k1)]
             self._freeze(0)
             self.m_min = self.m_max = m
             return self.lam_list[0]
         if m==self.m_min:
             if not self._frozen_equal(0) or self._force_recompile():
-                k1 = self.fgp._kernel_from_parts(self.fgp.k1parts_seq[self.l0,self.l1][:2**self.m_min],self.beta0,self.beta1,self.c0,self.c1)
+                _cache_event("lam","recompute")
+                k1 = self.fgp.k1parts_seq[self.l0,self.l1].k1(0,2**self.m_min,self.c0,self.c1)
                 self.lam_list[0] = self.fgp.ft(k1)
                 self._freeze(0)
             return self.lam_list[0]
-        if m>self.m_max:
+        extend = m>self.m_max
+        if extend:
             self.lam_list += [torch.empty(2**mm,dtype=self.fgp._FTOUTDTYPE,device=self.fgp.device) for mm in range(self.m_max+1,m+1)]
             self.raw_scale_freeze_list += [torch.empty_like(self.raw_scale_freeze_list[0])]*(m-self.m_max)
             self.raw_lengthscales_freeze_list += [torch.empty_like(self.raw_lengthscales_freeze_list[0])]*(m-self.m_max)
@@ -118,19 +255,21 @@ class _LamCaches(object):
             self.m_max = m
         midx = m-self.m_min
         if not self._frozen_equal(midx) or self._force_recompile():
+            _cache_event("lam","miss" if extend else "recompute")
             omega_m = self.fgp.get_omega(m-1)
-            k1_m = self.fgp._kernel_from_parts(self.fgp.k1parts_seq[self.l0,self.l1][2**(m-1):2**m],self.beta0,self.beta1,self.c0,self.c1)
+            k1_m = self.fgp.k1parts_seq[self.l0,self.l1].k1(2**(m-1),2**m,self.c0,self.c1)
             lam_m = self.fgp.ft(k1_m)
             omega_lam_m = omega_m*lam_m
             lam_m_prev = self.__getitem__no_delete(m-1)
             self.lam_list[midx] = torch.cat([lam_m_prev+omega_lam_m,lam_m_prev-omega_lam_m],-1)/np.sqrt(2)
             if os.environ.get("FASTGP_DEBUG")=="True":
-                k1_full = self.fgp._kernel_from_parts(self.fgp.k1parts_seq[self.l0,self.l1][:2**m],self.beta0,self.beta1,self.c0,self.c1)
+                k1_full = self.fgp.k1parts_seq[self.l0,self.l1].k1(0,2**m,self.c0,self.c1)
                 lam_full = self.fgp.ft(k1_full)
                 assert torch.allclose(self.lam_list[midx],lam_full,atol=1e-7,rtol=0)
             self._freeze(midx)
         return self.lam_list[midx]
     def __getitem__(self, m):
+        self.last_used = next(_CACHE_CLOCK)
         lam = self.__getitem__no_delete(m)
         while self.m_min<max(self.fgp.m[self.l0],self.fgp.m[self.l1]):
             del self.lam_list[0]
@@ -154,22 +293,28 @@ class _TaskCovCache(object):
     def _freeze(self):
         self.raw_factor_task_kernel_freeze = self.fgp.raw_factor_task_kernel.clone()
         self.raw_noise_task_kernel_freeze = self.fgp.raw_noise_task_kernel.clone()
+    @_profiled("task_cov")
     def __call__(self):
         if not hasattr(self,"kmat") or not self._frozen_equal() or self._force_recompile():
+            _cache_event("task_cov","recompute" if hasattr(self,"kmat") else "miss")
             self.kmat = torch.einsum("...il,...kl->...ik",self.fgp.factor_task_kernel,self.fgp.factor_task_kernel)
             self.kmat = self.kmat+self.fgp.noise_task_kernel[...,None]*torch.eye(self.fgp.num_tasks,device=self.fgp.device)
             self._freeze()
         return self.kmat
 
 class _YtildeCache(object):
+    _SNAPSHOT_ATTRS = ("ytilde","n")
     def __init__(self, fgp, l):
         self.fgp = fgp
         self.l = l
+    @_profiled("ytilde")
     def __call__(self):
         if not hasattr(self,"ytilde") or self.fgp.n[self.l]<=1:
+            _cache_event("ytilde","miss")
             self.ytilde = self.fgp.ft(self.fgp._y[self.l]) if self.fgp.n[self.l]>1 else self.fgp._y[self.l].clone().to(self.fgp._FTOUTDTYPE)
             self.n = self.fgp.n[self.l].item()
             return self.ytilde
+        if self.n!=self.fgp.n[self.l]: _cache_event("ytilde","miss")
         while self.n!=self.fgp.n[self.l]:
             n_double = 2*self.n
             ytilde_next = self.fgp.ft(self.fgp._y[self.l][...,self.n:n_double])
@@ -181,6 +326,13 @@ class _YtildeCache(object):
                 assert torch.allclose(self.ytilde,ytilde_ref,atol=1e-7,rtol=0)
             self.n = n_double
         return self.ytilde
+    def extend(self, y_new):
+        # append the transforms of new output columns, dropping the cache if it lags behind the data
+        if not hasattr(self,"ytilde"): return
+        if self.n!=self.fgp.n[self.l] or self.n<=1:
+            del self.ytilde
+            return
+        self.ytilde = torch.cat([self.ytilde,self.fgp.ft(y_new)],-2)
 
 class _AbstractInverseLogDetCache(object):
     def _frozen_equal(self):
@@ -203,38 +355,59 @@ class _AbstractInverseLogDetCache(object):
         self.raw_noise_freeze = self.fgp.raw_noise.clone()
         self.raw_factor_task_kernel_freeze = self.fgp.raw_factor_task_kernel.clone()
         self.raw_noise_task_kernel_freeze = self.fgp.raw_noise_task_kernel.clone()
+    def get_kfold_idx(self, folds):
+        assert (self.n==self.fgp.n).all(), "cross validation requires n equal to the current number of samples"
+        assert isinstance(folds,int) and folds>0 and (self.n%folds==0).all(), "folds must divide the number of samples for every task"
+        offsets = torch.hstack([torch.zeros(1,dtype=int,device=self.fgp.device),self.n.cumsum(0)[:-1]])
+        idx = torch.cat([(offsets[l]+torch.arange(self.n[l],device=self.fgp.device)).reshape(folds,-1) for l in range(self.fgp.num_tasks)],dim=-1)
+        return idx
+    def _get_kfold_residuals_logscores_dense(self, kmatinv, coeffs, idx):
+        kmatinv_folds = kmatinv[...,idx[:,:,None],idx[:,None,:]]
+        coeffs_folds = coeffs[...,idx]
+        residuals_folds = torch.linalg.solve(kmatinv_folds,coeffs_folds[...,None])[...,0]
+        logdet = torch.logdet(kmatinv_folds)
+        logscores = -1/2*((coeffs_folds*residuals_folds).sum(-1)-logdet+idx.size(1)*np.log(2*np.pi))
+        residuals = torch.empty_like(coeffs)
+        residuals[...,idx] = residuals_folds
+        return residuals,logscores
 
 class _StandardInverseLogDetCache(_AbstractInverseLogDetCache):
+    _SNAPSHOT_ATTRS = ("thetainv","logdet")
     def __init__(self, fgp, n):
         self.fgp = fgp
         self.n = n
+    def gram_matrix_cholesky(self):
+        kmat_tasks = self.fgp.gram_matrix_tasks
+        kmat_lower_tri = [[self.fgp._kernel(self.fgp.get_x(l0,self.n[l0])[:,None,:],self.fgp.get_x(l1,self.n[l1])[None,:,:],self.fgp.derivatives[l0],self.fgp.derivatives[l1],self.fgp.derivatives_coeffs[l0],self.fgp.derivatives_coeffs[l1]) for l1 in range(l0+1)] for l0 in range(self.fgp.num_tasks)]
+        if self.fgp.adaptive_nugget:
+            assert self.fgp.noise.size(-1)==1
+            n0range = torch.arange(self.n[0],device=self.fgp.device)
+            tr00 = kmat_lower_tri[0][0][...,n0range,n0range].sum(-1)
+        spd_factor = 1.
+        while True:
+            for l in range(self.fgp.num_tasks):
+                if self.fgp.adaptive_nugget:
+                    nlrange = torch.arange(self.n[l],device=self.fgp.device)
+                    trll = kmat_lower_tri[l][l][...,nlrange,nlrange].sum(-1)
+                    noise_l = self.fgp.noise[...,0]*trll/tr00
+                else:
+                    noise_l = self.fgp.noise[...,0]
+                kmat_lower_tri[l][l] = kmat_lower_tri[l][l]+spd_factor*noise_l[...,None,None]*torch.eye(self.n[l],device=self.fgp.device)
+            kmat_full = [[kmat_tasks[...,l0,l1,None,None]*(kmat_lower_tri[l0][l1] if l1<=l0 else kmat_lower_tri[l1][l0].transpose(dim0=-2,dim1=-1)) for l1 in range(self.fgp.num_tasks)] for l0 in range(self.fgp.num_tasks)]
+            kmat = torch.cat([torch.cat(kmat_full[l0],dim=-1) for l0 in range(self.fgp.num_tasks)],dim=-2)
+            try:
+                l_chol = torch.linalg.cholesky(kmat,upper=False)
+                break
+            except torch._C._LinAlgError as e:
+                expected_str = "linalg.cholesky: The factorization could not be completed because the input is not positive-definite"
+                if str(e)[:len(expected_str)]!=expected_str: raise
+                spd_factor *= 2#raise Exception("Cholesky factor not SPD, try increasing noise")
+        return l_chol
+    @_profiled("standard_inverse")
     def __call__(self):
         if not hasattr(self,"thetainv") or not self._frozen_equal() or self._force_recompile():
-            kmat_tasks = self.fgp.gram_matrix_tasks
-            kmat_lower_tri = [[self.fgp._kernel(self.fgp.get_x(l0,self.n[l0])[:,None,:],self.fgp.get_x(l1,self.n[l1])[None,:,:],self.fgp.derivatives[l0],self.fgp.derivatives[l1],self.fgp.derivatives_coeffs[l0],self.fgp.derivatives_coeffs[l1]) for l1 in range(l0+1)] for l0 in range(self.fgp.num_tasks)]
-            if self.fgp.adaptive_nugget:
-                assert self.fgp.noise.size(-1)==1
-                n0range = torch.arange(self.n[0],device=self.fgp.device)
-                tr00 = kmat_lower_tri[0][0][...,n0range,n0range].sum(-1)
-            spd_factor = 1.
-            while True:
-                for l in range(self.fgp.num_tasks):
-                    if self.fgp.adaptive_nugget:
-                        nlrange = torch.arange(self.n[l],device=self.fgp.device)
-                        trll = kmat_lower_tri[l][l][...,nlrange,nlrange].sum(-1)
-                        noise_l = self.fgp.noise[...,0]*trll/tr00
-                    else:
-                        noise_l = self.fgp.noise[...,0]
-                    kmat_lower_tri[l][l] = kmat_lower_tri[l][l]+spd_factor*noise_l[...,None,None]*torch.eye(self.n[l],device=self.fgp.device)
-                kmat_full = [[kmat_tasks[...,l0,l1,None,None]*(kmat_lower_tri[l0][l1] if l1<=l0 else kmat_lower_tri[l1][l0].transpose(dim0=-2,dim1=-1)) for l1 in range(self.fgp.num_tasks)] for l0 in range(self.fgp.num_tasks)]
-                kmat = torch.cat([torch.cat(kmat_full[l0],dim=-1) for l0 in range(self.fgp.num_tasks)],dim=-2)
-                try:
-                    l_chol = torch.linalg.cholesky(kmat,upper=False)
-                    break
-                except torch._C._LinAlgError as e:
-                    expected_str = "linalg.cholesky: The factorization could not be completed because the input is not positive-definite"
-                    if str(e)[:len(expected_str)]!=expected_str: raise
-                    spd_factor *= 2#raise Exception("Cholesky factor not SPD, try increasing noise")
+            _cache_event("standard_inverse","recompute" if hasattr(self,"thetainv") else "miss")
+            l_chol = self.gram_matrix_cholesky()
             nfrange = torch.arange(self.n.sum(),device=self.fgp.device)
             self.logdet = 2*torch.log(l_chol[...,nfrange,nfrange]).sum(-1)
             self.thetainv = torch.cholesky_inverse(l_chol,upper=False)
@@ -265,15 +438,87 @@ class _StandardInverseLogDetCache(_AbstractInverseLogDetCache):
         nrange = torch.arange(thetainv.size(-1),device=self.fgp.device)
         inv_diag = thetainv[...,nrange,nrange]
         return inv_diag
+    def get_kfold_residuals_logscores(self, folds, coeffs=None):
+        idx = self.get_kfold_idx(folds)
+        if coeffs is None: coeffs = self.fgp.coeffs
+        thetainv,logdet = self()
+        return self._get_kfold_residuals_logscores_dense(thetainv,coeffs,idx)
     
+class _KroneckerInverseLogDetCache(_AbstractInverseLogDetCache):
+    _SNAPSHOT_ATTRS = ("evecs","lam","logdet")
+    def __init__(self, fgp, n):
+        self.fgp = fgp
+        self.n = n
+        assert (self.n==self.fgp.n).all(), "grid GPs do not support evaluating at more than the current grid"
+    @_profiled("kronecker_inverse")
+    def __call__(self):
+        if not hasattr(self,"lam") or not self._frozen_equal() or self._force_recompile():
+            _cache_event("kronecker_inverse","recompute" if hasattr(self,"lam") else "miss")
+            self.evecs = []
+            lam = torch.ones(1,device=self.fgp.device)
+            for j in range(self.fgp.d):
+                evals_j,evecs_j = torch.linalg.eigh(self.fgp._kernel_grid_axis(j))
+                self.evecs.append(evecs_j)
+                lam = (lam[...,:,None]*evals_j[...,None,:]).flatten(-2)
+            self.lam = self.fgp.scale*lam.clamp(min=0)+self.fgp.noise
+            self.logdet = torch.log(self.lam).sum(-1)
+            self._freeze()
+        return self.evecs,self.lam,self.logdet
+    def _kron_mv(self, mats, v):
+        # apply the Kronecker product of the per axis matrices to the last dimension of v
+        d = len(mats)
+        v = v.reshape(v.shape[:-1]+tuple(mat.size(-1) for mat in mats))
+        for j in range(d):
+            mat = mats[j].reshape(mats[j].shape[:-2]+(1,)*(d-1)+mats[j].shape[-2:])
+            v = (mat@v.movedim(j-d,-1)[...,None])[...,0].movedim(-1,j-d)
+        return v.flatten(-d)
+    def gram_matrix_solve(self, y):
+        assert y.size(-1)==self.n.sum()
+        evecs,lam,logdet = self()
+        return self._kron_mv(evecs,self._kron_mv([q.transpose(-2,-1) for q in evecs],y)/lam)
+    def get_norm_term_logdet_term(self):
+        y = torch.cat(self.fgp._y,dim=-1)
+        evecs,lam,logdet = self()
+        v = self.gram_matrix_solve(y)
+        norm_term = (y*v).sum(-1,keepdim=True)
+        return norm_term,logdet[...,None]
+    def get_gcv_numer_denom(self):
+        y = torch.cat(self.fgp._y,dim=-1)
+        evecs,lam,logdet = self()
+        v = self.gram_matrix_solve(y)
+        numer = (v**2).sum(-1,keepdim=True)
+        tr_k_inv = (1/lam).sum(-1,keepdim=True)
+        denom = (tr_k_inv/lam.size(-1))**2
+        return numer,denom
+    def get_inv_diag(self):
+        evecs,lam,logdet = self()
+        return self._kron_mv([q**2 for q in evecs],1/lam)
+    def gram_matrix_cholesky(self):
+        evecs,lam,logdet = self()
+        nsum = self.n.sum()
+        eye = torch.eye(nsum,device=self.fgp.device).reshape([nsum]+[1]*(lam.ndim-1)+[nsum])
+        kmat = self._kron_mv(evecs,self._kron_mv([q.transpose(-2,-1) for q in evecs],eye)*lam)
+        return torch.linalg.cholesky(torch.movedim(kmat,0,-2))
+    def get_kfold_residuals_logscores(self, folds, coeffs=None):
+        idx = self.get_kfold_idx(folds)
+        if coeffs is None: coeffs = self.fgp.coeffs
+        evecs,lam,logdet = self()
+        nsum = self.n.sum()
+        eye = torch.eye(nsum,device=self.fgp.device).reshape([nsum]+[1]*(lam.ndim-1)+[nsum])
+        kmatinv = torch.movedim(self.gram_matrix_solve(eye),0,-2)
+        return self._get_kfold_residuals_logscores_dense(kmatinv,coeffs,idx)
+
 class _FastInverseLogDetCache(_AbstractInverseLogDetCache):
+    _SNAPSHOT_ATTRS = ("inv","logdet")
     def __init__(self, fgp, n):
         self.fgp = fgp
         self.n = n
         self.task_order = self.n.argsort(descending=True)
         self.inv_task_order = self.task_order.argsort()
+    @_profiled("fast_inverse")
     def __call__(self):
         if not hasattr(self,"inv") or not self._frozen_equal() or self._force_recompile():
+            _cache_event("fast_inverse","recompute" if hasattr(self,"inv") else "miss")
             n = self.n[self.task_order]
             kmat_tasks = self.fgp.gram_matrix_tasks
             lams = np.empty((self.fgp.num_tasks,self.fgp.num_tasks),dtype=object)
@@ -392,8 +637,31 @@ class _FastInverseLogDetCache(_AbstractInverseLogDetCache):
             nrange = torch.arange(kmatinv.size(-1),device=self.fgp.device)
             inv_diag = kmatinv[...,nrange,nrange]
         return inv_diag
+    def get_kfold_residuals_logscores(self, folds, coeffs=None):
+        idx = self.get_kfold_idx(folds)
+        if coeffs is None: coeffs = self.fgp.coeffs
+        inv,logdet = self()
+        nsum = self.n.sum()
+        if self.fgp.num_tasks==1:
+            # folds are cosets of the first n/folds points, so every diagonal block of the inverse Gram matrix 
+            # is the same matrix which is diagonalized by the fast transform of length n/folds
+            m = nsum.item()//folds
+            e0 = torch.zeros(nsum,device=self.fgp.device)
+            e0[0] = 1.
+            kinv = self.gram_matrix_solve(e0)
+            mu = (np.sqrt(m)*self.fgp.ft(kinv[...,:m])).real if m>1 else kinv[...,:m]
+            coeffs_folds = coeffs.reshape(coeffs.shape[:-1]+torch.Size([folds,m]))
+            residuals_folds = self.fgp.ift(self.fgp.ft(coeffs_folds)/mu[...,None,:]).real if m>1 else coeffs_folds/mu[...,None,:]
+            logscores = -1/2*((coeffs_folds*residuals_folds).sum(-1)-torch.log(mu).sum(-1,keepdim=True)+m*np.log(2*np.pi))
+            residuals = residuals_folds.reshape(coeffs.shape)
+        else:
+            eye = torch.eye(nsum,device=self.fgp.device).reshape([nsum]+[1]*(inv.ndim-3)+[nsum])
+            kmatinv = self.gram_matrix_solve(eye).permute([1+i for i in range(inv.ndim-3)]+[0,-1])
+            residuals,logscores = self._get_kfold_residuals_logscores_dense(kmatinv,coeffs,idx)
+        return residuals,logscores
 
 class _CoeffsCache(object):
+    _SNAPSHOT_ATTRS = ("coeffs","n")
     def __init__(self, fgp):
         self.fgp = fgp
     def _frozen_equal(self):
@@ -416,10 +684,198 @@ class _CoeffsCache(object):
         self.raw_noise_freeze = self.fgp.raw_noise.clone()
         self.raw_factor_task_kernel_freeze = self.fgp.raw_factor_task_kernel.clone()
         self.raw_noise_task_kernel_freeze = self.fgp.raw_noise_task_kernel.clone()
+    @_profiled("coeffs")
     def __call__(self):
         if not hasattr(self,"coeffs") or (self.n!=self.fgp.n).any() or not self._frozen_equal() or self._force_recompile():
+            _cache_event("coeffs","miss" if not hasattr(self,"coeffs") or (self.n!=self.fgp.n).any() else "recompute")
             inv_log_det_cache = self.fgp.get_inv_log_det_cache()
             self.coeffs = inv_log_det_cache.gram_matrix_solve(torch.cat(self.fgp._y,dim=-1))
             self._freeze()
             self.n = self.fgp.n.clone()
-        return self.coeffs  
\ No newline at end of file
+        return self.coeffs
+    def extend(self, y_new):
+        # append the coefficients of new output columns when the cached coefficients are current
+        if not hasattr(self,"coeffs") or (self.n!=self.fgp.n).any() or not self._frozen_equal(): return
+        with torch.set_grad_enabled(self.coeffs.requires_grad):
+            coeffs_new = self.fgp.get_inv_log_det_cache().gram_matrix_solve(torch.cat(y_new,dim=-1))
+        self.coeffs = torch.cat([self.coeffs,coeffs_new],-2)
+
+class _CubatureWeightsCache(_CoeffsCache):
+    _SNAPSHOT_ATTRS = ("weights","pcvar","n","integrate_unit_cube")
+    def _stale_grad(self):
+        # weights computed without gradient tracking cannot serve a call which needs gradients
+        return torch.is_grad_enabled() and not self.weights.requires_grad and any(p.requires_grad for p in self.fgp.parameters())
+    @_profiled("cubature_weights")
+    def __call__(self, n, integrate_unit_cube):
+        if not hasattr(self,"weights") or (self.n!=n).any() or self.integrate_unit_cube!=integrate_unit_cube or not self._frozen_equal() or self._force_recompile() or self._stale_grad():
+            _cache_event("cubature_weights","recompute" if hasattr(self,"weights") and (self.n==n).all() and self.integrate_unit_cube==integrate_unit_cube else "miss")
+            task = torch.arange(self.fgp.num_tasks,device=self.fgp.device)
+            kmat_tasks = self.fgp.gram_matrix_tasks
+            kints = self.fgp._cubature_kints(kmat_tasks,task,n,integrate_unit_cube)
+            self.weights = self.fgp.get_inv_log_det_cache(n).gram_matrix_solve(kints)
+            if integrate_unit_cube:
+                tval = self.fgp.scale*kmat_tasks[...,task,task]*self.fgp._cubature_t()[...,None]
+                self.pcvar = (tval-(kints*self.weights).sum(-1)).clamp_min(0.)
+            else:
+                self.pcvar = None
+            self._freeze()
+            self.n = n.clone()
+            self.integrate_unit_cube = integrate_unit_cube
+        return self.weights,self.pcvar
+
+class _CoeffsTildeCache(object):
+    def __init__(self, fgp):
+        self.fgp = fgp
+    def __call__(self):
+        coeffs = self.fgp.coeffs
+        if not hasattr(self,"ctildes") or self.coeffs is not coeffs:
+            coeffs_split = coeffs.split(self.fgp.n.tolist(),-1)
+            self.ctildes = [self.fgp.ft(coeffs_split[l]) if self.fgp.n[l]>1 else coeffs_split[l].clone().to(self.fgp._FTOUTDTYPE) for l in range(self.fgp.num_tasks)]
+            self.coeffs = coeffs
+        return self.ctildes  
+    def extend(self, coeffs_old, num_new):
+        # append the transforms of the last num_new coefficient columns when the cache matches coeffs_old
+        coeffs = getattr(self.fgp.coeffs_cache,"coeffs",None)
+        if not hasattr(self,"ctildes") or self.coeffs is not coeffs_old or coeffs is None or coeffs is coeffs_old: return
+        coeffs_split = coeffs[...,-num_new:,:].split(self.fgp.n.tolist(),-1)
+        self.ctildes = [torch.cat([self.ctildes[l],self.fgp.ft(coeffs_split[l]) if self.fgp.n[l]>1 else coeffs_split[l].clone().to(self.fgp._FTOUTDTYPE)],-2) for l in range(self.fgp.num_tasks)]
+        self.coeffs = coeffs
+
+class _InterpolatedInverseLogDetCache(_AbstractInverseLogDetCache):
+    _SNAPSHOT_ATTRS = ("lam",)
+    def __init__(self, fgp, n):
+        self.fgp = fgp
+        self.n = n
+        self.idx,self.weights = self.fgp.interp_seq[:self.n[0]]
+        self.probes = 2.*torch.randint(0,2,(self.fgp.num_probes,self.n[0].item()),generator=torch.Generator().manual_seed(self.fgp.seed_for_probes)).to(self.fgp.device)-1.
+    @_profiled("interpolated_inverse")
+    def __call__(self):
+        if not hasattr(self,"lam") or not self._frozen_equal() or self._force_recompile():
+            _cache_event("interpolated_inverse","recompute" if hasattr(self,"lam") else "miss")
+            beta = self.fgp.derivatives[0]
+            c = self.fgp.derivatives_coeffs[0]
+            k1 = self.fgp._kernel(self.fgp.xgrid,self.fgp.xgrid[:1],beta,beta,c,c)
+            self.lam = np.sqrt(self.fgp.n_grid)*self.fgp.ft(k1)
+            self._freeze()
+        return self.lam
+    def matvec(self, v):
+        lam = self()
+        u = torch.zeros(v.shape[:-1]+(self.fgp.n_grid,),dtype=v.dtype,device=self.fgp.device).index_add(-1,self.idx.flatten(),(v[...,None]*self.weights).flatten(-2))
+        u = self.fgp.ift(lam*self.fgp.ft(u)).real
+        return (u[...,self.idx]*self.weights).sum(-1)+self.fgp.noise*v
+    def _cg(self, b, lanczos=False):
+        lam = self()
+        b = b.expand(torch.broadcast_shapes(b.shape,lam.shape[:-1]+(1,),self.fgp.noise.shape))
+        x = torch.zeros_like(b)
+        r = b.clone()
+        p = r.clone()
+        rs = (r*r).sum(-1,keepdim=True)
+        tol = self.fgp.cg_tol*torch.sqrt(rs)
+        alphas,betas,actives = [],[],[]
+        for i in range(self.fgp.cg_max_iters):
+            active = torch.sqrt(rs)>tol
+            if not active.any(): break
+            Ap = self.matvec(p)
+            pAp = (p*Ap).sum(-1,keepdim=True)
+            alpha = torch.where(active,rs/torch.where(active,pAp,1.),0.)
+            x = x+alpha*p
+            r = r-alpha*Ap
+            rs_next = (r*r).sum(-1,keepdim=True)
+            beta = torch.where(active,rs_next/torch.where(active,rs,1.),0.)
+            p = r+beta*p
+            rs = torch.where(active,rs_next,rs)
+            if lanczos:
+                alphas.append(alpha[...,0])
+                betas.append(beta[...,0])
+                actives.append(active[...,0])
+        if (torch.sqrt(rs)>tol).any():
+            relres = (torch.sqrt(rs)/torch.where(tol>0,tol,1.)).max().item()*self.fgp.cg_tol
+            warnings.warn("conjugate gradients did not converge in cg_max_iters=%d iterations, the largest relative residual is %.1e with cg_tol=%.1e"%(self.fgp.cg_max_iters,relres,self.fgp.cg_tol))
+        if not lanczos: return x
+        return x,self._lanczos_logdet_quad(torch.stack(alphas,-1),torch.stack(betas,-1),torch.stack(actives,-1))
+    def _lanczos_logdet_quad(self, alpha, beta, active):
+        # e_1^T log(T) e_1 for the Lanczos tridiagonal matrix T recovered from the CG coefficients
+        alpha_safe = torch.where(active,alpha,1.)
+        beta_prev = torch.cat([torch.zeros_like(beta[...,:1]),beta[...,:-1]],-1)
+        alpha_prev = torch.cat([torch.ones_like(alpha_safe[...,:1]),alpha_safe[...,:-1]],-1)
+        diag = torch.where(active,1/alpha_safe+beta_prev/alpha_prev,1.)
+        off = torch.where(active[...,:-1]&active[...,1:],torch.sqrt(beta[...,:-1].clamp(min=0))/alpha_safe[...,:-1],0.)
+        tmat = torch.diag_embed(diag)+torch.diag_embed(off,offset=1)+torch.diag_embed(off,offset=-1)
+        evals,evecs = torch.linalg.eigh(tmat)
+        return (evecs[...,0,:]**2*torch.log(evals.clamp(min=1e-300))).sum(-1)
+    def gram_matrix_solve(self, y):
+        assert y.size(-1)==self.n.sum()
+        return self._cg(y)
+    def get_norm_term_logdet_term(self):
+        y = self.fgp._y[0]
+        z = self.probes.reshape((self.probes.size(0),)+(1,)*(y.ndim-1)+(self.probes.size(-1),))
+        with torch.no_grad():
+            c = self._cg(y)
+            u,quad = self._cg(z,lanczos=True)
+            logdet_slq = self.n[0].item()*quad.mean(0)
+        # surrogates whose values are the solves above and whose gradients are the exact and Hutchinson estimated derivatives
+        norm_term = 2*(c*y).sum(-1)-(c*self.matvec(c)).sum(-1)
+        logdet_grad = (u*self.matvec(z)).sum(-1).mean(0)
+        logdet = logdet_slq+logdet_grad-logdet_grad.detach()
+        return norm_term[...,None],logdet[...,None]
+
+class _DesignStream(object):
+    def __init__(self, fgp, max_n, batch_size, task, max_pending):
+        self.fgp = fgp
+        self.max_n = max_n
+        self.batch_size = batch_size
+        self.task = task
+        self.max_pending = max_pending
+        self.next_idx = self.fgp.n[self.task].item()
+        self.pending = 0
+        self.results = {}
+        self.condition = None
+    def _get_condition(self):
+        # created lazily so the condition binds to the running event loop
+        if self.condition is None: self.condition = asyncio.Condition()
+        return self.condition
+    def __aiter__(self):
+        return self._stream()
+    async def _stream(self):
+        condition = self._get_condition()
+        while self.next_idx<self.max_n:
+            if self.max_pending is not None:
+                async with condition:
+                    await condition.wait_for(lambda: self.pending<self.max_pending)
+            start = self.next_idx
+            stop = min(start+self.batch_size,self.max_n)
+            # sequences are generated in power of 2 blocks, so slice the batch out of the enclosing block
+            x,_ = self.fgp.xxb_seqs[self.task][:2**int(np.ceil(np.log2(stop)))]
+            x = x[start:stop]
+            self.next_idx = stop
+            self.pending += stop-start
+            yield start,x.clone()
+    async def put(self, idx, y):
+        assert isinstance(y,torch.Tensor) and y.shape[:-1]==self.fgp.shape_batch
+        assert idx not in self.results and self.fgp.n[self.task]<=idx<self.next_idx, "idx must be the start index of a handed out batch which has not been put"
+        condition = self._get_condition()
+        async with condition:
+            self.results[idx] = y
+            self.pending -= y.size(-1)
+            self._flush()
+            condition.notify_all()
+    def _flush(self):
+        n = self.fgp.n[self.task].item()
+        end,chunks = n,[]
+        while end in self.results:
+            chunks.append(self.results[end])
+            end += chunks[-1].size(-1)
+        if end==n: return
+        p = 2**int(np.floor(np.log2(end)))
+        if p<=n: return
+        for chunk in chunks: del self.results[n]; n += chunk.size(-1)
+        y = torch.cat(chunks,dim=-1)
+        n = self.fgp.n[self.task].item()
+        if p<end: self.results[p] = y[...,(p-n):]
+        self.fgp.add_y_next(y[...,:(p-n)],task=self.task)
+        self.fgp.get_ytilde(self.task)
+    async def wait(self, n=None):
+        if n is None: n = self.max_n
+        condition = self._get_condition()
+        async with condition:
+            await condition.wait_for(lambda: self.fgp.n[self.task]>=n)